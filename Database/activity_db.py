@@ -0,0 +1,457 @@
+import pymongo
+import re
+from exceptions import DatabaseError, NotFoundError, DuplicateError, ValidationError, CapacityError
+from pymongo.errors import DuplicateKeyError
+from typing import Optional, List, Dict, Any, Tuple
+from Database.projection import build_projection
+import datetime
+
+# Akış sorgularında bir sayfadaki en fazla aktivite
+ACTIVITY_FEED_MAX_LIMIT = 100
+# Yakındaki aktiviteler aramasında izin verilen en büyük yarıçap (metre)
+NEARBY_MAX_DISTANCE_M = 50_000
+
+
+def to_utc_datetime(value: str) -> datetime.datetime:
+    """
+    ISO formatındaki activity_date değerini saat dilimi bilgisi olmayan UTC datetime'a çevirir.
+    Saat dilimi belirtilmemiş tarihler UTC kabul edilir.
+    """
+    parsed = datetime.datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def to_geo_point(latitude: Optional[float], longitude: Optional[float]) -> Optional[Dict[str, Any]]:
+    """
+    Koordinatları 2dsphere indeksine uygun GeoJSON Point'e çevirir (GeoJSON sırası: boylam, enlem)
+    """
+    if latitude is None or longitude is None:
+        return None
+    return {"type": "Point", "coordinates": [longitude, latitude]}
+
+
+def encode_cursor(activity: Dict[str, Any]) -> str:
+    return f"{activity['activity_at'].isoformat()}|{activity['activity_id']}"
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime.datetime, str]:
+    try:
+        activity_at, activity_id = cursor.split("|", 1)
+        return datetime.datetime.fromisoformat(activity_at), activity_id
+    except ValueError:
+        raise ValidationError("Geçersiz imleç")
+
+
+def encode_distance_cursor(activity: Dict[str, Any]) -> str:
+    return f"{activity['distance_m']!r}|{activity['activity_id']}"
+
+
+def decode_distance_cursor(cursor: str) -> Tuple[float, str]:
+    try:
+        distance, activity_id = cursor.split("|", 1)
+        return float(distance), activity_id
+    except ValueError:
+        raise ValidationError("Geçersiz imleç")
+
+
+class ActivityDB:
+    """
+    Aktivite koleksiyonu ve akış sorguları.
+
+    activity_date istemciye ISO string olarak döner; sıralama ve aralık filtreleri
+    için ayrıca UTC datetime olarak activity_at alanı tutulur. Sayfalama
+    (activity_at, activity_id) imleciyle yapılır, böylece skip kullanılmaz.
+    """
+
+    def __init__(self, db):
+        self.activities = db["activities"]
+        self.activities.create_index([("activity_id", pymongo.ASCENDING)], unique=True)
+        self.activities.create_index([("activity_at", pymongo.ASCENDING), ("activity_id", pymongo.ASCENDING)])
+        self.activities.create_index([("participants", pymongo.ASCENDING), ("activity_at", pymongo.ASCENDING)])
+        self.activities.create_index([("creator_id", pymongo.ASCENDING), ("activity_at", pymongo.ASCENDING)])
+        self.activities.create_index([("location", pymongo.ASCENDING), ("activity_at", pymongo.ASCENDING)])
+        # Koordinatı olmayan aktiviteler 2dsphere indeksine girmez
+        self.activities.create_index([("geo", pymongo.GEOSPHERE), ("activity_at", pymongo.ASCENDING)])
+
+        # Sona ermiş aktivitelerin taşındığı soğuk koleksiyon
+        self.archive = db["activities_archive"]
+        self.archive.create_index([("activity_id", pymongo.ASCENDING)], unique=True)
+        self.archive.create_index([("participants", pymongo.ASCENDING), ("activity_at", pymongo.DESCENDING)])
+
+    @staticmethod
+    def _prepare_for_write(data: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Yazmadan önce türetilmiş alanları (activity_at, geo) hesaplar.
+        Döndürülen sözlük $unset edilmesi gereken alanları içerir.
+        """
+        unset = {}
+        if "activity_date" in data:
+            data["activity_at"] = to_utc_datetime(data["activity_date"])
+            # Tarih değişirse hatırlatma yeniden gönderilir
+            data["reminder_sent"] = False
+        if "latitude" in data or "longitude" in data:
+            geo = to_geo_point(data.get("latitude"), data.get("longitude"))
+            if geo:
+                data["geo"] = geo
+            else:
+                data.pop("geo", None)
+                unset["geo"] = ""
+        return unset
+
+    def get_all_activities(self, fields: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        try:
+            return list(self.activities.find({}, build_projection(fields)))
+        except Exception as e:
+            raise DatabaseError(f"Aktiviteler getirilirken hata oluştu: {str(e)}")
+
+    def get_activity_by_id(self, activity_id: str, fields: Optional[List[str]] = None) -> Optional[Dict[str, Any]]:
+        try:
+            return self.activities.find_one({"activity_id": activity_id}, build_projection(fields))
+        except Exception as e:
+            raise DatabaseError(f"Aktivite getirilirken hata oluştu: {str(e)}")
+
+    def insert_activity(self, activity_data: Dict[str, Any]) -> None:
+        try:
+            self._prepare_for_write(activity_data)
+            # version/updated_at her değişiklikte güncellenir; HTTP ETag/Last-Modified bunlardan türetilir
+            activity_data["version"] = 1
+            activity_data["updated_at"] = datetime.datetime.utcnow()
+            self.activities.insert_one(activity_data)
+        except DuplicateKeyError:
+            raise DuplicateError("Bu aktivite zaten mevcut")
+        except Exception as e:
+            raise DatabaseError(f"Aktivite eklenirken hata oluştu: {str(e)}")
+
+    def update_activity(self, activity_id: str, update_data: Dict[str, Any]) -> bool:
+        try:
+            update = {"$set": update_data, "$inc": {"version": 1}}
+            unset = self._prepare_for_write(update_data)
+            update_data["updated_at"] = datetime.datetime.utcnow()
+            if unset:
+                update["$unset"] = unset
+            result = self.activities.update_one({"activity_id": activity_id}, update)
+            if result.matched_count == 0:
+                raise NotFoundError("Güncellenecek aktivite bulunamadı")
+            return True
+        except NotFoundError:
+            raise
+        except Exception as e:
+            raise DatabaseError(f"Aktivite güncellenirken hata oluştu: {str(e)}")
+
+    def delete_activity(self, activity_id: str) -> bool:
+        try:
+            result = self.activities.delete_one({"activity_id": activity_id})
+            if result.deleted_count == 0:
+                raise NotFoundError("Silinecek aktivite bulunamadı")
+            return True
+        except NotFoundError:
+            raise
+        except Exception as e:
+            raise DatabaseError(f"Aktivite silinirken hata oluştu: {str(e)}")
+
+    def join_activity(self, activity_id: str, user_id: str) -> Dict[str, Any]:
+        """
+        Kullanıcıyı kapasite kontrolüyle birlikte tek atomik işlemde katılımcılara ekler.
+        Eşzamanlı katılımlarda max_participants aşılamaz.
+        """
+        try:
+            activity = self.activities.find_one_and_update(
+                {
+                    "activity_id": activity_id,
+                    "participants": {"$ne": user_id},
+                    "$expr": {"$lt": [{"$size": "$participants"}, "$max_participants"]}
+                },
+                {
+                    "$addToSet": {"participants": user_id},
+                    "$inc": {"version": 1},
+                    "$set": {"updated_at": datetime.datetime.utcnow()}
+                },
+                projection={"_id": 0, "activity_id": 1, "participants": 1, "max_participants": 1},
+                return_document=pymongo.ReturnDocument.AFTER
+            )
+            if activity:
+                return activity
+
+            # Güncelleme olmadıysa nedenini belirle
+            existing = self.get_activity_by_id(activity_id, fields=["participants"])
+            if not existing:
+                raise NotFoundError("Aktivite bulunamadı")
+            if user_id in existing.get("participants", []):
+                raise DuplicateError("Bu aktiviteye zaten katılıyorsunuz")
+            raise CapacityError("Aktivitenin katılımcı kapasitesi dolu")
+        except (NotFoundError, DuplicateError, CapacityError):
+            raise
+        except Exception as e:
+            raise DatabaseError(f"Aktiviteye katılırken hata oluştu: {str(e)}")
+
+    def leave_activity(self, activity_id: str, user_id: str) -> Dict[str, Any]:
+        """
+        Kullanıcıyı katılımcılardan tek atomik işlemde çıkarır. Oluşturan kullanıcı ayrılamaz.
+        """
+        try:
+            activity = self.activities.find_one_and_update(
+                {"activity_id": activity_id, "participants": user_id, "creator_id": {"$ne": user_id}},
+                {
+                    "$pull": {"participants": user_id},
+                    "$inc": {"version": 1},
+                    "$set": {"updated_at": datetime.datetime.utcnow()}
+                },
+                projection={"_id": 0, "activity_id": 1, "participants": 1, "max_participants": 1},
+                return_document=pymongo.ReturnDocument.AFTER
+            )
+            if activity:
+                return activity
+
+            existing = self.get_activity_by_id(activity_id, fields=["participants", "creator_id"])
+            if not existing:
+                raise NotFoundError("Aktivite bulunamadı")
+            if existing.get("creator_id") == user_id:
+                raise ValidationError("Aktiviteyi oluşturan kullanıcı aktiviteden ayrılamaz")
+            raise NotFoundError("Bu aktiviteye katılmıyorsunuz")
+        except (NotFoundError, ValidationError):
+            raise
+        except Exception as e:
+            raise DatabaseError(f"Aktiviteden ayrılırken hata oluştu: {str(e)}")
+
+    def update_activity_details(self, activity_id: str, update_data: Dict[str, Any]) -> bool:
+        """
+        Katılımcı listesine dokunmadan aktiviteyi günceller. Yeni max_participants
+        mevcut katılımcı sayısından az olamaz; kontrol güncellemeyle aynı işlemde yapılır.
+        """
+        try:
+            update_data = {key: value for key, value in update_data.items() if key != "participants"}
+            update = {"$set": update_data, "$inc": {"version": 1}}
+            unset = self._prepare_for_write(update_data)
+            update_data["updated_at"] = datetime.datetime.utcnow()
+            if unset:
+                update["$unset"] = unset
+            query = {"activity_id": activity_id}
+            if "max_participants" in update_data:
+                query["$expr"] = {"$lte": [{"$size": "$participants"}, update_data["max_participants"]]}
+            result = self.activities.update_one(query, update)
+            if result.matched_count == 0:
+                if self.get_activity_by_id(activity_id, fields=["activity_id"]):
+                    raise CapacityError("Maksimum katılımcı sayısı mevcut katılımcı sayısından az olamaz")
+                raise NotFoundError("Güncellenecek aktivite bulunamadı")
+            return True
+        except (NotFoundError, CapacityError):
+            raise
+        except Exception as e:
+            raise DatabaseError(f"Aktivite güncellenirken hata oluştu: {str(e)}")
+
+    def get_user_activities(self, user_id: str, fields: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        """
+        Kullanıcının oluşturduğu veya katıldığı aktiviteler (tek sorgu, tarihe göre sıralı)
+        """
+        try:
+            return list(self.activities.find(
+                {"$or": [{"creator_id": user_id}, {"participants": user_id}]},
+                build_projection(fields, required=("activity_id",)),
+                sort=[("activity_at", pymongo.ASCENDING), ("activity_id", pymongo.ASCENDING)]
+            ))
+        except Exception as e:
+            raise DatabaseError(f"Kullanıcı aktiviteleri getirilirken hata oluştu: {str(e)}")
+
+    def get_feed(
+        self,
+        upcoming: bool = False,
+        date_from: Optional[str] = None,
+        date_to: Optional[str] = None,
+        location: Optional[str] = None,
+        has_free_slots: bool = False,
+        after: Optional[str] = None,
+        limit: int = 20,
+        fields: Optional[List[str]] = None
+    ) -> Dict[str, Any]:
+        """
+        Filtrelenmiş aktivite akışını activity_at'e göre artan sırada, imleçle sayfalı getirir.
+
+        location: konumun başıyla eşleşir (indeksli önek araması)
+        after: bir önceki sayfanın next_cursor değeri
+        """
+        try:
+            limit = max(1, min(limit, ACTIVITY_FEED_MAX_LIMIT))
+            conditions = []
+
+            activity_at = {}
+            if upcoming:
+                activity_at["$gte"] = datetime.datetime.utcnow()
+            if date_from:
+                start = to_utc_datetime(date_from)
+                activity_at["$gte"] = max(start, activity_at.get("$gte", start))
+            if date_to:
+                activity_at["$lte"] = to_utc_datetime(date_to)
+            if activity_at:
+                conditions.append({"activity_at": activity_at})
+
+            if location:
+                conditions.append({"location": {"$regex": f"^{re.escape(location)}"}})
+
+            if has_free_slots:
+                conditions.append({"$expr": {"$lt": [{"$size": "$participants"}, "$max_participants"]}})
+
+            if after:
+                cursor_at, cursor_id = decode_cursor(after)
+                conditions.append({"$or": [
+                    {"activity_at": {"$gt": cursor_at}},
+                    {"activity_at": cursor_at, "activity_id": {"$gt": cursor_id}}
+                ]})
+
+            query = {"$and": conditions} if conditions else {}
+            activities = list(self.activities.find(
+                query,
+                build_projection(fields, required=("activity_id", "activity_at")),
+                sort=[("activity_at", pymongo.ASCENDING), ("activity_id", pymongo.ASCENDING)],
+                limit=limit
+            ))
+            return {
+                "activities": activities,
+                "next_cursor": encode_cursor(activities[-1]) if len(activities) == limit else None
+            }
+        except ValidationError:
+            raise
+        except ValueError:
+            raise ValidationError("Geçersiz tarih formatı")
+        except Exception as e:
+            raise DatabaseError(f"Aktivite akışı getirilirken hata oluştu: {str(e)}")
+
+    def get_nearby(
+        self,
+        latitude: float,
+        longitude: float,
+        max_distance_m: float = 10_000,
+        upcoming: bool = True,
+        after: Optional[str] = None,
+        limit: int = 20
+    ) -> Dict[str, Any]:
+        """
+        Verilen noktaya en yakın aktiviteleri uzaklığa göre artan sırada getirir.
+
+        Sonuçlar distance_m alanını (metre) içerir. after: bir önceki sayfanın
+        next_cursor değeri; (distance_m, activity_id) üzerinden sayfalama yapılır.
+        """
+        try:
+            limit = max(1, min(limit, ACTIVITY_FEED_MAX_LIMIT))
+            max_distance_m = max(1, min(max_distance_m, NEARBY_MAX_DISTANCE_M))
+
+            query = {}
+            if upcoming:
+                query["activity_at"] = {"$gte": datetime.datetime.utcnow()}
+
+            geo_near = {
+                "near": to_geo_point(latitude, longitude),
+                "key": "geo",
+                "distanceField": "distance_m",
+                "spherical": True,
+                "maxDistance": max_distance_m,
+                "query": query
+            }
+            pipeline = [{"$geoNear": geo_near}]
+
+            if after:
+                cursor_distance, cursor_id = decode_distance_cursor(after)
+                # minDistance dahil edicidir; aynı uzaklıktakiler activity_id ile ayrılır
+                geo_near["minDistance"] = cursor_distance
+                pipeline.append({"$match": {"$or": [
+                    {"distance_m": {"$gt": cursor_distance}},
+                    {"distance_m": cursor_distance, "activity_id": {"$gt": cursor_id}}
+                ]}})
+
+            pipeline += [
+                {"$sort": {"distance_m": 1, "activity_id": 1}},
+                {"$limit": limit},
+                {"$project": {"_id": 0, "geo": 0}}
+            ]
+            activities = list(self.activities.aggregate(pipeline))
+            return {
+                "activities": activities,
+                "next_cursor": encode_distance_cursor(activities[-1]) if len(activities) == limit else None
+            }
+        except ValidationError:
+            raise
+        except Exception as e:
+            raise DatabaseError(f"Yakındaki aktiviteler getirilirken hata oluştu: {str(e)}")
+
+    def get_pending_reminders(self, start: datetime.datetime, end: datetime.datetime,
+                              limit: int = 10000) -> List[Dict[str, Any]]:
+        """
+        activity_at değeri [start, end] aralığında olan ve hatırlatması gönderilmemiş aktiviteler
+        """
+        try:
+            return list(self.activities.find(
+                {"activity_at": {"$gte": start, "$lte": end}, "reminder_sent": {"$ne": True}},
+                {"_id": 0, "activity_id": 1, "activity_at": 1},
+                sort=[("activity_at", pymongo.ASCENDING)],
+                limit=limit
+            ))
+        except Exception as e:
+            raise DatabaseError(f"Hatırlatılacak aktiviteler getirilirken hata oluştu: {str(e)}")
+
+    def get_archivable(self, before: datetime.datetime, limit: int = 10000) -> List[Dict[str, Any]]:
+        """
+        activity_at değeri before'dan önce olan (arşivlenecek) aktiviteler
+        """
+        try:
+            return list(self.activities.find(
+                {"activity_at": {"$lte": before}},
+                {"_id": 0, "activity_id": 1, "activity_at": 1},
+                sort=[("activity_at", pymongo.ASCENDING)],
+                limit=limit
+            ))
+        except Exception as e:
+            raise DatabaseError(f"Arşivlenecek aktiviteler getirilirken hata oluştu: {str(e)}")
+
+    def claim_reminder(self, activity_id: str, activity_at: datetime.datetime) -> Optional[Dict[str, Any]]:
+        """
+        Hatırlatmayı gönderilmiş olarak işaretler; yalnızca ilk çağıran aktiviteyi alır.
+        Aktivite tarihi zamanlandıktan sonra değiştiyse None döner.
+        """
+        try:
+            return self.activities.find_one_and_update(
+                {"activity_id": activity_id, "activity_at": activity_at, "reminder_sent": {"$ne": True}},
+                {"$set": {"reminder_sent": True}},
+                projection={"_id": 0, "activity_id": 1, "title": 1, "activity_date": 1, "participants": 1}
+            )
+        except Exception as e:
+            raise DatabaseError(f"Hatırlatma işaretlenirken hata oluştu: {str(e)}")
+
+    def archive_activity(self, activity_id: str, before: datetime.datetime) -> bool:
+        """
+        Sona ermiş aktiviteyi activities_archive koleksiyonuna taşır.
+        Önce arşive yazılır, sonra silinir; yarıda kalan taşıma tekrar çalıştırıldığında tamamlanır.
+        """
+        try:
+            activity = self.activities.find_one({"activity_id": activity_id, "activity_at": {"$lte": before}})
+            if not activity:
+                return False
+            activity.pop("_id", None)
+            activity["archived_at"] = datetime.datetime.utcnow()
+            self.archive.replace_one({"activity_id": activity_id}, activity, upsert=True)
+            self.activities.delete_one({"activity_id": activity_id, "activity_at": {"$lte": before}})
+            return True
+        except Exception as e:
+            raise DatabaseError(f"Aktivite arşivlenirken hata oluştu: {str(e)}")
+
+    def backfill_activity_at(self, batch_size: int = 1000) -> int:
+        """
+        activity_at alanı olmayan eski aktiviteler için alanı activity_date'ten hesaplar
+        """
+        updated = 0
+        batch = []
+        for activity in self.activities.find(
+            {"activity_at": {"$exists": False}, "activity_date": {"$type": "string"}},
+            {"_id": 1, "activity_date": 1}
+        ):
+            try:
+                activity_at = to_utc_datetime(activity["activity_date"])
+            except ValueError:
+                continue
+            batch.append(pymongo.UpdateOne({"_id": activity["_id"]}, {"$set": {"activity_at": activity_at}}))
+            if len(batch) >= batch_size:
+                updated += self.activities.bulk_write(batch, ordered=False).modified_count
+                batch = []
+        if batch:
+            updated += self.activities.bulk_write(batch, ordered=False).modified_count
+        return updated
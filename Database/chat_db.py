@@ -1,40 +1,119 @@
-from typing import List, Optional
+"""
+Sohbet ve mesaj veritabanı katmanı.
+
+Üyelik kontrolü (is_member) her chat isteğinde çalıştığından olumlu sonuçlar süreç
+içinde CHAT_MEMBERSHIP_CACHE_SECONDS (varsayılan 10 sn) saklanır. Katılımcı çıkarma ve
+chat'i pasifleştirme yalnızca değişikliği yapan süreçteki kayıtları siler; diğer
+worker'larda ve Database örneklerinde erişimi kaldırılan kullanıcı en fazla bu süre
+boyunca okumaya ve yazmaya devam edebilir.
+"""
+from contextlib import contextmanager
+from typing import Callable, List, Optional, Tuple
 from models.chat import Chat, Message, CreateNewChat
-from exceptions import DatabaseError
-from datetime import datetime
-from pymongo import MongoClient
+from exceptions import DatabaseError, DuplicateError, ForbiddenError, NotFoundError
+from datetime import datetime, timedelta
+from pymongo import MongoClient, ReturnDocument
+from pymongo.errors import DuplicateKeyError
+import pymongo
+from logger import get_logger, log_payload
+from Database.projection import build_projection
+from cache import TTLCache
+from ids import id_from_datetime, is_sortable_id, new_edit_id
+from Database.write_combiner import ChatSummaryCombiner
+from Database.message_store import BucketMessageStore, DocumentMessageStore, create_message_store
+import os
+import time
+
+logger = get_logger(__name__)
+
+ARCHIVE_STATE_PROJECTION = {"_id": 0, "chat_id": 1, "archived_through": 1, "archived_seq": 1}
+
+# Mesaj dokümanında tutulan son düzenleme sayısı; tam geçmiş message_edits koleksiyonundadır
+EDIT_HISTORY_INLINE_LIMIT = 3
+
+# Üyelik kontrolü sonuçlarının süreç içinde saklandığı süre (sn); yalnızca olumlu sonuçlar saklanır.
+# Diğer worker'larda erişimi kaldırılan kullanıcının en fazla bu kadar süre erişebileceği üst sınırdır
+CHAT_MEMBERSHIP_CACHE_SECONDS = int(os.getenv("CHAT_MEMBERSHIP_CACHE_SECONDS", "10"))
+
+# Chat özet güncellemelerinin birleştirildiği pencere (ms); 0 her mesajda hemen yazar
+CHAT_SUMMARY_FLUSH_MS = int(os.getenv("CHAT_SUMMARY_FLUSH_MS", "50"))
+
+# Aynı iki kullanıcı arasında eş zamanlı oluşturmada upsert'ün tekrar deneme sayısı
+CREATE_CHAT_ATTEMPTS = 3
+
+# İstemci tekrar deneme anahtarlarının saklandığı süre (gün); bu süreden sonraki tekrarlar yeni mesaj sayılır
+CLIENT_MESSAGE_KEY_TTL_DAYS = int(os.getenv("CLIENT_MESSAGE_KEY_TTL_DAYS", "30"))
+
+
+def direct_pair_key(participants: List[str]) -> Optional[str]:
+    """
+    Birebir sohbetin kanonik anahtarı ("kullanıcıA:kullanıcıB", sıralı); iki farklı katılımcı yoksa None
+    """
+    unique = sorted(set(participants))
+    return ":".join(unique) if len(unique) == 2 else None
+
 
 class ChatDatabase:
     def __init__(self, db):
-        print("\n=== ChatDatabase başlatılıyor ===")
         self.chats = db["chats"]
         self.messages = db["messages"]
+        self.sequences = db["chat_sequences"]
+        # Mesaj düzenleme geçmişi; her düzenleme ayrı bir doküman olarak eklenir
+        self.edits = db["message_edits"]
+        # (chat_id, sender_id, client_message_id) -> kanonik kimlik; tekrar denemeler her iki
+        # saklama modunda ve arşivlenmiş mesajlar için de bu koleksiyondan ayıklanır
+        self.client_keys = db["message_client_keys"]
+        # Mesajlar seçilen saklama moduna göre (doküman/kova) bu katman üzerinden okunup yazılır
+        self.store = create_message_store(db)
+        # Eski mesajların taşındığı soğuk katman (archiver.py); okumalar sıcak katmanda bitince buraya düşer
+        self.archive = DocumentMessageStore(db, "messages_archive", archive=True)
+        # Yoğun sohbetlerde chat dokümanı güncellemelerini birleştirir (Database/write_combiner.py)
+        self.summary_combiner = ChatSummaryCombiner(self.chats, window_ms=CHAT_SUMMARY_FLUSH_MS)
+        # (chat_id, user_id) -> True; her chat isteğinde yapılan yetki kontrolü için
+        self.membership_cache = TTLCache(maxsize=50000, ttl=CHAT_MEMBERSHIP_CACHE_SECONDS)
         self.db = db
-        print(f"chats ve messages koleksiyonları seçildi")
-        
-        # chats koleksiyonundaki toplam doküman sayısını göster
-        total_chats = self.chats.count_documents({})
-        print(f"\nToplam chat sayısı: {total_chats}")
-        
-        # Örnek bir chat göster
-        if total_chats > 0:
-            sample_chat = self.chats.find_one()
-            print(f"\nÖrnek chat:")
-            print(f"Chat ID: {sample_chat.get('chat_id')}")
-            print(f"Katılımcılar: {sample_chat.get('participants')}")
-        
-        print("=== ChatDatabase başlatma tamamlandı ===\n")
+
+        self.chats.create_index([("participants", pymongo.ASCENDING), ("updated_at", pymongo.DESCENDING)])
+        # Üyelik kontrolü dokümana dokunmadan yalnızca indeksten yanıtlanır
+        self.chats.create_index([
+            ("chat_id", pymongo.ASCENDING), ("participants", pymongo.ASCENDING), ("is_active", pymongo.ASCENDING)
+        ])
+        # İki kullanıcı arasında tek birebir sohbet; grup sohbetlerinde pair_key yoktur
+        self.chats.create_index(
+            "pair_key",
+            unique=True,
+            partialFilterExpression={"pair_key": {"$type": "string"}}
+        )
+        # edit_id zamana göre sıralanabilir (ids.py); geçmiş bu indeks üzerinden sayfalanır
+        self.edits.create_index([
+            ("chat_id", pymongo.ASCENDING), ("message_id", pymongo.ASCENDING), ("edit_id", pymongo.DESCENDING)
+        ])
+        # Eski edit_history dizilerinin taşınması tekrarlandığında kopya oluşmaz
+        self.edits.create_index("edit_id", unique=True)
+        self.client_keys.create_index(
+            [("chat_id", pymongo.ASCENDING), ("sender_id", pymongo.ASCENDING), ("client_message_id", pymongo.ASCENDING)],
+            unique=True
+        )
+        self.client_keys.create_index("created_at", expireAfterSeconds=CLIENT_MESSAGE_KEY_TTL_DAYS * 86400)
+        logger.info("ChatDatabase başlatıldı")
+
+    def close(self) -> None:
+        """
+        Bekleyen chat özeti güncellemelerini yazar
+        """
+        self.summary_combiner.stop()
 
     def __del__(self):
         try:
             if hasattr(self, 'client'):
                 self.client.close()
         except Exception as e:
-            print(f"Veritabanı bağlantı kapatma hatası: {str(e)}")
+            logger.error("Veritabanı bağlantı kapatma hatası", extra={"error": str(e)})
 
-    def create_chat(self, chat_data: CreateNewChat) -> Chat:
+    def create_chat(self, chat_data: CreateNewChat) -> Tuple[Chat, bool]:
         """
-        Yeni bir chat oluştur
+        Yeni bir chat oluştur; (chat, oluşturuldu_mu) döndürür.
+        Birebir sohbetlerde iki kullanıcı arasında zaten bir chat varsa o döndürülür.
         """
         try:
             # Chat nesnesini oluştur
@@ -50,9 +129,16 @@ class ChatDatabase:
             )
 
             # Katılımcı bilgilerini al
+            users = {
+                user["user_id"]: user
+                for user in self.db["users"].find(
+                    {"user_id": {"$in": chat_data.participants}},
+                    build_projection(["user_id", "full_name", "profile_picture"])
+                )
+            }
             participants_info = []
             for user_id in chat_data.participants:
-                user = self.db["users"].find_one({"user_id": user_id})
+                user = users.get(user_id)
                 if user:
                     participants_info.append({
                         "user_id": user_id,
@@ -63,39 +149,67 @@ class ChatDatabase:
             # Katılımcı bilgilerini ekle
             chat.participants_info = participants_info
 
-            # MongoDB'ye ekle
-            self.chats.insert_one(chat.dict())
-            return chat
+            pair_key = None if chat_data.is_group else direct_pair_key(chat_data.participants)
+            if pair_key is None:
+                # MongoDB'ye ekle
+                self.chats.insert_one(chat.dict())
+                return chat, True
+            return self._get_or_create_direct_chat(chat, pair_key)
         except Exception as e:
             raise DatabaseError(f"Chat oluşturma hatası: {str(e)}")
 
-    def get_chat_by_id(self, chat_id: str) -> Optional[Chat]:
+    def _get_or_create_direct_chat(self, chat: Chat, pair_key: str) -> Tuple[Chat, bool]:
         """
-        Chat ID'sine göre chat'i getir
+        pair_key üzerinde tek bir atomik upsert: chat yoksa eklenir, varsa mevcut chat döner
+        """
+        document = chat.dict()
+        document.pop("is_active")
+        for attempt in range(CREATE_CHAT_ATTEMPTS):
+            try:
+                existing = self.chats.find_one_and_update(
+                    {"pair_key": pair_key},
+                    {
+                        "$setOnInsert": document,
+                        # Pasif hale gelmiş birebir sohbet yeniden kullanılır
+                        "$set": {"is_active": True}
+                    },
+                    projection={"_id": 0, "messages": 0},
+                    upsert=True,
+                    return_document=ReturnDocument.BEFORE
+                )
+            except DuplicateKeyError:
+                # Aynı anda oluşturan diğer istek kazandı; upsert bu kez mevcut chat'i bulur
+                logger.debug("Birebir chat oluşturma yarışı, tekrar deneniyor", extra={
+                    "pair_key": pair_key, "attempt": attempt + 1
+                })
+                continue
+            if existing is None:
+                return chat, True
+            existing["is_active"] = True
+            return Chat.from_db(existing), False
+        raise DatabaseError("Birebir chat oluşturulamadı")
+
+    def get_chat_by_id(self, chat_id: str, fields: Optional[List[str]] = None) -> Optional[Chat]:
+        """
+        Chat ID'sine göre chat'i getir.
+        fields verilirse yalnızca bu alanlar okunur; mesaj birleştirmesi ($lookup) yapılmaz.
         """
         try:
+            if fields:
+                chat_data = self.chats.find_one(
+                    {"chat_id": chat_id, "is_active": True},
+                    build_projection(fields, required=("chat_id",))
+                )
+                return Chat.from_db(chat_data) if chat_data else None
+
             # Chat ve son mesajını tek sorguda getir
             pipeline = [
                 {"$match": {
                     "chat_id": chat_id,
                     "is_active": True
                 }},
-                {"$lookup": {
-                    "from": "messages",
-                    "let": {"chat_id": "$chat_id"},
-                    "pipeline": [
-                        {"$match": {
-                            "$expr": {"$eq": ["$chat_id", "$$chat_id"]}
-                        }},
-                        {"$sort": {"timestamp": -1}},
-                        {"$limit": 1}
-                    ],
-                    "as": "last_message"
-                }},
-                {"$unwind": {
-                    "path": "$last_message",
-                    "preserveNullAndEmptyArrays": True
-                }},
+                # Son mesaj saklama moduna göre messages veya message_buckets koleksiyonundan eklenir
+                *self.store.last_message_lookup(),
                 {"$addFields": {
                     "last_message": {
                         "$cond": {
@@ -128,161 +242,265 @@ class ChatDatabase:
                 }}
             ]
             
-            chat_data = self.chats.aggregate(pipeline).next()
+            chat_data = next(self.chats.aggregate(pipeline), None)
             if chat_data:
-                return Chat(**chat_data)
+                return Chat.from_db(chat_data)
             return None
         except Exception as e:
             raise DatabaseError(f"Chat getirme hatası: {str(e)}")
 
+    def is_member(self, chat_id: str, user_id: str) -> bool:
+        """
+        Kullanıcının aktif bir chat'in katılımcısı olup olmadığını chat'i yüklemeden kontrol eder
+        """
+        key = (chat_id, user_id)
+        if self.membership_cache.get(key):
+            return True
+        try:
+            member = self.chats.count_documents(
+                {"chat_id": chat_id, "participants": user_id, "is_active": True}, limit=1
+            ) > 0
+        except Exception as e:
+            raise DatabaseError(f"Üyelik kontrolü hatası: {str(e)}")
+        if member:
+            self.membership_cache.set(key, True)
+        return member
+
+    def _bump_version(self, chat_id: str) -> None:
+        """
+        Chat'in mesaj listesini etkileyen her değişiklikte version artırılır (HTTP ETag için).
+        Artış özet birleştiriciye bırakılır; yoğun sohbetlerde chat dokümanına ayrı istek gitmez.
+        """
+        self.summary_combiner.bump_version(chat_id)
+
     def add_message(self, chat_id: str, message: Message):
         """
         Chat'e yeni mesaj ekle
         """
         try:
-            self.messages.insert_one(message.dict())
-            self.chats.update_one(
-                {"chat_id": chat_id},
-                {"$set": {"updated_at": datetime.now().isoformat()}}
-            )
+            data = message.dict()
+            data["seq"] = self._next_seq(chat_id)
+            self.store.insert(data)
+            self.summary_combiner.add(chat_id, self._message_summary(data), data["seq"])
             return True
         except Exception as e:
             raise DatabaseError(f"Mesaj ekleme hatası: {str(e)}")
 
-    def update_message_status(self, chat_id: str, message_id: str, user_id: str, is_delivered: bool = False, is_read: bool = False):
+    @contextmanager
+    def _measure(self, operation: str, chat_id: str):
         """
-        Mesaj durumunu güncelle
+        Mesaj yazma işlemlerinin süresini ve veritabanı istek sayısını loglar
         """
+        stats = {"round_trips": 0}
+        started = time.perf_counter()
         try:
-            # Mesajı bul
-            message = self.messages.find_one({
+            yield stats
+        finally:
+            logger.debug("Mesaj işlemi tamamlandı", extra={
+                "operation": operation,
                 "chat_id": chat_id,
-                "message_id": message_id
+                "round_trips": stats["round_trips"],
+                "duration_ms": round((time.perf_counter() - started) * 1000, 2)
             })
-            
-            if not message:
-                raise DatabaseError("Mesaj bulunamadı")
-            
+
+    def _write_failure(self, chat_id: str, message_id: str, user_id: str) -> Exception:
+        """
+        Koşullu yazma hiçbir mesajla eşleşmediğinde nedenini ayırt eder (yalnızca hata yolunda okunur)
+        """
+        message = self.store.find_one(chat_id, {"message_id": message_id}, {"sender_id": 1, "is_deleted": 1})
+        if message and not message.get("is_deleted") and message.get("sender_id") != user_id:
+            return ForbiddenError("Bu mesaj üzerinde işlem yetkiniz yok")
+        return NotFoundError("Mesaj bulunamadı")
+
+    def update_message_status(self, chat_id: str, message_id: str, user_id: str, is_delivered: bool = False, is_read: bool = False):
+        """
+        Mesaj durumunu güncelle
+        """
+        try:
             # Güncelleme verilerini hazırla
-            update_data = {}
-            
+            add_to_set = {}
             if is_delivered:
-                if "delivered_to" not in message.get("status", {}):
-                    update_data["status.delivered_to"] = []
-                update_data["$addToSet"] = {"status.delivered_to": user_id}
-            
+                add_to_set["status.delivered_to"] = user_id
             if is_read:
-                if "read_by" not in message.get("status", {}):
-                    update_data["status.read_by"] = []
-                update_data["$addToSet"] = {"status.read_by": user_id}
-            
-            # Mesajı güncelle
-            self.messages.update_one(
-                {
-                    "chat_id": chat_id,
-                    "message_id": message_id
-                },
-                {
-                    "$set": update_data
-                }
-            )
-            
+                add_to_set["status.read_by"] = user_id
+            if not add_to_set:
+                return True
+
+            with self._measure("update_message_status", chat_id) as stats:
+                # Mesajı tek istekte güncelle; status_updated_at yeniden bağlanan istemcilere
+                # durum değişikliklerini iletmek için tutulur
+                matched, modified = self.store.update(
+                    chat_id,
+                    {"message_id": message_id},
+                    {
+                        "$addToSet": add_to_set,
+                        "$set": {"status_updated_at": datetime.now().isoformat()}
+                    }
+                )
+                stats["round_trips"] += 1
+
+                if matched == 0:
+                    raise NotFoundError("Mesaj bulunamadı")
+                if modified:
+                    self._bump_version(chat_id)
+
             return True
+        except NotFoundError:
+            raise
         except Exception as e:
             raise DatabaseError(f"Mesaj durumu güncelleme hatası: {str(e)}")
 
-    def delete_message(self, chat_id: str, message_id: str, user_id: str):
+    def mark_message_as_read(self, chat_id: str, message_id: str, user_id: str):
+        """
+        Mesajı okundu olarak işaretle
+        """
+        return self.update_message_status(chat_id, message_id, user_id, is_read=True)
+
+    def delete_message(self, chat_id: str, message_id: str, user_id: str) -> dict:
         """
-        Mesajı yumuşak sil (soft delete)
+        Mesajı yumuşak sil (soft delete); güncellenmiş mesajı döndürür.
+        Mesaj yoksa NotFoundError, başka kullanıcıya aitse ForbiddenError fırlatılır.
         """
         try:
-            # Mesajın varlığını ve sahipliğini kontrol et
-            message = self.messages.find_one({
-                "chat_id": chat_id,
-                "message_id": message_id,
-                "sender_id": user_id
-            })
-            
-            if not message:
-                raise DatabaseError("Mesaj bulunamadı veya silme yetkiniz yok")
-            
-            # Mesajı silmek yerine deleted alanını güncelle
-            self.messages.update_one(
-                {
-                    "chat_id": chat_id,
-                    "message_id": message_id
-                },
-                {
-                    "$set": {
-                        "deleted": True,
-                        "deleted_at": datetime.now().isoformat(),
-                        "deleted_by": user_id
+            with self._measure("delete_message", chat_id) as stats:
+                # Sahiplik kontrolü ve güncelleme aynı istekte
+                message = self.store.find_one_and_update(
+                    chat_id,
+                    {
+                        "message_id": message_id,
+                        "sender_id": user_id,
+                        "is_deleted": {"$ne": True}
+                    },
+                    {
+                        "$set": {
+                            "is_deleted": True,
+                            "deleted_at": datetime.now().isoformat(),
+                            "deleted_by": user_id
+                        }
                     }
-                }
-            )
-            
-            return True
+                )
+                stats["round_trips"] += 1
+
+                if not message:
+                    stats["round_trips"] += 1
+                    raise self._write_failure(chat_id, message_id, user_id)
+
+                self._bump_version(chat_id)
+
+            return message
+        except (NotFoundError, ForbiddenError):
+            raise
         except Exception as e:
             raise DatabaseError(f"Mesaj silme hatası: {str(e)}")
 
-    def edit_message(self, chat_id: str, message_id: str, user_id: str, content: str):
+    def edit_message(self, chat_id: str, message_id: str, user_id: str, content: str) -> dict:
         """
-        Mesajı düzenle ve düzenleme geçmişini tut
+        Mesajı düzenle ve düzenleme geçmişini tut; güncellenmiş mesajı döndürür.
+        Mesaj tek istekte güncellenir; dokümanda yalnızca son EDIT_HISTORY_INLINE_LIMIT
+        düzenleme tutulur, tam geçmiş message_edits koleksiyonuna eklenir.
         """
         try:
-            # Mesajın varlığını ve sahipliğini kontrol et
-            message = self.messages.find_one({
-                "chat_id": chat_id,
-                "message_id": message_id,
-                "sender_id": user_id,
-                "deleted": {"$ne": True}  # Silinmiş mesajları düzenleyemez
-            })
-            
-            if not message:
-                raise DatabaseError("Mesaj bulunamadı veya düzenleme yetkiniz yok")
-            
-            # Düzenleme geçmişini oluştur
-            edit_history = message.get("edit_history", [])
-            edit_history.append({
-                "old_content": message["content"],
-                "edited_at": datetime.now().isoformat(),
-                "edited_by": user_id
-            })
-            
-            # Mesajı güncelle
-            self.messages.update_one(
-                {
+            now = datetime.now().isoformat()
+            edit = {"content": content, "edited_at": now, "edited_by": user_id}
+            changes = {"content": content, "edited": True, "updated_at": now}
+
+            with self._measure("edit_message", chat_id) as stats:
+                # Sahiplik kontrolü ve güncelleme aynı istekte; eski içerik dönen dokümandan alınır
+                previous = self.store.find_one_and_update(
+                    chat_id,
+                    {
+                        "message_id": message_id,
+                        "sender_id": user_id,
+                        "is_deleted": {"$ne": True}  # Silinmiş mesajları düzenleyemez
+                    },
+                    {
+                        "$set": changes,
+                        "$push": {
+                            "recent_edits": {"$each": [edit], "$slice": -EDIT_HISTORY_INLINE_LIMIT}
+                        }
+                    },
+                    return_document=ReturnDocument.BEFORE
+                )
+                stats["round_trips"] += 1
+
+                if not previous:
+                    stats["round_trips"] += 1
+                    raise self._write_failure(chat_id, message_id, user_id)
+
+                self.edits.insert_one({
+                    "edit_id": new_edit_id(),
                     "chat_id": chat_id,
-                    "message_id": message_id
-                },
-                {
-                    "$set": {
-                        "content": content,
-                        "edited": True,
-                        "edit_history": edit_history,
-                        "updated_at": datetime.now().isoformat()
-                    }
-                }
-            )
-            
-            return True
+                    "message_id": message_id,
+                    "old_content": previous.get("content"),
+                    "new_content": content,
+                    "edited_at": now,
+                    "edited_by": user_id
+                })
+                self._bump_version(chat_id)
+                stats["round_trips"] += 1
+
+            # Güncellemenin sonucu dönen önceki halden hesaplanır; ikinci bir okuma yapılmaz
+            recent_edits = (previous.get("recent_edits") or []) + [edit]
+            return {**previous, **changes, "recent_edits": recent_edits[-EDIT_HISTORY_INLINE_LIMIT:]}
+        except (NotFoundError, ForbiddenError):
+            raise
         except Exception as e:
             raise DatabaseError(f"Mesaj düzenleme hatası: {str(e)}")
 
-    def get_message_history(self, chat_id: str, message_id: str) -> List[dict]:
+    @staticmethod
+    def _legacy_edits(chat_id: str, message_id: str, edit_history: List[dict]) -> List[dict]:
         """
-        Mesajın düzenleme geçmişini getir
+        Mesaj dokümanındaki eski edit_history kayıtlarını message_edits biçimine çevirir.
+        edit_id edited_at'ten türetildiğinden aynı kayıt her seferinde aynı kimliği alır.
         """
-        try:
-            message = self.messages.find_one({
+        edits = []
+        for index, entry in enumerate(edit_history):
+            try:
+                edited_at = datetime.fromisoformat(str(entry.get("edited_at", "")).replace("Z", "+00:00"))
+            except ValueError:
+                continue
+            edits.append({
+                "edit_id": id_from_datetime(edited_at, prefix="edt_", sequence=index),
                 "chat_id": chat_id,
-                "message_id": message_id
+                "message_id": message_id,
+                "old_content": entry.get("old_content"),
+                "edited_at": entry.get("edited_at"),
+                "edited_by": entry.get("edited_by")
             })
-            
+        return edits
+
+    def get_message_history(self, chat_id: str, message_id: str, limit: int = 50,
+                            before: Optional[str] = None) -> List[dict]:
+        """
+        Mesajın düzenleme geçmişini yeniden eskiye getir.
+        before verilirse bu edit_id'den eski kayıtlar döner (imleçli sayfalama).
+        """
+        try:
+            projection = {"message_id": 1, "edit_history": 1}
+            message = (
+                self.store.find_one(chat_id, {"message_id": message_id}, projection)
+                or self.archive.find_one(chat_id, {"message_id": message_id}, projection)
+            )
+
             if not message:
-                raise DatabaseError("Mesaj bulunamadı")
-            
-            return message.get("edit_history", [])
+                raise NotFoundError("Mesaj bulunamadı")
+
+            query = {"chat_id": chat_id, "message_id": message_id}
+            if before:
+                query["edit_id"] = {"$lt": before}
+            edits = list(self.edits.find(query, {"_id": 0}, sort=[("edit_id", pymongo.DESCENDING)]).limit(limit))
+
+            # Henüz taşınmamış (migrate_edit_history) eski kayıtlar
+            if message.get("edit_history"):
+                legacy = [
+                    edit for edit in self._legacy_edits(chat_id, message_id, message["edit_history"])
+                    if not before or edit["edit_id"] < before
+                ]
+                edits = sorted(edits + legacy, key=lambda edit: edit["edit_id"], reverse=True)[:limit]
+
+            return edits
+        except NotFoundError:
+            raise
         except Exception as e:
             raise DatabaseError(f"Mesaj geçmişi getirme hatası: {str(e)}")
 
@@ -291,102 +509,104 @@ class ChatDatabase:
         Kullanıcının tüm chat'lerini getir
         """
         try:
-            print(f"\n=== get_user_chats başladı ===")
-            print(f"Kullanıcı ID: {user_id}")
-            
             # Chat'leri ve son mesajlarını tek sorguda getir
             pipeline = [
                 {"$match": {
                     "participants": user_id,
                     "is_active": True
                 }},
-                {"$lookup": {
-                    "from": "messages",
-                    "let": {"chat_id": "$chat_id"},
-                    "pipeline": [
-                        {"$match": {
-                            "$expr": {"$eq": ["$chat_id", "$$chat_id"]}
-                        }},
-                        {"$sort": {"timestamp": -1}},
-                        {"$limit": 1}
-                    ],
-                    "as": "last_message"
-                }},
-                {"$unwind": {
-                    "path": "$last_message",
-                    "preserveNullAndEmptyArrays": True
-                }},
+                # Son mesaj saklama moduna göre messages veya message_buckets koleksiyonundan eklenir
+                *self.store.last_message_lookup(),
                 {"$sort": {"updated_at": -1}}
             ]
             
-            print(f"\nPipeline: {pipeline}")
-            
-            # Önce basit bir sorgu ile chat'leri kontrol et
-            simple_query = {"participants": user_id, "is_active": True}
-            print(f"\nBasit sorgu sonucu:")
-            simple_result = list(self.chats.find(simple_query))
-            print(f"Bulunan chat sayısı: {len(simple_result)}")
-            for chat in simple_result:
-                print(f"Chat ID: {chat.get('chat_id')}, Participants: {chat.get('participants')}")
-            
             chats = []
-            print("\nAggregation pipeline sonucu:")
             for chat_data in self.chats.aggregate(pipeline):
-                print(f"\nChat verisi: {chat_data}")
-                
                 # Chat nesnesini oluştur
-                chat = Chat(
-                    chat_id=chat_data["chat_id"],
-                    participants=chat_data["participants"],
-                    is_group=chat_data.get("is_group", False),
-                    group_name=chat_data.get("group_name"),
-                    group_admin=chat_data.get("group_admin"),
-                    created_at=chat_data["created_at"],
-                    updated_at=chat_data["updated_at"],
-                    is_active=chat_data["is_active"]
-                )
-                
-                print(f"Oluşturulan chat nesnesi: {chat.dict()}")
+                last_message = chat_data.pop("last_message", None)
+                chat_data.pop("messages", None)
+                chat = Chat.from_db(chat_data)
                 
                 # Son mesajı ekle
-                if "last_message" in chat_data:
-                    print(f"Son mesaj verisi: {chat_data['last_message']}")
-                    chat.last_message = Message(
-                        message_id=chat_data["last_message"]["message_id"],
-                        chat_id=chat_data["chat_id"],
-                        sender_id=chat_data["last_message"]["sender_id"],
-                        content=chat_data["last_message"]["content"],
-                        timestamp=chat_data["last_message"]["timestamp"],
-                        status=chat_data["last_message"].get("status", {})
-                    )
+                if last_message:
+                    chat.last_message = Message.from_db({**last_message, "chat_id": chat.chat_id})
                 
                 chats.append(chat)
             
-            print(f"\nToplam dönen chat sayısı: {len(chats)}")
-            print("=== get_user_chats bitti ===\n")
+            logger.debug("Kullanıcı chat'leri getirildi", extra={"user_id": user_id, "chat_count": len(chats)})
             
             return chats
         except Exception as e:
-            print(f"\n!!! HATA !!!")
-            print(f"Hata mesajı: {str(e)}")
-            print(f"Hata tipi: {type(e)}")
-            import traceback
-            print(f"Stack trace: {traceback.format_exc()}")
-            print("!!! HATA !!!\n")
+            logger.exception("Chat listesi getirme hatası", extra={"user_id": user_id})
             raise DatabaseError(f"Chat listesi getirme hatası: {str(e)}")
 
-    def get_chat_messages(self, chat_id: str, page: int = 1, page_size: int = 20) -> dict:
+    @staticmethod
+    def _as_message_cursor(cursor: str) -> str:
+        """
+        Eski istemcilerin gönderdiği ISO timestamp imleçlerini message_id imlecine çevirir
+        """
+        if is_sortable_id(cursor):
+            return cursor
+        try:
+            return id_from_datetime(datetime.fromisoformat(cursor.replace("Z", "+00:00")))
+        except ValueError:
+            return cursor
+
+    @staticmethod
+    def _archived(chat: Optional[dict]) -> Optional[dict]:
+        return chat if chat and chat.get("archived_through") else None
+
+    def _archive_state(self, chat_id: str) -> Optional[dict]:
+        """
+        Chat'in arşivlenmiş mesajı varsa arşiv sınırını (archived_through, archived_seq) döndürür
+        """
+        return self._archived(self.chats.find_one({"chat_id": chat_id}, ARCHIVE_STATE_PROJECTION))
+
+    def _find_newest_first(self, chat_id: str, query: dict, skip: int, limit: int,
+                           archived: Optional[dict]) -> List[dict]:
+        """
+        En yeniden eskiye okur; sıcak katmanda sayfa dolmazsa kalanı arşivden tamamlar
+        """
+        messages = self.store.find(chat_id, query, skip=skip, limit=limit)
+        if not archived or len(messages) >= limit:
+            return messages
+        # skip sıcak katmandaki eşleşmeleri aştıysa arşivdeki karşılığına kaydırılır
+        archive_skip = max(0, skip - self.store.count(chat_id, query)) if skip and not messages else 0
+        seen = {message["message_id"] for message in messages}
+        older = self.archive.find(chat_id, query, skip=archive_skip, limit=limit - len(messages))
+        return messages + [message for message in older if message["message_id"] not in seen]
+
+    def _find_oldest_first(self, chat_id: str, query: dict, sort: list, limit: int, in_archive: bool) -> List[dict]:
         """
-        Belirli bir chat'in mesajlarını getir
+        Eskiden yeniye okur; imleç arşiv sınırının gerisindeyse önce arşivden başlanır
+        """
+        if not in_archive:
+            return self.store.find(chat_id, query, sort=sort, limit=limit)
+        messages = self.archive.find(chat_id, query, sort=sort, limit=limit)
+        if len(messages) < limit:
+            seen = {message["message_id"] for message in messages}
+            newer = self.store.find(chat_id, query, sort=sort, limit=limit - len(messages))
+            messages += [message for message in newer if message["message_id"] not in seen]
+        return messages
+
+    def get_chat_messages(self, chat_id: str, page: int = 1, page_size: int = 20,
+                          before: Optional[str] = None, after_seq: Optional[int] = None) -> dict:
+        """
+        Belirli bir chat'in mesajlarını getir.
+        before (message_id) verilirse sayfa numarası yerine imleçle, bu mesajdan eskiler getirilir.
+        after_seq verilirse bu sıra numarasından sonraki mesajlar eskiden yeniye getirilir (delta senkronizasyonu).
         """
         try:
-            # Chat'in varlığını kontrol et
-            chat = self.get_chat_by_id(chat_id)
+            # Chat'in varlığını ve arşiv sınırını kontrol et
+            chat = self.chats.find_one({"chat_id": chat_id}, ARCHIVE_STATE_PROJECTION)
             if not chat:
                 raise DatabaseError("Chat bulunamadı")
+            archived = self._archived(chat)
 
             # Toplam mesaj sayısını al
-            total_messages = self.messages.count_documents({"chat_id": chat_id})
+            total_messages = self.store.count(chat_id)
+            if archived:
+                total_messages += self.archive.count(chat_id)
             
             # Toplam sayfa sayısını hesapla
             total_pages = (total_messages + page_size - 1) // page_size if total_messages > 0 else 1
@@ -397,27 +617,22 @@ class ChatDatabase:
             elif page > total_pages:
                 page = total_pages
 
-            # Mesajları getir (en yeniden eskiye sıralı)
-            messages = list(self.messages.find(
-                {"chat_id": chat_id},
-                sort=[("timestamp", -1)]  # En yeni mesajlar önce
-            ).skip((page - 1) * page_size).limit(page_size))
+            # Mesajları getir (en yeniden eskiye sıralı; after_seq'te eskiden yeniye)
+            if after_seq is not None:
+                messages = self._find_oldest_first(
+                    chat_id, {"seq": {"$gt": after_seq}}, [("seq", 1)], page_size,
+                    in_archive=bool(archived) and after_seq < archived.get("archived_seq", 0)
+                )
+            elif before:
+                messages = self._find_newest_first(
+                    chat_id, {"message_id": {"$lt": self._as_message_cursor(before)}}, 0, page_size, archived
+                )
+            else:
+                # En yeni mesajlar önce
+                messages = self._find_newest_first(chat_id, {}, (page - 1) * page_size, page_size, archived)
 
-            # Mesajları Message nesnelerine dönüştür
-            message_objects = []
-            for message in messages:
-                try:
-                    # Eğer content yoksa varsayılan değerler kullan
-                    if not message.get('content'):
-                        message['content'] = {
-                            'type': 'text',
-                            'text': '',
-                            'content': ''
-                        }
-                    message_objects.append(Message(**message))
-                except Exception as e:
-                    print(f"Mesaj dönüştürme hatası: {str(e)}")
-                    continue
+            # Mesajları Message nesnelerine dönüştür (veritabanı verisi, doğrulama yapılmaz)
+            message_objects = [Message.from_db(message) for message in messages]
 
             return {
                 "messages": message_objects,
@@ -427,18 +642,118 @@ class ChatDatabase:
                     "total_messages": total_messages,
                     "page_size": page_size,
                     "has_next": page < total_pages,
-                    "has_previous": page > 1
+                    "has_previous": page > 1,
+                    "next_before": message_objects[-1].message_id if len(message_objects) == page_size and after_seq is None else None,
+                    "next_after_seq": message_objects[-1].seq if len(message_objects) == page_size and after_seq is not None else None
                 }
             }
         except Exception as e:
             raise DatabaseError(f"Mesajları getirme hatası: {str(e)}")
 
+    def get_user_chat_cursors(self, user_id: str) -> List[dict]:
+        """
+        Kullanıcının aktif chat'lerinin yalnızca senkronizasyon için gereken alanlarını getir.
+        Chat özetleri birleştirilerek yazıldığından last_seq sayaç koleksiyonundan okunur.
+        """
+        try:
+            chats = list(self.chats.find(
+                {"participants": user_id, "is_active": True},
+                {"_id": 0, "chat_id": 1, "updated_at": 1, "last_seq": 1}
+            ))
+            counters = {
+                counter["_id"]: counter["seq"]
+                for counter in self.sequences.find({"_id": {"$in": [chat["chat_id"] for chat in chats]}})
+            }
+            for chat in chats:
+                chat["last_seq"] = max(chat.get("last_seq", 0), counters.get(chat["chat_id"], 0))
+            return chats
+        except Exception as e:
+            raise DatabaseError(f"Chat listesi getirme hatası: {str(e)}")
+
+    def get_messages_since(self, chat_id: str, after: Optional[str] = None, limit: int = 100) -> List[dict]:
+        """
+        İmleçten (after, son görülen message_id) sonraki mesajları eskiden yeniye getir.
+        İmleç yoksa chat'in en son `limit` mesajını döndürür.
+        """
+        try:
+            archived = self._archive_state(chat_id)
+            if after:
+                after = self._as_message_cursor(after)
+                return self._find_oldest_first(
+                    chat_id, {"message_id": {"$gt": after}}, [("message_id", 1)], limit,
+                    in_archive=bool(archived) and after <= archived["archived_through"]
+                )
+            messages = self._find_newest_first(chat_id, {}, 0, limit, archived)
+            messages.reverse()
+            return messages
+        except Exception as e:
+            raise DatabaseError(f"Mesajları getirme hatası: {str(e)}")
+
+    def find_by_client_message_id(self, chat_id: str, sender_id: str, client_message_id: str) -> Optional[dict]:
+        """
+        İstemci anahtarıyla daha önce kaydedilmiş mesajın kanonik kimliğini getir
+        """
+        try:
+            key = self.client_keys.find_one(
+                {"chat_id": chat_id, "sender_id": sender_id, "client_message_id": client_message_id},
+                {"_id": 0, "message_id": 1, "timestamp": 1}
+            )
+            if key:
+                # seq anahtar alındıktan sonra ayrılır; kazanan istek henüz eklemediyse None kalır
+                message = self.store.find_one(chat_id, {"message_id": key["message_id"]}, {"seq": 1})
+                return {**key, "seq": message.get("seq") if message else None}
+            return None
+        except Exception as e:
+            raise DatabaseError(f"Mesaj getirme hatası: {str(e)}")
+
+    def get_messages_after_seq(self, chat_id: str, after_seq: int = 0, limit: int = 100) -> List[dict]:
+        """
+        after_seq'ten büyük sıra numaralı mesajları seq sırasıyla getir ({chat_id, seq} indeksiyle)
+        """
+        try:
+            archived = self._archive_state(chat_id)
+            return self._find_oldest_first(
+                chat_id, {"seq": {"$gt": after_seq}}, [("seq", 1)], limit,
+                in_archive=bool(archived) and after_seq < archived.get("archived_seq", 0)
+            )
+        except Exception as e:
+            raise DatabaseError(f"Mesajları getirme hatası: {str(e)}")
+
+    def get_status_updates_since(self, chat_ids: List[str], since: str,
+                                 after: Optional[Tuple[str, str]] = None, limit: int = 1000) -> List[dict]:
+        """
+        Verilen zamandan sonra durumu (iletildi/okundu) değişen mesajları
+        (status_updated_at, message_id) sırasıyla sayfalı getir.
+        after: bir önceki sayfanın son (status_updated_at, message_id) çifti
+        """
+        try:
+            query = {"status_updated_at": {"$gt": since}}
+            if after:
+                updated_at, message_id = after
+                # Aynı zaman damgasına sahip güncellemeler sayfa sınırında atlanmaz
+                query["$or"] = [
+                    {"status_updated_at": {"$gt": updated_at}},
+                    {"status_updated_at": updated_at, "message_id": {"$gt": message_id}}
+                ]
+            return self.store.find(
+                chat_ids,
+                query,
+                sort=(("status_updated_at", pymongo.ASCENDING), ("message_id", pymongo.ASCENDING)),
+                limit=limit,
+                projection={"chat_id": 1, "message_id": 1, "status": 1, "status_updated_at": 1}
+            )
+        except Exception as e:
+            raise DatabaseError(f"Mesaj durumları getirme hatası: {str(e)}")
+
     def get_message_count(self, chat_id: str) -> int:
         """
         Bir chat'teki toplam mesaj sayısını getir
         """
         try:
-            return self.messages.count_documents({"chat_id": chat_id})
+            total = self.store.count(chat_id)
+            if self._archive_state(chat_id):
+                total += self.archive.count(chat_id)
+            return total
         except Exception as e:
             raise DatabaseError(f"Mesaj sayısı getirme hatası: {str(e)}")
 
@@ -448,7 +763,7 @@ class ChatDatabase:
         """
         try:
             # Chat'in grup olduğunu ve ekleyen kişinin admin olduğunu kontrol et
-            chat = self.get_chat_by_id(chat_id)
+            chat = self.get_chat_by_id(chat_id, fields=["is_group", "group_admin", "participants"])
             if not chat or not chat.is_group:
                 raise DatabaseError("Grup bulunamadı")
             
@@ -463,6 +778,7 @@ class ChatDatabase:
                     "$set": {"updated_at": datetime.now().isoformat()}
                 }
             )
+            self.membership_cache.delete((chat_id, user_id))
             
             return True
         except Exception as e:
@@ -474,7 +790,7 @@ class ChatDatabase:
         """
         try:
             # Chat'in grup olduğunu ve çıkaran kişinin admin olduğunu kontrol et
-            chat = self.get_chat_by_id(chat_id)
+            chat = self.get_chat_by_id(chat_id, fields=["is_group", "group_admin", "participants"])
             if not chat or not chat.is_group:
                 raise DatabaseError("Grup bulunamadı")
             
@@ -493,18 +809,39 @@ class ChatDatabase:
                     "$set": {"updated_at": datetime.now().isoformat()}
                 }
             )
+            self.membership_cache.delete((chat_id, user_id))
             
             return True
         except Exception as e:
             raise DatabaseError(f"Katılımcı çıkarma hatası: {str(e)}")
 
+    def deactivate_chat(self, chat_id: str) -> bool:
+        """
+        Chat'i pasifleştirir; katılımcıların bu süreçteki üyelik kayıtları silinir
+        """
+        try:
+            chat = self.chats.find_one_and_update(
+                {"chat_id": chat_id, "is_active": True},
+                {"$set": {"is_active": False, "updated_at": datetime.now().isoformat()}},
+                projection={"_id": 0, "participants": 1}
+            )
+            if not chat:
+                raise NotFoundError("Chat bulunamadı")
+            for user_id in chat.get("participants", []):
+                self.membership_cache.delete((chat_id, user_id))
+            return True
+        except NotFoundError:
+            raise
+        except Exception as e:
+            raise DatabaseError(f"Chat pasifleştirme hatası: {str(e)}")
+
     def change_group_admin(self, chat_id: str, new_admin_id: str, current_admin_id: str):
         """
         Grup yöneticisini değiştir
         """
         try:
             # Chat'in grup olduğunu ve mevcut admin olduğunu kontrol et
-            chat = self.get_chat_by_id(chat_id)
+            chat = self.get_chat_by_id(chat_id, fields=["is_group", "group_admin", "participants"])
             if not chat or not chat.is_group:
                 raise DatabaseError("Grup bulunamadı")
             
@@ -535,7 +872,7 @@ class ChatDatabase:
         Grup bilgilerini getir
         """
         try:
-            chat = self.get_chat_by_id(chat_id)
+            chat = self.get_chat_by_id(chat_id, fields=["is_group", "group_name", "group_admin", "participants", "created_at", "updated_at"])
             if not chat or not chat.is_group:
                 raise DatabaseError("Grup bulunamadı")
             
@@ -578,18 +915,12 @@ class ChatDatabase:
             }
             
             # Mesajı kaydet
-            self.messages.insert_one(message.dict())
+            data = message.dict()
+            data["seq"] = self._next_seq(chat_id)
+            self.store.insert(data)
             
-            # Chat'i güncelle
-            self.chats.update_one(
-                {"chat_id": chat_id},
-                {
-                    "$set": {
-                        "updated_at": datetime.now().isoformat(),
-                        "last_message": message.dict()
-                    }
-                }
-            )
+            # Chat özeti save_message ile aynı yoldan (seq kontrollü) güncellenir
+            self.summary_combiner.add(chat_id, self._message_summary(data), data["seq"])
             
             return True
         except Exception as e:
@@ -610,19 +941,19 @@ class ChatDatabase:
                 query["content.media_type"] = media_type
             
             # Toplam mesaj sayısını al
-            total_messages = self.messages.count_documents(query)
+            archived = self._archive_state(chat_id)
+            total_messages = self.store.count(chat_id, query)
+            if archived:
+                total_messages += self.archive.count(chat_id, query)
             
             # Toplam sayfa sayısını hesapla
             total_pages = (total_messages + page_size - 1) // page_size
             
             # Mesajları getir
-            messages = list(self.messages.find(
-                query,
-                sort=[("timestamp", -1)]
-            ).skip((page - 1) * page_size).limit(page_size))
+            messages = self._find_newest_first(chat_id, query, (page - 1) * page_size, page_size, archived)
             
             # Mesajları Message nesnelerine dönüştür
-            message_objects = [Message(**message) for message in messages]
+            message_objects = [Message.from_db(message) for message in messages]
             
             return {
                 "messages": message_objects,
@@ -653,19 +984,19 @@ class ChatDatabase:
             }
             
             # Toplam sonuç sayısını al
-            total_results = self.messages.count_documents(search_query)
+            archived = self._archive_state(chat_id)
+            total_results = self.store.count(chat_id, search_query)
+            if archived:
+                total_results += self.archive.count(chat_id, search_query)
             
             # Toplam sayfa sayısını hesapla
             total_pages = (total_results + page_size - 1) // page_size
             
             # Sonuçları getir
-            results = list(self.messages.find(
-                search_query,
-                sort=[("timestamp", -1)]
-            ).skip((page - 1) * page_size).limit(page_size))
+            results = self._find_newest_first(chat_id, search_query, (page - 1) * page_size, page_size, archived)
             
             # Sonuçları Message nesnelerine dönüştür
-            message_objects = [Message(**result) for result in results]
+            message_objects = [Message.from_db(result) for result in results]
             
             return {
                 "messages": message_objects,
@@ -709,19 +1040,19 @@ class ChatDatabase:
                 filter_query["content.media_type"] = filters["media_type"]
             
             # Toplam sonuç sayısını al
-            total_results = self.messages.count_documents(filter_query)
+            archived = self._archive_state(chat_id)
+            total_results = self.store.count(chat_id, filter_query)
+            if archived:
+                total_results += self.archive.count(chat_id, filter_query)
             
             # Toplam sayfa sayısını hesapla
             total_pages = (total_results + page_size - 1) // page_size
             
             # Sonuçları getir
-            results = list(self.messages.find(
-                filter_query,
-                sort=[("timestamp", -1)]
-            ).skip((page - 1) * page_size).limit(page_size))
+            results = self._find_newest_first(chat_id, filter_query, (page - 1) * page_size, page_size, archived)
             
             # Sonuçları Message nesnelerine dönüştür
-            message_objects = [Message(**result) for result in results]
+            message_objects = [Message.from_db(result) for result in results]
             
             return {
                 "messages": message_objects,
@@ -737,34 +1068,87 @@ class ChatDatabase:
         except Exception as e:
             raise DatabaseError(f"Mesaj filtreleme hatası: {str(e)}")
 
-    def save_message(self, message: dict) -> bool:
+    def _next_seq(self, chat_id: str) -> int:
+        """
+        chat_sequences sayacından sohbet içi bir sonraki sıra numarasını alır.
+        Sayaç yoksa chat dokümanındaki last_seq değerinden tembel olarak başlatılır.
+        """
+        while True:
+            counter = self.sequences.find_one_and_update(
+                {"_id": chat_id},
+                {"$inc": {"seq": 1}},
+                return_document=ReturnDocument.AFTER
+            )
+            if counter:
+                return counter["seq"]
+            chat = self.chats.find_one({"chat_id": chat_id}, {"_id": 0, "chat_id": 1, "last_seq": 1})
+            if chat is None:
+                raise DatabaseError("Chat bulunamadı")
+            try:
+                self.sequences.insert_one({"_id": chat_id, "seq": chat.get("last_seq", 0)})
+            except DuplicateKeyError:
+                # Başka bir istek aynı anda başlattı; artırmayı tekrar dene
+                pass
+
+    @staticmethod
+    def _message_summary(message: dict) -> dict:
+        """
+        Chat dokümanındaki last_message alanına yazılan özet
+        """
+        return {
+            "message_id": message["message_id"],
+            "content": message["content"],
+            "sender_id": message["sender_id"],
+            "timestamp": message["timestamp"],
+            "seq": message["seq"]
+        }
+
+    def save_message(self, message: dict) -> Optional[int]:
         """
-        Yeni mesaj kaydet
+        Yeni mesaj kaydet. Mesaja sohbet içi sıra numarası (seq) atanır ve hemen eklenir;
+        chat özeti (last_message, unread_count, version) yazma birleştiriciyle toplu güncellenir.
+        Başarılıysa atanan seq'i, değilse None döndürür.
         """
+        client_key = None
         try:
-            # Mesajı messages koleksiyonuna ekle
-            self.messages.insert_one(message)
-            
-            # Chat'in son mesajını güncelle
-            self.chats.update_one(
-                {"chat_id": message["chat_id"]},
-                {
-                    "$set": {
-                        "last_message": {
-                            "message_id": message["message_id"],
-                            "content": message["content"],
-                            "sender_id": message["sender_id"],
-                            "timestamp": message["timestamp"]
-                        },
-                        "updated_at": datetime.now().isoformat()
-                    },
-                    "$inc": {"unread_count": 1}
+            if message.get("client_message_id"):
+                # Tekrar denemeler seq ayrılmadan ve mesaj eklenmeden önce benzersiz anahtarda elenir (kova modu dahil)
+                client_key = {
+                    "chat_id": message["chat_id"],
+                    "sender_id": message["sender_id"],
+                    "client_message_id": message["client_message_id"]
                 }
-            )
-            return True
+                try:
+                    self.client_keys.insert_one({
+                        **client_key,
+                        "message_id": message["message_id"],
+                        "timestamp": message["timestamp"],
+                        "created_at": datetime.utcnow()
+                    })
+                except DuplicateKeyError:
+                    logger.warning("Tekrarlanan mesaj kaydedilmedi", extra={
+                        "chat_id": message["chat_id"], "client_message_id": message["client_message_id"]
+                    })
+                    raise DuplicateError("Mesaj zaten kaydedildi")
+
+            try:
+                # Mesaj eklenemezse bu seq boş kalır; istemciler boşluğu görüp aralığı yeniden ister
+                message["seq"] = self._next_seq(message["chat_id"])
+                self.store.insert(message)
+            except Exception:
+                # Anahtar bırakılır ki istemcinin tekrar denemesi kaydedilebilsin
+                if client_key:
+                    self.client_keys.delete_one({**client_key, "message_id": message["message_id"]})
+                raise
+
+            self.summary_combiner.add(message["chat_id"], self._message_summary(message), message["seq"])
+            return message["seq"]
+        except DuplicateError:
+            raise
         except Exception as e:
-            print(f"Mesaj kaydetme hatası: {str(e)}")
-            return False
+            logger.error("Mesaj kaydetme hatası", extra={"chat_id": message.get("chat_id"), "error": str(e)})
+            log_payload(logger, "Kaydedilemeyen mesaj", message)
+            return None
 
     def get_user_chats_with_recent_messages(self, user_id: str) -> List[Chat]:
         """
@@ -772,9 +1156,6 @@ class ChatDatabase:
         Son 5 sohbetin son 30 mesajını da içerir.
         """
         try:
-            print(f"\n=== get_user_chats_with_recent_messages başladı ===")
-            print(f"Kullanıcı ID: {user_id}")
-            
             # Önce kullanıcının tüm sohbetlerini al
             pipeline = [
                 {"$match": {
@@ -785,27 +1166,16 @@ class ChatDatabase:
             ]
             
             all_chats = list(self.chats.aggregate(pipeline))
-            print(f"Toplam sohbet sayısı: {len(all_chats)}")
             
             # Son 5 sohbeti ayır
             recent_chats = all_chats[:5]
             other_chats = all_chats[5:]
             
-            print(f"Son 5 sohbet: {len(recent_chats)}")
-            print(f"Diğer sohbetler: {len(other_chats)}")
-            
             # Son 5 sohbetin mesajlarını al
             for chat_data in recent_chats:
                 chat_id = chat_data["chat_id"]
-                messages_pipeline = [
-                    {"$match": {"chat_id": chat_id}},
-                    {"$sort": {"timestamp": -1}},  # En son mesajlar önce
-                    {"$limit": 30}  # Son 30 mesaj
-                ]
-                
-                chat_messages = list(self.messages.aggregate(messages_pipeline))
-                chat_data["messages"] = chat_messages
-                print(f"Chat {chat_id} için {len(chat_messages)} mesaj bulundu")
+                # Son 30 mesaj, en son mesajlar önce
+                chat_data["messages"] = self._find_newest_first(chat_id, {}, 0, 30, self._archived(chat_data))
             
             # Tüm sohbetleri birleştir
             all_chats = recent_chats + other_chats
@@ -813,59 +1183,247 @@ class ChatDatabase:
             # Chat nesnelerini oluştur
             chats = []
             for chat_data in all_chats:
-                chat = Chat(
-                    chat_id=chat_data["chat_id"],
-                    participants=chat_data["participants"],
-                    is_group=chat_data.get("is_group", False),
-                    group_name=chat_data.get("group_name"),
-                    group_admin=chat_data.get("group_admin"),
-                    created_at=chat_data["created_at"],
-                    updated_at=chat_data["updated_at"],
-                    is_active=chat_data["is_active"]
-                )
+                chat = Chat.from_db({k: v for k, v in chat_data.items() if k != "messages"})
                 
                 # Son mesajı ekle
                 if "messages" in chat_data and chat_data["messages"]:
-                    chat.last_message = Message(
-                        message_id=chat_data["messages"][0]["message_id"],
-                        chat_id=chat_data["chat_id"],
-                        sender_id=chat_data["messages"][0]["sender_id"],
-                        content=chat_data["messages"][0]["content"],
-                        timestamp=chat_data["messages"][0]["timestamp"],
-                        status=chat_data["messages"][0].get("status", {})
-                    )
+                    chat.last_message = Message.from_db({**chat_data["messages"][0], "chat_id": chat.chat_id})
                 else:
                     # Eğer mesajlar yoksa, son mesajı ayrıca al
-                    last_message = self.messages.find_one(
-                        {"chat_id": chat_data["chat_id"]},
-                        sort=[("timestamp", -1)]
-                    )
+                    last_messages = self._find_newest_first(chat_data["chat_id"], {}, 0, 1, self._archived(chat_data))
+                    last_message = last_messages[0] if last_messages else None
                     
                     if last_message:
-                        chat.last_message = Message(
-                            message_id=last_message["message_id"],
-                            chat_id=last_message["chat_id"],
-                            sender_id=last_message["sender_id"],
-                            content=last_message["content"],
-                            timestamp=last_message["timestamp"],
-                            status=last_message.get("status", {})
-                        )
+                        chat.last_message = Message.from_db(last_message)
                 
                 # Son 5 sohbet için mesajları ekle
                 if chat_data in recent_chats and "messages" in chat_data:
-                    chat.messages = [Message(**msg) for msg in chat_data["messages"]]
+                    chat.messages = [Message.from_db(msg) for msg in chat_data["messages"]]
                 
                 chats.append(chat)
             
-            print(f"\nToplam dönen chat sayısı: {len(chats)}")
-            print("=== get_user_chats_with_recent_messages bitti ===\n")
+            logger.debug("Son mesajlarla chat'ler getirildi", extra={"user_id": user_id, "chat_count": len(chats)})
             
             return chats
         except Exception as e:
-            print(f"\n!!! HATA !!!")
-            print(f"Hata mesajı: {str(e)}")
-            print(f"Hata tipi: {type(e)}")
-            import traceback
-            print(f"Stack trace: {traceback.format_exc()}")
-            print("!!! HATA !!!\n")
-            raise DatabaseError(f"Chat listesi getirme hatası: {str(e)}") 
\ No newline at end of file
+            logger.exception("Chat listesi getirme hatası", extra={"user_id": user_id})
+            raise DatabaseError(f"Chat listesi getirme hatası: {str(e)}")
+
+    def archive_chat(self, chat_id: str, cutoff_id: str, batch_size: int = 1000) -> int:
+        """
+        Chat'in cutoff_id'den eski mesajlarını messages_archive koleksiyonuna taşır.
+        Sıra: arşive kopyala -> arşiv sınırını ilerlet -> sıcak katmandan sil; böylece
+        yarıda kalan bir taşıma mesaj kaybetmez, okumalar ise kopyaları tekilleştirir.
+        """
+        archived = 0
+        while True:
+            messages, keys = self.store.take_older_than(chat_id, cutoff_id, batch_size)
+            if not messages:
+                return archived
+            self.archive.insert_many(messages)
+            seqs = [message["seq"] for message in messages if message.get("seq") is not None]
+            boundary = {"archived_through": max(message["message_id"] for message in messages)}
+            if seqs:
+                boundary["archived_seq"] = max(seqs)
+            self.chats.update_one({"chat_id": chat_id}, {"$max": boundary})
+            self.store.remove(keys)
+            archived += len(messages)
+
+    def archive_old_messages(self, default_days: int, batch_size: int = 1000,
+                             should_continue: Optional[Callable[[], bool]] = None) -> int:
+        """
+        Tüm chat'lerde yaşı eşiği aşan mesajları arşivler. Eşik chat bazında
+        archive_after_days alanıyla değiştirilebilir. should_continue False dönerse
+        (ör. liderlik kaybedildi) işlem chat aralarında durur.
+        """
+        archived = 0
+        now = datetime.now()
+        for chat in self.chats.find({}, {"_id": 0, "chat_id": 1, "archive_after_days": 1}):
+            if should_continue is not None and not should_continue():
+                break
+            days = chat.get("archive_after_days") or default_days
+            cutoff_id = id_from_datetime(now - timedelta(days=days))
+            oldest = self.store.oldest_message_id(chat["chat_id"])
+            if oldest is None or oldest >= cutoff_id:
+                continue
+            count = self.archive_chat(chat["chat_id"], cutoff_id, batch_size)
+            if count:
+                logger.info("Mesajlar arşivlendi", extra={"chat_id": chat["chat_id"], "count": count})
+            archived += count
+        return archived
+
+    def migrate_message_ids(self, batch_size: int = 500) -> int:
+        """
+        Eski rastgele message_id'leri (msg_xxxxxxxx) timestamp'ten türetilen sıralanabilir
+        kimliklerle değiştirir. reply_to ve chat'lerin last_message referansları da güncellenir;
+        eski kimlik legacy_message_id alanında saklanır. Tekrar çalıştırılabilir.
+        """
+        migrated = 0
+        last_ms = None
+        sequence = 0
+        message_ops, reference_ops, chat_ops = [], [], []
+
+        def flush():
+            if message_ops:
+                self.messages.bulk_write(message_ops, ordered=False)
+            if reference_ops:
+                self.messages.bulk_write(reference_ops, ordered=False)
+            if chat_ops:
+                self.chats.bulk_write(chat_ops, ordered=False)
+            message_ops.clear()
+            reference_ops.clear()
+            chat_ops.clear()
+
+        cursor = self.messages.find(
+            {"legacy_message_id": {"$exists": False}},
+            {"_id": 1, "message_id": 1, "timestamp": 1},
+            sort=[("timestamp", 1)]
+        )
+        for message in cursor:
+            old_id = message.get("message_id", "")
+            if is_sortable_id(old_id):
+                continue
+            try:
+                created = datetime.fromisoformat(str(message.get("timestamp", "")).replace("Z", "+00:00"))
+            except ValueError:
+                logger.warning("Mesaj timestamp'i okunamadı, atlandı", extra={"message_id": old_id})
+                continue
+
+            # Aynı milisaniyedeki mesajlar sıra numarasıyla ayrılır
+            ms = int(created.timestamp() * 1000)
+            sequence = sequence + 1 if ms == last_ms else 0
+            last_ms = ms
+            new_id = id_from_datetime(created, sequence=sequence)
+
+            message_ops.append(pymongo.UpdateOne(
+                {"_id": message["_id"]},
+                {"$set": {"message_id": new_id, "legacy_message_id": old_id}}
+            ))
+            reference_ops.append(pymongo.UpdateMany({"reply_to": old_id}, {"$set": {"reply_to": new_id}}))
+            chat_ops.append(pymongo.UpdateMany(
+                {"last_message.message_id": old_id},
+                {"$set": {"last_message.message_id": new_id}}
+            ))
+            migrated += 1
+            if len(message_ops) >= batch_size:
+                flush()
+        flush()
+
+        # Sıralama artık message_id üzerinden; eski timestamp indeksi gereksiz
+        try:
+            self.messages.drop_index([("chat_id", pymongo.ASCENDING), ("timestamp", pymongo.DESCENDING)])
+        except pymongo.errors.OperationFailure:
+            pass
+        return migrated
+
+    def backfill_message_seq(self) -> int:
+        """
+        seq alanı olmayan eski mesajlara message_id sırasıyla sohbet içi sıra numarası atar.
+        Yalnızca sayacı (chat_sequences) henüz oluşmamış chat'ler işlenir; sayaç önce
+        oluşturulduğu için bu sırada gelen yeni mesajlar numaralandırılan aralığın sonrasından devam eder.
+        """
+        backfilled = 0
+        for chat in self.chats.find({"last_seq": {"$exists": False}}, {"_id": 0, "chat_id": 1}):
+            chat_id = chat["chat_id"]
+            message_ids = [
+                message["message_id"] for message in self.messages.find(
+                    {"chat_id": chat_id, "seq": {"$exists": False}},
+                    {"_id": 0, "message_id": 1},
+                    sort=[("message_id", 1)]
+                )
+            ]
+            try:
+                self.sequences.insert_one({"_id": chat_id, "seq": len(message_ids)})
+            except DuplicateKeyError:
+                # Taşıma sırasında chat'e yeni mesaj yazıldı; eski mesajlar seq'siz kalır
+                logger.warning("Chat sayacı taşıma sırasında oluştu, atlandı", extra={"chat_id": chat_id})
+                continue
+            self.chats.update_one({"chat_id": chat_id}, {"$max": {"last_seq": len(message_ids)}})
+            operations = [
+                pymongo.UpdateOne({"chat_id": chat_id, "message_id": message_id}, {"$set": {"seq": seq}})
+                for seq, message_id in enumerate(message_ids, start=1)
+            ]
+            if operations:
+                self.messages.bulk_write(operations, ordered=False)
+            backfilled += len(operations)
+        return backfilled
+
+    def migrate_to_buckets(self) -> int:
+        """
+        messages koleksiyonundaki mesajları message_buckets kovalarına kopyalar.
+        MESSAGE_STORAGE=bucket ayarına geçmeden önce, message-seq taşımasından sonra çalıştırılmalıdır.
+        """
+        return BucketMessageStore(self.db).rebuild_from(self.messages)
+
+    def migrate_edit_history(self) -> int:
+        """
+        Mesaj dokümanlarındaki edit_history dizilerini message_edits koleksiyonuna taşır ve
+        dokümandan kaldırır. Tekrar çalıştırılabilir; kimlikler edited_at'ten türetildiğinden
+        yarıda kalan taşımalar kopya oluşturmaz.
+        """
+        migrated = 0
+        for collection in (self.messages, self.archive.collection):
+            cursor = collection.find(
+                {"edit_history": {"$exists": True}},
+                {"_id": 1, "chat_id": 1, "message_id": 1, "edit_history": 1}
+            )
+            for message in cursor:
+                edits = self._legacy_edits(message["chat_id"], message["message_id"], message.get("edit_history") or [])
+                if edits:
+                    try:
+                        self.edits.insert_many(edits, ordered=False)
+                    except pymongo.errors.BulkWriteError as e:
+                        if any(error.get("code") != 11000 for error in e.details.get("writeErrors", [])):
+                            raise
+                collection.update_one({"_id": message["_id"]}, {"$unset": {"edit_history": ""}})
+                migrated += len(edits)
+        return migrated
+
+    def backfill_chat_pair_keys(self) -> int:
+        """
+        pair_key alanı olmayan birebir sohbetlere kanonik anahtar ekler. Aynı iki kullanıcı
+        arasında birden fazla chat varsa anahtarı en son güncellenen alır; diğerleri
+        anahtarsız kalır ve loglanır. Tekrar çalıştırılabilir.
+        """
+        backfilled = 0
+        cursor = self.chats.find(
+            {"is_group": {"$ne": True}, "pair_key": {"$exists": False}},
+            {"_id": 1, "chat_id": 1, "participants": 1},
+            sort=[("updated_at", pymongo.DESCENDING)]
+        )
+        for chat in cursor:
+            pair_key = direct_pair_key(chat.get("participants") or [])
+            if pair_key is None:
+                continue
+            try:
+                self.chats.update_one({"_id": chat["_id"]}, {"$set": {"pair_key": pair_key}})
+                backfilled += 1
+            except DuplicateKeyError:
+                logger.warning("Aynı kullanıcılar arasında tekrarlanan birebir chat", extra={
+                    "chat_id": chat["chat_id"], "pair_key": pair_key
+                })
+        return backfilled
+
+    def ensure_unique_message_ids(self) -> int:
+        """
+        Sıcak ve arşiv katmanlarında (chat_id, message_id) indeksini benzersiz yapar;
+        kopya kimlik sayısını döndürür (0 ise indeksler hazırdır)
+        """
+        duplicates = 0
+        for store in (self.store, self.archive):
+            if isinstance(store, DocumentMessageStore):
+                duplicates += store.ensure_unique_message_ids()
+        return duplicates
+
+    def migrate_deleted_flag(self) -> int:
+        """
+        Eski sürümün yazdığı deleted alanını okumaların kullandığı is_deleted alanına çevirir
+        """
+        migrated = 0
+        for collection in (self.messages, self.archive.collection):
+            result = collection.update_many(
+                {"deleted": True},
+                {"$set": {"is_deleted": True}, "$unset": {"deleted": ""}}
+            )
+            migrated += result.modified_count
+        return migrated
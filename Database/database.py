@@ -1,12 +1,15 @@
 from bson.json_util import dumps
 import pymongo
-from exceptions import DatabaseError, NotFoundError, DuplicateError
-from pymongo.errors import DuplicateKeyError
+from exceptions import DatabaseError
 from typing import Optional, List, Dict, Any
 from bson import ObjectId
 import os
 from dotenv import load_dotenv
 from Database.user_db import UserDB
+from Database.friendship_db import FriendshipDB, FriendshipStatus
+from Database.suggestion_db import SuggestionDB
+from Database.notification_db import NotificationDB
+from Database.activity_db import ActivityDB
 
 # .env dosyasını yükle
 load_dotenv()
@@ -21,23 +24,30 @@ class Database:
             myclient = pymongo.MongoClient(connection_string)
             self.db = myclient["search_db"]
             self.user_db = UserDB(self.db)
+            self.friendship_db = FriendshipDB(self.db)
+            self.suggestion_db = SuggestionDB(self.db, self.friendship_db)
+            self.notification_db = NotificationDB(self.db)
             from Database.chat_db import ChatDatabase
             self.chat_db = ChatDatabase(self.db)
-            self.activities = self.db["activities"]
+            self.activity_db = ActivityDB(self.db)
+            self.activities = self.activity_db.activities
         except pymongo.errors.ConnectionError as e:
             raise DatabaseError(f"Veritabanına bağlanılamadı: {str(e)}")
         except Exception as e:
             raise DatabaseError(f"Beklenmeyen bir hata oluştu: {str(e)}")
 
     # Users Collection İşlemleri
-    def get_all_users(self) -> List[Dict[str, Any]]:
-        return self.user_db.get_all_users()
+    def get_all_users(self, fields: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        return self.user_db.get_all_users(fields)
 
-    def get_user_by_email(self, email: str) -> Optional[Dict[str, Any]]:
-        return self.user_db.get_user_by_email(email)
+    def get_user_by_email(self, email: str, fields: Optional[List[str]] = None) -> Optional[Dict[str, Any]]:
+        return self.user_db.get_user_by_email(email, fields)
 
-    def get_user_by_id(self, user_id: str) -> Optional[Dict[str, Any]]:
-        return self.user_db.get_user_by_id(user_id)
+    def get_user_by_id(self, user_id: str, fields: Optional[List[str]] = None) -> Optional[Dict[str, Any]]:
+        return self.user_db.get_user_by_id(user_id, fields)
+
+    def get_users_by_ids(self, user_ids: List[str], fields: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        return self.user_db.get_users_by_ids(user_ids, fields)
 
     def insert_user(self, user_data: Dict[str, Any]) -> None:
         self.user_db.insert_user(user_data)
@@ -48,69 +58,102 @@ class Database:
     def soft_delete_user(self, user_id: str) -> bool:
         return self.user_db.soft_delete_user(user_id)
 
-    # Activities Collection İşlemleri
-    def get_all_activities(self) -> List[Dict[str, Any]]:
-        try:
-            activities = list(self.activities.find({}, {"_id": 0}))
-            return self.user_db._convert_to_json(activities)
-        except Exception as e:
-            raise DatabaseError(f"Aktiviteler getirilirken hata oluştu: {str(e)}")
+    # Friendships Collection İşlemleri
+    def add_friend_request(self, user_id: str, friend_id: str) -> bool:
+        result = self.friendship_db.add_friend_request(user_id, friend_id)
+        # İlişki, sayaçlar ve ortak arkadaşlar her iki profilde de değişir
+        self.user_db.bump_versions([user_id, friend_id])
+        return result
 
-    def get_activity_by_id(self, activity_id: str) -> Optional[Dict[str, Any]]:
-        try:
-            activity = self.activities.find_one({"activity_id": activity_id}, {"_id": 0})
-            return self.user_db._convert_to_json(activity) if activity else None
-        except Exception as e:
-            raise DatabaseError(f"Aktivite getirilirken hata oluştu: {str(e)}")
+    def accept_friend_request(self, user_id: str, friend_id: str) -> bool:
+        result = self.friendship_db.accept_friend_request(user_id, friend_id)
+        # İlişki, sayaçlar ve ortak arkadaşlar her iki profilde de değişir
+        self.user_db.bump_versions([user_id, friend_id])
+        return result
+
+    def reject_friend_request(self, user_id: str, friend_id: str) -> bool:
+        result = self.friendship_db.reject_friend_request(user_id, friend_id)
+        # İlişki, sayaçlar ve ortak arkadaşlar her iki profilde de değişir
+        self.user_db.bump_versions([user_id, friend_id])
+        return result
+
+    def are_friends(self, user_id: str, other_id: str) -> bool:
+        return self.friendship_db.are_friends(user_id, other_id)
+
+    def get_relationship(self, user_id: str, other_id: str) -> Optional[str]:
+        return self.friendship_db.get_relationship(user_id, other_id)
+
+    def get_relationships(self, user_id: str, other_ids: List[str]) -> Dict[str, str]:
+        return self.friendship_db.get_relationships(user_id, other_ids)
+
+    def get_friend_ids(self, user_id: str, status: str = FriendshipStatus.FRIEND,
+                       after: Optional[str] = None, limit: int = 50) -> List[str]:
+        return self.friendship_db.get_friend_ids(user_id, status, after, limit)
+
+    def count_friends(self, user_id: str, status: str = FriendshipStatus.FRIEND) -> int:
+        return self.friendship_db.count(user_id, status)
+
+    def get_mutual_friend_count(self, user_id: str, other_id: str) -> int:
+        return self.friendship_db.get_mutual_friend_count(user_id, other_id)
+
+    # Friend Suggestions Collection İşlemleri
+    def get_friend_suggestions(self, user_id: str, limit: int = 20) -> List[Dict[str, Any]]:
+        return self.suggestion_db.get_suggestions(user_id, limit)
+
+    # Notifications Collection İşlemleri
+    def get_notifications(self, user_id: str, before: Optional[str] = None, limit: int = 20) -> Dict[str, Any]:
+        return self.notification_db.get_notifications(user_id, before, limit)
+
+    def mark_notification_as_read(self, user_id: str, notification_id: Optional[str] = None) -> bool:
+        return self.notification_db.mark_as_read(user_id, notification_id)
+
+    # Activities Collection İşlemleri
+    def get_all_activities(self, fields: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        return self.activity_db.get_all_activities(fields)
+
+    def get_activity_feed(self, upcoming: bool = False, date_from: Optional[str] = None,
+                          date_to: Optional[str] = None, location: Optional[str] = None,
+                          has_free_slots: bool = False, after: Optional[str] = None,
+                          limit: int = 20) -> Dict[str, Any]:
+        return self.activity_db.get_feed(
+            upcoming=upcoming, date_from=date_from, date_to=date_to, location=location,
+            has_free_slots=has_free_slots, after=after, limit=limit
+        )
+
+    def get_nearby_activities(self, latitude: float, longitude: float, max_distance_m: float = 10_000,
+                              upcoming: bool = True, after: Optional[str] = None,
+                              limit: int = 20) -> Dict[str, Any]:
+        return self.activity_db.get_nearby(latitude, longitude, max_distance_m, upcoming, after, limit)
+
+    def get_activity_by_id(self, activity_id: str, fields: Optional[List[str]] = None) -> Optional[Dict[str, Any]]:
+        return self.activity_db.get_activity_by_id(activity_id, fields)
 
     def insert_activity(self, activity_data: Dict[str, Any]) -> None:
-        try:
-            self.activities.insert_one(activity_data)
-        except DuplicateKeyError:
-            raise DuplicateError("Bu aktivite zaten mevcut")
-        except Exception as e:
-            raise DatabaseError(f"Aktivite eklenirken hata oluştu: {str(e)}")
+        return self.activity_db.insert_activity(activity_data)
 
     def update_activity(self, activity_id: str, update_data: Dict[str, Any]) -> bool:
-        try:
-            result = self.activities.update_one(
-                {"activity_id": activity_id},
-                {"$set": update_data}
-            )
-            if result.modified_count == 0:
-                raise NotFoundError("Güncellenecek aktivite bulunamadı")
-            return True
-        except Exception as e:
-            raise DatabaseError(f"Aktivite güncellenirken hata oluştu: {str(e)}")
+        return self.activity_db.update_activity(activity_id, update_data)
+
+    def update_activity_details(self, activity_id: str, update_data: Dict[str, Any]) -> bool:
+        return self.activity_db.update_activity_details(activity_id, update_data)
+
+    def join_activity(self, activity_id: str, user_id: str) -> Dict[str, Any]:
+        return self.activity_db.join_activity(activity_id, user_id)
+
+    def leave_activity(self, activity_id: str, user_id: str) -> Dict[str, Any]:
+        return self.activity_db.leave_activity(activity_id, user_id)
 
     def delete_activity(self, activity_id: str) -> bool:
-        try:
-            result = self.activities.delete_one({"activity_id": activity_id})
-            if result.deleted_count == 0:
-                raise NotFoundError("Silinecek aktivite bulunamadı")
-            return True
-        except Exception as e:
-            raise DatabaseError(f"Aktivite silinirken hata oluştu: {str(e)}")
+        return self.activity_db.delete_activity(activity_id)
 
-    def get_user_activities(self, user_id: str) -> List[Dict[str, Any]]:
-        try:
-            # Kullanıcının oluşturduğu aktiviteler
-            created_activities = list(self.activities.find({"creator_id": user_id}, {"_id": 0}))
-            
-            # Kullanıcının katıldığı aktiviteler
-            participated_activities = list(self.activities.find({"participants": user_id}, {"_id": 0}))
-            
-            # Tüm aktiviteleri birleştir ve tekrar edenleri kaldır
-            all_activities = created_activities + participated_activities
-            unique_activities = {activity["activity_id"]: activity for activity in all_activities}.values()
-            
-            return self.user_db._convert_to_json(list(unique_activities))
-        except Exception as e:
-            raise DatabaseError(f"Kullanıcı aktiviteleri getirilirken hata oluştu: {str(e)}")
+    def get_user_activities(self, user_id: str, fields: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        return self.activity_db.get_user_activities(user_id, fields)
 
     # Genel İşlemler
     def close(self):
         try:
+            # Birleştirilmiş chat özeti güncellemeleri bağlantı kapanmadan yazılır
+            self.chat_db.close()
             self.db.client.close()
         except Exception as e:
             raise DatabaseError(f"Veritabanı bağlantısı kapatılırken hata oluştu: {str(e)}")
@@ -0,0 +1,234 @@
+import pymongo
+from pymongo import UpdateOne, DeleteOne
+from exceptions import DatabaseError, NotFoundError, DuplicateError
+from typing import Optional, List, Dict, Any
+import datetime
+
+class FriendshipStatus:
+    FRIEND = "friend"
+    SENT = "sent"
+    RECEIVED = "received"
+
+class FriendshipDB:
+    """
+    Sosyal grafı kullanıcı dokümanlarındaki diziler yerine ayrı bir kenar (edge)
+    koleksiyonunda tutar. Her ilişki iki yönlü kenar olarak saklanır:
+    {user_id, friend_id, status, created_at, updated_at}
+
+    (user_id, friend_id) üzerindeki tekil indeks sayesinde "arkadaş mıyız"
+    kontrolü tek bir indeks erişimidir; (user_id, status, friend_id) indeksi ise
+    sayfalı listeleme ve sayımlar için kullanılır.
+    """
+
+    def __init__(self, db):
+        self.friendships = db["friendships"]
+        self.friendships.create_index(
+            [("user_id", pymongo.ASCENDING), ("friend_id", pymongo.ASCENDING)],
+            unique=True
+        )
+        self.friendships.create_index(
+            [("user_id", pymongo.ASCENDING), ("status", pymongo.ASCENDING), ("friend_id", pymongo.ASCENDING)]
+        )
+
+    def add_friend_request(self, user_id: str, friend_id: str) -> bool:
+        try:
+            if user_id == friend_id:
+                raise DuplicateError("Kendinize arkadaşlık isteği gönderemezsiniz")
+            now = datetime.datetime.now().isoformat()
+            # Kenarlar zaten varsa (istek ya da arkadaşlık) $setOnInsert hiçbir şey yapmaz
+            result = self.friendships.bulk_write([
+                UpdateOne(
+                    {"user_id": user_id, "friend_id": friend_id},
+                    {"$setOnInsert": {"status": FriendshipStatus.SENT, "created_at": now, "updated_at": now}},
+                    upsert=True
+                ),
+                UpdateOne(
+                    {"user_id": friend_id, "friend_id": user_id},
+                    {"$setOnInsert": {"status": FriendshipStatus.RECEIVED, "created_at": now, "updated_at": now}},
+                    upsert=True
+                )
+            ], ordered=True)
+            if result.upserted_count < 2:
+                # Kenarlardan biri zaten vardı (ör. karşı taraf aynı anda istek gönderdi);
+                # bu çağrının eklediği tek kenar geri alınır, tek yönlü istek kalmaz
+                if result.upserted_ids:
+                    self.friendships.delete_many({"_id": {"$in": list(result.upserted_ids.values())}})
+                raise DuplicateError("Arkadaşlık isteği zaten gönderilmiş veya zaten arkadaşsınız")
+            return True
+        except DuplicateError:
+            raise
+        except Exception as e:
+            raise DatabaseError(f"Arkadaşlık isteği gönderilirken hata oluştu: {str(e)}")
+
+    def accept_friend_request(self, user_id: str, friend_id: str) -> bool:
+        try:
+            now = datetime.datetime.now().isoformat()
+            result = self.friendships.bulk_write([
+                UpdateOne(
+                    {"user_id": user_id, "friend_id": friend_id, "status": FriendshipStatus.RECEIVED},
+                    {"$set": {"status": FriendshipStatus.FRIEND, "updated_at": now}}
+                ),
+                UpdateOne(
+                    {"user_id": friend_id, "friend_id": user_id, "status": FriendshipStatus.SENT},
+                    {"$set": {"status": FriendshipStatus.FRIEND, "updated_at": now}}
+                )
+            ], ordered=True)
+            if result.matched_count < 2:
+                if result.matched_count:
+                    # Yalnızca bir kenar güncellendi; updated_at bu çağrının yazdığı kenarı işaretler
+                    self.friendships.bulk_write([
+                        UpdateOne(
+                            {"user_id": user_id, "friend_id": friend_id, "status": FriendshipStatus.FRIEND, "updated_at": now},
+                            {"$set": {"status": FriendshipStatus.RECEIVED}}
+                        ),
+                        UpdateOne(
+                            {"user_id": friend_id, "friend_id": user_id, "status": FriendshipStatus.FRIEND, "updated_at": now},
+                            {"$set": {"status": FriendshipStatus.SENT}}
+                        )
+                    ], ordered=False)
+                raise NotFoundError("Bu kullanıcıdan gelen arkadaşlık isteği bulunamadı")
+            return True
+        except NotFoundError:
+            raise
+        except Exception as e:
+            raise DatabaseError(f"Arkadaşlık isteği kabul edilirken hata oluştu: {str(e)}")
+
+    def reject_friend_request(self, user_id: str, friend_id: str) -> bool:
+        try:
+            result = self.friendships.bulk_write([
+                DeleteOne({"user_id": user_id, "friend_id": friend_id, "status": FriendshipStatus.RECEIVED}),
+                DeleteOne({"user_id": friend_id, "friend_id": user_id, "status": FriendshipStatus.SENT})
+            ], ordered=True)
+            # Yalnızca bir yönde kalan kenar silinir ama istek bulunamamış sayılır
+            if result.deleted_count < 2:
+                raise NotFoundError("Bu kullanıcıdan gelen arkadaşlık isteği bulunamadı")
+            return True
+        except NotFoundError:
+            raise
+        except Exception as e:
+            raise DatabaseError(f"Arkadaşlık isteği reddedilirken hata oluştu: {str(e)}")
+
+    def get_relationship(self, user_id: str, other_id: str) -> Optional[str]:
+        """
+        İki kullanıcı arasındaki ilişki durumunu döndürür (friend/sent/received veya None)
+        """
+        try:
+            edge = self.friendships.find_one(
+                {"user_id": user_id, "friend_id": other_id},
+                {"_id": 0, "status": 1}
+            )
+            return edge["status"] if edge else None
+        except Exception as e:
+            raise DatabaseError(f"Arkadaşlık durumu getirilirken hata oluştu: {str(e)}")
+
+    def get_relationships(self, user_id: str, other_ids: List[str]) -> Dict[str, str]:
+        """
+        Bir kullanıcının verilen kullanıcılarla ilişkilerini tek sorguda getirir
+        """
+        try:
+            if not other_ids:
+                return {}
+            edges = self.friendships.find(
+                {"user_id": user_id, "friend_id": {"$in": other_ids}},
+                {"_id": 0, "friend_id": 1, "status": 1}
+            )
+            return {edge["friend_id"]: edge["status"] for edge in edges}
+        except Exception as e:
+            raise DatabaseError(f"Arkadaşlık durumları getirilirken hata oluştu: {str(e)}")
+
+    def are_friends(self, user_id: str, other_id: str) -> bool:
+        return self.get_relationship(user_id, other_id) == FriendshipStatus.FRIEND
+
+    def get_friend_ids(self, user_id: str, status: str = FriendshipStatus.FRIEND,
+                       after: Optional[str] = None, limit: int = 50) -> List[str]:
+        """
+        İlişki listesini friend_id sırasına göre, imleç (cursor) ile sayfalı getirir.
+        after: bir önceki sayfanın son friend_id değeri
+        """
+        try:
+            query = {"user_id": user_id, "status": status}
+            if after:
+                query["friend_id"] = {"$gt": after}
+            edges = self.friendships.find(
+                query,
+                {"_id": 0, "friend_id": 1}
+            ).sort("friend_id", pymongo.ASCENDING).limit(limit)
+            return [edge["friend_id"] for edge in edges]
+        except Exception as e:
+            raise DatabaseError(f"Arkadaş listesi getirilirken hata oluştu: {str(e)}")
+
+    def count(self, user_id: str, status: str = FriendshipStatus.FRIEND) -> int:
+        try:
+            return self.friendships.count_documents({"user_id": user_id, "status": status})
+        except Exception as e:
+            raise DatabaseError(f"Arkadaş sayısı getirilirken hata oluştu: {str(e)}")
+
+    def get_mutual_friend_count(self, user_id: str, other_id: str) -> int:
+        try:
+            pipeline = [
+                {"$match": {
+                    "user_id": {"$in": [user_id, other_id]},
+                    "status": FriendshipStatus.FRIEND
+                }},
+                {"$group": {"_id": "$friend_id", "count": {"$sum": 1}}},
+                {"$match": {"count": 2}},
+                {"$count": "mutual"}
+            ]
+            result = list(self.friendships.aggregate(pipeline))
+            return result[0]["mutual"] if result else 0
+        except Exception as e:
+            raise DatabaseError(f"Ortak arkadaş sayısı getirilirken hata oluştu: {str(e)}")
+
+    def migrate_from_user_arrays(self, users, drop_arrays: bool = False, batch_size: int = 1000) -> int:
+        """
+        users koleksiyonundaki friends/sent_requests/received_requests dizilerini
+        kenar koleksiyonuna taşır. Tekrar çalıştırılması güvenlidir (upsert).
+        Taşınan kenar sayısını döndürür.
+        """
+        try:
+            now = datetime.datetime.now().isoformat()
+            field_status = [
+                ("friends", FriendshipStatus.FRIEND),
+                ("sent_requests", FriendshipStatus.SENT),
+                ("received_requests", FriendshipStatus.RECEIVED)
+            ]
+            cursor = users.find(
+                {"$or": [{field: {"$exists": True, "$ne": []}} for field, _ in field_status]},
+                {"_id": 0, "user_id": 1, "friends": 1, "sent_requests": 1, "received_requests": 1}
+            )
+            operations = []
+            migrated = 0
+            for user in cursor:
+                for field, status in field_status:
+                    for other_id in user.get(field) or []:
+                        # Arkadaşlık, bekleyen istekten önceliklidir
+                        if status == FriendshipStatus.FRIEND:
+                            update = {
+                                "$set": {"status": status, "updated_at": now},
+                                "$setOnInsert": {"created_at": now}
+                            }
+                        else:
+                            update = {
+                                "$setOnInsert": {"status": status, "created_at": now, "updated_at": now}
+                            }
+                        operations.append(UpdateOne(
+                            {"user_id": user["user_id"], "friend_id": other_id},
+                            update,
+                            upsert=True
+                        ))
+                if len(operations) >= batch_size:
+                    migrated += len(operations)
+                    self.friendships.bulk_write(operations, ordered=False)
+                    operations = []
+            if operations:
+                migrated += len(operations)
+                self.friendships.bulk_write(operations, ordered=False)
+
+            if drop_arrays:
+                users.update_many(
+                    {},
+                    {"$unset": {"friends": "", "sent_requests": "", "received_requests": ""}}
+                )
+            return migrated
+        except Exception as e:
+            raise DatabaseError(f"Arkadaşlık verileri taşınırken hata oluştu: {str(e)}")
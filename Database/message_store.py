@@ -0,0 +1,438 @@
+"""
+Mesaj saklama katmanı.
+
+ChatDatabase mesajlara doğrudan koleksiyon üzerinden değil bu arayüz
+üzerinden erişir. İki mod vardır (MESSAGE_STORAGE ortam değişkeni):
+
+    document  Her mesaj messages koleksiyonunda ayrı bir dokümandır (varsayılan)
+    bucket    Bir sohbetin ardışık MESSAGE_BUCKET_SIZE mesajı message_buckets
+              koleksiyonunda tek dokümanda tutulur; kova numarası seq'ten
+              türetilir. Kısa metinlerde doküman başına yük ve son sayfa için
+              okunan indeks/doküman sayısı azalır.
+
+Sorgular her iki modda da mesaj alanları üzerinden yazılır (ör.
+{"message_id": {"$lt": x}}); kova modu bunları $unwind ile uygular ve
+bilinen biçimlerde taranacak kovaları önceden daraltır.
+"""
+import math
+import os
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+
+import pymongo
+from pymongo import ReturnDocument
+
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+MESSAGE_STORAGE = os.getenv("MESSAGE_STORAGE", "document").lower()
+MESSAGE_BUCKET_SIZE = int(os.getenv("MESSAGE_BUCKET_SIZE", "50"))
+
+ChatIds = Union[str, List[str]]
+Sort = Sequence[Tuple[str, int]]
+
+DEFAULT_SORT: Sort = (("message_id", pymongo.DESCENDING),)
+MESSAGE_ID_INDEX = [("chat_id", pymongo.ASCENDING), ("message_id", pymongo.DESCENDING)]
+
+
+def _chat_filter(chat_id: ChatIds) -> Dict[str, Any]:
+    return {"chat_id": {"$in": chat_id}} if isinstance(chat_id, list) else {"chat_id": chat_id}
+
+
+class MessageStore:
+    """
+    Mesaj saklama arayüzü
+    """
+
+    def insert(self, message: dict) -> None:
+        raise NotImplementedError
+
+    def find(self, chat_id: ChatIds, query: Optional[dict] = None, sort: Sort = DEFAULT_SORT,
+             skip: int = 0, limit: int = 0, projection: Optional[dict] = None) -> List[dict]:
+        raise NotImplementedError
+
+    def find_one(self, chat_id: str, query: dict, projection: Optional[dict] = None) -> Optional[dict]:
+        found = self.find(chat_id, query, limit=1, projection=projection)
+        return found[0] if found else None
+
+    def count(self, chat_id: str, query: Optional[dict] = None) -> int:
+        raise NotImplementedError
+
+    def update(self, chat_id: str, query: dict, update: dict) -> Tuple[int, int]:
+        """
+        query ile eşleşen tek mesajı günceller; (eşleşen, değişen) sayılarını döndürür
+        """
+        raise NotImplementedError
+
+    def find_one_and_update(self, chat_id: str, query: dict, update: dict,
+                            return_document: bool = ReturnDocument.AFTER) -> Optional[dict]:
+        """
+        query ile eşleşen tek mesajı tek istekte günceller; mesajın güncelleme öncesi veya
+        sonrası halini, eşleşme yoksa None döndürür
+        """
+        raise NotImplementedError
+
+    def last_message_lookup(self) -> List[dict]:
+        """
+        chats aggregation'ına eklenen ve her chat'e last_message alanını ekleyen aşamalar
+        """
+        raise NotImplementedError
+
+    def oldest_message_id(self, chat_id: str) -> Optional[str]:
+        oldest = self.find(chat_id, sort=[("message_id", pymongo.ASCENDING)], limit=1, projection={"message_id": 1})
+        return oldest[0]["message_id"] if oldest else None
+
+    def take_older_than(self, chat_id: str, cutoff_id: str, limit: int) -> Tuple[List[dict], List[Any]]:
+        """
+        Arşivlenecek, cutoff_id'den eski mesajları ve bunları silmek için gereken anahtarları döndürür
+        """
+        raise NotImplementedError
+
+    def remove(self, keys: List[Any]) -> None:
+        raise NotImplementedError
+
+
+class DocumentMessageStore(MessageStore):
+    def __init__(self, db, name: str = "messages", archive: bool = False):
+        if archive and name not in db.list_collection_names():
+            # Soğuk veride okuma seyrek, boyut önemli: zstd blok sıkıştırması
+            try:
+                db.create_collection(name, storageEngine={"wiredTiger": {"configString": "block_compressor=zstd"}})
+            except pymongo.errors.CollectionInvalid:
+                pass
+        self.collection = db[name]
+
+        # Geçmiş sayfalama ve yeniden bağlanma senkronizasyonu için indeksler.
+        # message_id zamana göre sıralanabilir olduğundan (ids.py) sıralama anahtarı olarak kullanılır.
+        # Her iki katmanda da benzersizdir; yarıda kalan arşiv taşıması tekrarlandığında veya
+        # iki worker aynı kimliği ürettiğinde kopya mesaj oluşmaz
+        try:
+            self.collection.create_index(MESSAGE_ID_INDEX, unique=True)
+        except pymongo.errors.OperationFailure as e:
+            # Eski kurulumlarda aynı anahtarlarla benzersiz olmayan indeks vardır
+            logger.warning(
+                "message_id indeksi benzersiz değil; 'python -m Database.migrations message-id-index' çalıştırılmalı",
+                extra={"collection": name, "error": str(e)}
+            )
+        # İstemci tekrar denemeleri message_client_keys koleksiyonunda ayıklanır (chat_db.py);
+        # önceki sürümün bu koleksiyonda kurduğu indeks her yazmaya ek maliyet getirdiğinden kaldırılır
+        for index_name, info in self.collection.index_information().items():
+            if [key for key, _ in info["key"]] == ["chat_id", "sender_id", "client_message_id"]:
+                self.collection.drop_index(index_name)
+        # Sohbet içi sıra numarası: boşluk tespiti ve after_seq ile aralık senkronizasyonu
+        self.collection.create_index(
+            [("chat_id", pymongo.ASCENDING), ("seq", pymongo.ASCENDING)],
+            unique=True,
+            partialFilterExpression={"seq": {"$exists": True}}
+        )
+        self.collection.create_index(
+            [("chat_id", pymongo.ASCENDING), ("status_updated_at", pymongo.ASCENDING)],
+            partialFilterExpression={"status_updated_at": {"$exists": True}}
+        )
+
+    def ensure_unique_message_ids(self) -> int:
+        """
+        (chat_id, message_id) indeksini benzersiz olarak yeniden oluşturur. Kopya mesaj
+        varsa indekse dokunulmaz ve kopyalanmış kimlik sayısı döndürülür.
+        """
+        duplicates = list(self.collection.aggregate([
+            {"$group": {"_id": {"chat_id": "$chat_id", "message_id": "$message_id"}, "count": {"$sum": 1}}},
+            {"$match": {"count": {"$gt": 1}}},
+            {"$count": "duplicates"}
+        ], allowDiskUse=True))
+        if duplicates:
+            return duplicates[0]["duplicates"]
+        for name, info in self.collection.index_information().items():
+            if info["key"] == MESSAGE_ID_INDEX and not info.get("unique"):
+                self.collection.drop_index(name)
+        self.collection.create_index(MESSAGE_ID_INDEX, unique=True)
+        return 0
+
+    def insert(self, message: dict) -> None:
+        self.collection.insert_one(message)
+        message.pop("_id", None)
+
+    def find(self, chat_id, query=None, sort=DEFAULT_SORT, skip=0, limit=0, projection=None):
+        cursor = self.collection.find(
+            {**_chat_filter(chat_id), **(query or {})},
+            {"_id": 0, **(projection or {})},
+            sort=list(sort)
+        )
+        if skip:
+            cursor = cursor.skip(skip)
+        if limit:
+            cursor = cursor.limit(limit)
+        return list(cursor)
+
+    def count(self, chat_id, query=None):
+        return self.collection.count_documents({**_chat_filter(chat_id), **(query or {})})
+
+    def update(self, chat_id, query, update):
+        result = self.collection.update_one({"chat_id": chat_id, **query}, update)
+        return result.matched_count, result.modified_count
+
+    def find_one_and_update(self, chat_id, query, update, return_document=ReturnDocument.AFTER):
+        return self.collection.find_one_and_update(
+            {"chat_id": chat_id, **query},
+            update,
+            projection={"_id": 0},
+            return_document=return_document
+        )
+
+    def last_message_lookup(self):
+        return [
+            {"$lookup": {
+                "from": self.collection.name,
+                "let": {"chat_id": "$chat_id"},
+                "pipeline": [
+                    {"$match": {"$expr": {"$eq": ["$chat_id", "$$chat_id"]}}},
+                    {"$sort": {"message_id": -1}},
+                    {"$limit": 1}
+                ],
+                "as": "last_message"
+            }},
+            {"$unwind": {"path": "$last_message", "preserveNullAndEmptyArrays": True}}
+        ]
+
+    def take_older_than(self, chat_id, cutoff_id, limit):
+        messages = list(self.collection.find(
+            {"chat_id": chat_id, "message_id": {"$lt": cutoff_id}},
+            sort=[("message_id", pymongo.ASCENDING)]
+        ).limit(limit))
+        keys = [message.pop("_id") for message in messages]
+        return messages, keys
+
+    def remove(self, keys):
+        if keys:
+            self.collection.delete_many({"_id": {"$in": keys}})
+
+    def insert_many(self, messages: List[dict]) -> None:
+        """
+        Tekrar çalıştırmada zaten var olan mesajlar atlanır
+        """
+        if not messages:
+            return
+        try:
+            self.collection.insert_many(messages, ordered=False)
+        except pymongo.errors.BulkWriteError as e:
+            if any(error.get("code") != 11000 for error in e.details.get("writeErrors", [])):
+                raise
+
+
+class BucketMessageStore(MessageStore):
+    def __init__(self, db, bucket_size: int = MESSAGE_BUCKET_SIZE):
+        self.collection = db["message_buckets"]
+        self.bucket_size = bucket_size
+
+        self.collection.create_index([("chat_id", pymongo.ASCENDING), ("bucket", pymongo.DESCENDING)], unique=True)
+        self.collection.create_index([("chat_id", pymongo.ASCENDING), ("last_seq", pymongo.ASCENDING)])
+        self.collection.create_index([("chat_id", pymongo.ASCENDING), ("first_message_id", pymongo.DESCENDING)])
+        self.collection.create_index(
+            [("chat_id", pymongo.ASCENDING), ("status_updated_at", pymongo.ASCENDING)],
+            partialFilterExpression={"status_updated_at": {"$exists": True}}
+        )
+
+    def bucket_of(self, seq: int) -> int:
+        return (seq - 1) // self.bucket_size
+
+    def insert(self, message: dict) -> None:
+        if message.get("seq") is None:
+            raise ValueError("Kova modunda mesajın seq alanı olmalı")
+        message.pop("_id", None)
+        self.collection.update_one(
+            {"chat_id": message["chat_id"], "bucket": self.bucket_of(message["seq"])},
+            {
+                "$push": {"messages": message},
+                "$inc": {"count": 1},
+                "$min": {"first_seq": message["seq"], "first_message_id": message["message_id"]},
+                "$max": {"last_seq": message["seq"], "last_message_id": message["message_id"]}
+            },
+            upsert=True
+        )
+
+    def _bucket_match(self, chat_id: ChatIds, query: dict) -> Dict[str, Any]:
+        """
+        Bilinen sorgu biçimlerinde taranacak kovaları daraltır
+        """
+        match = _chat_filter(chat_id)
+        message_id = query.get("message_id")
+        seq = query.get("seq")
+        status_updated_at = query.get("status_updated_at")
+
+        if isinstance(message_id, dict) and "$lt" in message_id:
+            match["first_message_id"] = {"$lt": message_id["$lt"]}
+        elif isinstance(message_id, dict) and "$gt" in message_id:
+            match["last_message_id"] = {"$gt": message_id["$gt"]}
+        if isinstance(seq, dict) and "$gt" in seq:
+            match["last_seq"] = {"$gt": seq["$gt"]}
+        if isinstance(status_updated_at, dict) and "$gt" in status_updated_at:
+            match["status_updated_at"] = {"$gt": status_updated_at["$gt"]}
+        return match
+
+    def find(self, chat_id, query=None, sort=DEFAULT_SORT, skip=0, limit=0, projection=None):
+        query = query or {}
+        match = self._bucket_match(chat_id, query)
+        newest_first = not sort or sort[0][1] == pymongo.DESCENDING
+        # Tek chat'te yalnızca sıralama/imleç sorgusu varsa önce yoğun seq varsayımıyla gereken
+        # kova sayısı okunur. seq'te boşluk (eklenemeyen mesaj) olan kovalar eksik dolu olduğundan
+        # sayfa dolmazsa ve daha fazla kova varsa sınır iki katına çıkarılıp tekrar okunur
+        prunable = set(query) <= {"message_id", "seq"} and limit and isinstance(chat_id, str)
+        bucket_limit = math.ceil((skip + limit) / self.bucket_size) + 1 if prunable else 0
+        while True:
+            pipeline = [{"$match": match}, {"$sort": {"bucket": -1 if newest_first else 1}}]
+            if bucket_limit:
+                pipeline.append({"$limit": bucket_limit})
+            pipeline += [
+                {"$unwind": "$messages"},
+                {"$replaceRoot": {"newRoot": "$messages"}}
+            ]
+            if query:
+                pipeline.append({"$match": query})
+            if sort:
+                pipeline.append({"$sort": dict(sort)})
+            if skip:
+                pipeline.append({"$skip": skip})
+            if limit:
+                pipeline.append({"$limit": limit})
+            pipeline.append({"$project": {"_id": 0, **(projection or {})}})
+            messages = list(self.collection.aggregate(pipeline))
+            if (not bucket_limit or len(messages) >= limit
+                    or self.collection.count_documents(match, limit=bucket_limit + 1) <= bucket_limit):
+                return messages
+            bucket_limit *= 2
+
+    def count(self, chat_id, query=None):
+        if not query:
+            result = list(self.collection.aggregate([
+                {"$match": {"chat_id": chat_id}},
+                {"$group": {"_id": None, "total": {"$sum": "$count"}}}
+            ]))
+        else:
+            result = list(self.collection.aggregate([
+                {"$match": {"chat_id": chat_id}},
+                {"$unwind": "$messages"},
+                {"$replaceRoot": {"newRoot": "$messages"}},
+                {"$match": query},
+                {"$count": "total"}
+            ]))
+        return result[0]["total"] if result else 0
+
+    @staticmethod
+    def _array_update(update: dict) -> Dict[str, dict]:
+        # Mesaj alanlarındaki güncellemeler dizideki eşleşen elemana uygulanır
+        array_update: Dict[str, dict] = {}
+        for operator, fields in update.items():
+            array_update[operator] = {f"messages.$[m].{key}": value for key, value in fields.items()}
+        if "status_updated_at" in update.get("$set", {}):
+            array_update.setdefault("$max", {})["status_updated_at"] = update["$set"]["status_updated_at"]
+        return array_update
+
+    def update(self, chat_id, query, update):
+        result = self.collection.update_one(
+            {"chat_id": chat_id, "messages": {"$elemMatch": query}},
+            self._array_update(update),
+            array_filters=[{f"m.{key}": value for key, value in query.items()}]
+        )
+        return result.matched_count, result.modified_count
+
+    def find_one_and_update(self, chat_id, query, update, return_document=ReturnDocument.AFTER):
+        # Dönen kovadan yalnızca ilgili mesaj alınır; güncelleme sorgudaki alanları
+        # değiştirebileceğinden projeksiyon yalnızca message_id ile eşleştirilir
+        match = {"message_id": query["message_id"]} if "message_id" in query else query
+        bucket = self.collection.find_one_and_update(
+            {"chat_id": chat_id, "messages": {"$elemMatch": query}},
+            self._array_update(update),
+            projection={"_id": 0, "messages": {"$elemMatch": match}},
+            array_filters=[{f"m.{key}": value for key, value in query.items()}],
+            return_document=return_document
+        )
+        messages = bucket.get("messages") if bucket else None
+        return messages[0] if messages else None
+
+    def last_message_lookup(self):
+        return [
+            {"$lookup": {
+                "from": self.collection.name,
+                "let": {"chat_id": "$chat_id"},
+                "pipeline": [
+                    {"$match": {"$expr": {"$eq": ["$chat_id", "$$chat_id"]}}},
+                    {"$sort": {"bucket": -1}},
+                    {"$limit": 1},
+                    {"$project": {"_id": 0, "message": {"$arrayElemAt": ["$messages", -1]}}}
+                ],
+                "as": "last_bucket"
+            }},
+            {"$unwind": {"path": "$last_bucket", "preserveNullAndEmptyArrays": True}},
+            {"$addFields": {"last_message": "$last_bucket.message"}},
+            {"$project": {"last_bucket": 0}}
+        ]
+
+    def take_older_than(self, chat_id, cutoff_id, limit):
+        # Kovalar bütün olarak taşınır: yalnızca tüm mesajları cutoff'tan eski olanlar
+        buckets = list(self.collection.find(
+            {"chat_id": chat_id, "last_message_id": {"$lt": cutoff_id}},
+            {"_id": 1, "messages": 1},
+            sort=[("bucket", pymongo.ASCENDING)]
+        ).limit(max(1, limit // self.bucket_size)))
+        messages = [message for bucket in buckets for message in bucket.get("messages", [])]
+        return messages, [bucket["_id"] for bucket in buckets]
+
+    def remove(self, keys):
+        if keys:
+            self.collection.delete_many({"_id": {"$in": keys}})
+
+    def rebuild_from(self, messages_collection, batch_size: int = 200) -> int:
+        """
+        messages koleksiyonundaki seq'li mesajlardan kovaları yeniden oluşturur (tekrar çalıştırılabilir).
+        Kova moduna geçmeden önce çalıştırılmalıdır.
+        """
+        migrated = 0
+        operations = []
+        current_key, current = None, []
+
+        def close_bucket():
+            if not current:
+                return
+            chat_id, bucket = current_key
+            operations.append(pymongo.ReplaceOne(
+                {"chat_id": chat_id, "bucket": bucket},
+                {
+                    "chat_id": chat_id,
+                    "bucket": bucket,
+                    "count": len(current),
+                    "first_seq": current[0]["seq"],
+                    "last_seq": current[-1]["seq"],
+                    "first_message_id": min(message["message_id"] for message in current),
+                    "last_message_id": max(message["message_id"] for message in current),
+                    "messages": list(current)
+                },
+                upsert=True
+            ))
+
+        cursor = messages_collection.find(
+            {"seq": {"$exists": True}},
+            {"_id": 0},
+            sort=[("chat_id", pymongo.ASCENDING), ("seq", pymongo.ASCENDING)]
+        )
+        for message in cursor:
+            key = (message["chat_id"], self.bucket_of(message["seq"]))
+            if key != current_key:
+                close_bucket()
+                current_key, current = key, []
+                if len(operations) >= batch_size:
+                    self.collection.bulk_write(operations, ordered=False)
+                    operations = []
+            current.append(message)
+            migrated += 1
+        close_bucket()
+        if operations:
+            self.collection.bulk_write(operations, ordered=False)
+        return migrated
+
+
+def create_message_store(db, mode: str = MESSAGE_STORAGE) -> MessageStore:
+    if mode == "bucket":
+        return BucketMessageStore(db)
+    if mode != "document":
+        raise ValueError(f"Geçersiz MESSAGE_STORAGE değeri: {mode}")
+    return DocumentMessageStore(db)
@@ -0,0 +1,165 @@
+"""
+Veritabanı taşıma (migration) araçları.
+
+Kullanım:
+    python -m Database.migrations friendships [--drop-arrays]
+    python -m Database.migrations suggestions
+    python -m Database.migrations activities
+    python -m Database.migrations message-ids
+    python -m Database.migrations message-seq
+    python -m Database.migrations message-buckets
+    python -m Database.migrations message-edits
+    python -m Database.migrations message-deleted-flag
+    python -m Database.migrations chat-pair-keys
+    python -m Database.migrations message-id-index
+    python -m Database.migrations user-indexes
+"""
+import argparse
+from Database.database import Database
+
+
+def migrate_friendships(db: Database, drop_arrays: bool = False) -> int:
+    """
+    users dokümanlarındaki friends/sent_requests/received_requests dizilerini
+    friendships kenar koleksiyonuna taşır.
+    """
+    return db.friendship_db.migrate_from_user_arrays(db.user_db.users, drop_arrays=drop_arrays)
+
+
+def rebuild_suggestions(db: Database) -> int:
+    """
+    Tüm kullanıcıların öneri kümelerini friendships ve activities verilerinden yeniden hesaplar.
+    """
+    rebuilt = 0
+    for user in db.user_db.users.find({"is_deleted": {"$ne": True}}, {"_id": 0, "user_id": 1}):
+        db.suggestion_db.rebuild_for_user(user["user_id"])
+        rebuilt += 1
+    return rebuilt
+
+
+def backfill_activity_dates(db: Database) -> int:
+    """
+    Eski aktivitelere sıralama ve filtreleme için kullanılan activity_at alanını ekler.
+    """
+    return db.activity_db.backfill_activity_at()
+
+
+def migrate_message_ids(db: Database) -> int:
+    """
+    Eski rastgele mesaj kimliklerini timestamp'ten türetilen sıralanabilir kimliklere çevirir.
+    """
+    return db.chat_db.migrate_message_ids()
+
+
+def backfill_message_seq(db: Database) -> int:
+    """
+    Eski mesajlara sohbet içi sıra numarası (seq) atar. message-ids taşımasından sonra çalıştırılmalıdır.
+    """
+    return db.chat_db.backfill_message_seq()
+
+
+def migrate_to_buckets(db: Database) -> int:
+    """
+    Mesajları kova (bucket) saklama düzenine kopyalar. message-seq taşımasından sonra çalıştırılmalıdır.
+    """
+    return db.chat_db.migrate_to_buckets()
+
+
+def migrate_edit_history(db: Database) -> int:
+    """
+    Mesaj dokümanlarındaki düzenleme geçmişini message_edits koleksiyonuna taşır.
+    """
+    return db.chat_db.migrate_edit_history()
+
+
+def migrate_deleted_flag(db: Database) -> int:
+    """
+    Silinmiş mesajlardaki eski deleted alanını is_deleted alanına çevirir.
+    """
+    return db.chat_db.migrate_deleted_flag()
+
+
+def backfill_chat_pair_keys(db: Database) -> int:
+    """
+    Birebir sohbetlere tekrar oluşturmayı engelleyen kanonik pair_key alanını ekler.
+    """
+    return db.chat_db.backfill_chat_pair_keys()
+
+
+def ensure_unique_message_ids(db: Database) -> int:
+    """
+    Mesaj koleksiyonlarındaki (chat_id, message_id) indeksini benzersiz olarak yeniden oluşturur.
+    """
+    return db.chat_db.ensure_unique_message_ids()
+
+
+def migrate_user_indexes(db: Database) -> dict:
+    """
+    Eski kullanıcılara is_deleted alanını ekler ve benzersiz email/user_id indekslerini oluşturur.
+    """
+    return db.user_db.migrate_indexes()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="MeetApp veritabanı taşıma araçları")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    friendships = subparsers.add_parser("friendships", help="Arkadaşlık dizilerini kenar koleksiyonuna taşı")
+    friendships.add_argument("--drop-arrays", action="store_true", help="Taşıma sonrası kullanıcı dokümanlarındaki dizileri sil")
+
+    subparsers.add_parser("suggestions", help="Arkadaş önerilerini yeniden hesapla")
+    subparsers.add_parser("activities", help="Eski aktivitelere activity_at alanını ekle")
+    subparsers.add_parser("message-ids", help="Eski mesaj kimliklerini sıralanabilir kimliklere çevir")
+    subparsers.add_parser("message-seq", help="Eski mesajlara sohbet içi sıra numarası ata")
+    subparsers.add_parser("message-buckets", help="Mesajları kova saklama düzenine kopyala")
+    subparsers.add_parser("message-edits", help="Mesaj düzenleme geçmişini message_edits koleksiyonuna taşı")
+    subparsers.add_parser("message-deleted-flag", help="Silinmiş mesajlardaki deleted alanını is_deleted alanına çevir")
+    subparsers.add_parser("chat-pair-keys", help="Birebir sohbetlere pair_key alanını ekle")
+    subparsers.add_parser("message-id-index", help="Mesaj kimliği indeksini benzersiz yap")
+    subparsers.add_parser("user-indexes", help="Kullanıcı e-posta ve kimlik indekslerini benzersiz yap")
+
+    args = parser.parse_args()
+    db = Database()
+    try:
+        if args.command == "friendships":
+            migrated = migrate_friendships(db, drop_arrays=args.drop_arrays)
+            print(f"Taşınan arkadaşlık kenarı sayısı: {migrated}")
+        elif args.command == "suggestions":
+            rebuilt = rebuild_suggestions(db)
+            print(f"Önerileri yeniden hesaplanan kullanıcı sayısı: {rebuilt}")
+        elif args.command == "activities":
+            updated = backfill_activity_dates(db)
+            print(f"activity_at alanı eklenen aktivite sayısı: {updated}")
+        elif args.command == "message-ids":
+            migrated = migrate_message_ids(db)
+            print(f"Kimliği yenilenen mesaj sayısı: {migrated}")
+        elif args.command == "message-seq":
+            backfilled = backfill_message_seq(db)
+            print(f"Sıra numarası atanan mesaj sayısı: {backfilled}")
+        elif args.command == "message-buckets":
+            copied = migrate_to_buckets(db)
+            print(f"Kovalara kopyalanan mesaj sayısı: {copied}")
+        elif args.command == "message-edits":
+            migrated = migrate_edit_history(db)
+            print(f"Taşınan düzenleme kaydı sayısı: {migrated}")
+        elif args.command == "message-deleted-flag":
+            migrated = migrate_deleted_flag(db)
+            print(f"is_deleted alanına çevrilen mesaj sayısı: {migrated}")
+        elif args.command == "chat-pair-keys":
+            backfilled = backfill_chat_pair_keys(db)
+            print(f"pair_key eklenen chat sayısı: {backfilled}")
+        elif args.command == "message-id-index":
+            duplicates = ensure_unique_message_ids(db)
+            print(f"Kopya mesaj kimliği sayısı: {duplicates}" if duplicates else "Mesaj kimliği indeksi benzersiz")
+        elif args.command == "user-indexes":
+            duplicates = migrate_user_indexes(db)
+            if any(duplicates.values()):
+                print(f"Kopya kayıtlar çözülmeli (e-posta: {duplicates['email']}, user_id: {duplicates['user_id']})")
+            else:
+                print("Kullanıcı indeksleri benzersiz")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
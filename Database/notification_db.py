@@ -0,0 +1,128 @@
+import pymongo
+from exceptions import DatabaseError, NotFoundError
+from typing import Optional, List, Dict, Any
+import datetime
+
+# Kullanıcı başına saklanan en fazla bildirim sayısı (en eskiler atılır)
+NOTIFICATION_INBOX_LIMIT = 200
+
+class NotificationDB:
+    """
+    Kullanıcı başına tek bir gelen kutusu dokümanı tutar:
+    {user_id, items: [Notification, ...]}
+
+    Yeni bildirimler $push + $slice ile eklenir; böylece kutu tek bir yazma
+    işlemiyle hem güncellenir hem de NOTIFICATION_INBOX_LIMIT ile sınırlı kalır.
+    items dizisi eskiden yeniye sıralıdır.
+    """
+
+    def __init__(self, db):
+        self.inboxes = db["notification_inboxes"]
+        self.inboxes.create_index([("user_id", pymongo.ASCENDING)], unique=True)
+
+    def add_notification(self, notification: Dict[str, Any]) -> None:
+        try:
+            self.inboxes.update_one(
+                {"user_id": notification["user_id"]},
+                {"$push": {"items": {"$each": [notification], "$slice": -NOTIFICATION_INBOX_LIMIT}}},
+                upsert=True
+            )
+        except Exception as e:
+            raise DatabaseError(f"Bildirim kaydedilirken hata oluştu: {str(e)}")
+
+    def get_notifications(self, user_id: str, before: Optional[str] = None, limit: int = 20) -> Dict[str, Any]:
+        """
+        Bildirimleri yeniden eskiye, imleçle sayfalı getirir.
+        before: bir önceki sayfanın son bildiriminin created_at değeri
+        """
+        try:
+            items = "$items"
+            if before:
+                items = {"$filter": {
+                    "input": "$items",
+                    "as": "n",
+                    "cond": {"$lt": ["$$n.created_at", before]}
+                }}
+            pipeline = [
+                {"$match": {"user_id": user_id}},
+                {"$project": {
+                    "_id": 0,
+                    "items": {"$slice": [items, -limit]},
+                    "unread_count": {"$size": {"$filter": {
+                        "input": "$items",
+                        "as": "n",
+                        "cond": {"$eq": ["$$n.is_read", False]}
+                    }}}
+                }}
+            ]
+            result = list(self.inboxes.aggregate(pipeline))
+            if not result:
+                return {"notifications": [], "unread_count": 0, "next_cursor": None}
+            notifications = list(reversed(result[0]["items"]))
+            return {
+                "notifications": notifications,
+                "unread_count": result[0]["unread_count"],
+                "next_cursor": notifications[-1]["created_at"] if len(notifications) == limit else None
+            }
+        except Exception as e:
+            raise DatabaseError(f"Bildirimler getirilirken hata oluştu: {str(e)}")
+
+    def pop_pending(self, user_id: str) -> List[Dict[str, Any]]:
+        """
+        Teslim edilmemiş bildirimleri döndürür ve tek işlemde teslim edildi olarak işaretler
+        """
+        try:
+            inbox = self.inboxes.find_one_and_update(
+                {"user_id": user_id, "items.delivered": False},
+                {"$set": {"items.$[n].delivered": True}},
+                array_filters=[{"n.delivered": False}],
+                projection={"_id": 0, "items": 1},
+                return_document=pymongo.ReturnDocument.BEFORE
+            )
+            if not inbox:
+                return []
+            return [item for item in inbox.get("items", []) if not item.get("delivered")]
+        except Exception as e:
+            raise DatabaseError(f"Bekleyen bildirimler getirilirken hata oluştu: {str(e)}")
+
+    def mark_pending(self, user_id: str, notification_ids: List[str]) -> None:
+        """
+        Gönderimi başarısız olan bildirimleri tekrar teslim edilmedi olarak işaretler
+        """
+        try:
+            if not notification_ids:
+                return
+            self.inboxes.update_one(
+                {"user_id": user_id},
+                {"$set": {"items.$[n].delivered": False}},
+                array_filters=[{"n.notification_id": {"$in": notification_ids}}]
+            )
+        except Exception as e:
+            raise DatabaseError(f"Bildirim durumu güncellenirken hata oluştu: {str(e)}")
+
+    def mark_as_read(self, user_id: str, notification_id: Optional[str] = None) -> bool:
+        """
+        Bir bildirimi (notification_id verilmezse tüm bildirimleri) okundu olarak işaretler
+        """
+        try:
+            query = {"user_id": user_id}
+            if notification_id:
+                query["items.notification_id"] = notification_id
+                array_filter = {"n.notification_id": notification_id}
+            else:
+                array_filter = {"n.is_read": False}
+            result = self.inboxes.update_one(
+                query,
+                {"$set": {
+                    "items.$[n].is_read": True,
+                    "items.$[n].read_at": datetime.datetime.now().isoformat()
+                }},
+                array_filters=[array_filter]
+            )
+            if notification_id and result.matched_count == 0:
+                raise NotFoundError("Bildirim bulunamadı")
+            return True
+        except NotFoundError:
+            raise
+        except Exception as e:
+            raise DatabaseError(f"Bildirim güncellenirken hata oluştu: {str(e)}")
@@ -0,0 +1,15 @@
+from typing import Dict, Iterable, Optional
+
+
+def build_projection(fields: Optional[Iterable[str]] = None, required: Iterable[str] = ()) -> Dict[str, int]:
+    """
+    Alan listesinden MongoDB projeksiyonu oluşturur.
+
+    fields verilmezse _id dışındaki tüm alanlar döner. Verilirse yalnızca bu alanlar
+    ve metodun kendi çalışması için gereken `required` alanları okunur.
+    """
+    projection = {"_id": 0}
+    if fields:
+        for field in (*required, *fields):
+            projection[field] = 1
+    return projection
@@ -0,0 +1,283 @@
+import pymongo
+from pymongo import UpdateOne
+from exceptions import DatabaseError
+from typing import List, Dict, Any, Iterable
+from cache import TTLCache
+from Database.friendship_db import FriendshipDB, FriendshipStatus
+
+# Skor ağırlıkları: ortak arkadaş sayısı ve ortak aktivite katılımı
+MUTUAL_FRIEND_WEIGHT = 1.0
+SHARED_ACTIVITY_WEIGHT = 0.5
+
+# Bir arkadaşlık değişikliğinde güncellenecek en fazla komşu sayısı.
+# Çok bağlantılı (hub) kullanıcılarda tek bir kabulün binlerce yazma üretmesini engeller.
+MAX_FANOUT = 1000
+
+# Önbellekte kullanıcı başına tutulan sıralı öneri sayısı; istekler bu listenin başından dilimlenir
+MAX_CACHED_SUGGESTIONS = 100
+
+class SuggestionDB:
+    """
+    "Tanıyor olabileceğin kişiler" önerileri.
+
+    Aday kümeleri friend_suggestions koleksiyonunda önceden hesaplanmış olarak tutulur:
+    {user_id, candidate_id, mutual_count, shared_activities, score}
+
+    Arkadaşlık kabul edildiğinde ve aktivitelere katılım olduğunda ilgili çiftlerin
+    sayaçları artımlı olarak güncellenir; okuma tarafı indeksli tek bir sorgu ve
+    süreç içi önbellekten beslenir.
+    """
+
+    def __init__(self, db, friendship_db: FriendshipDB):
+        self.suggestions = db["friend_suggestions"]
+        self.activities = db["activities"]
+        self.friendship_db = friendship_db
+        self.cache = TTLCache(maxsize=10000, ttl=300)
+        self.suggestions.create_index(
+            [("user_id", pymongo.ASCENDING), ("candidate_id", pymongo.ASCENDING)],
+            unique=True
+        )
+        self.suggestions.create_index(
+            [("user_id", pymongo.ASCENDING), ("score", pymongo.DESCENDING)]
+        )
+
+    def _increment_op(self, user_id: str, candidate_id: str, mutual: int = 0, shared: int = 0) -> UpdateOne:
+        # Sayaç artışı ve skor hesabı tek bir pipeline güncellemesinde atomik yapılır.
+        # Azaltmalar olmayan öneri kaydı oluşturmaz ve sayaçlar sıfırın altına inmez.
+        return UpdateOne(
+            {"user_id": user_id, "candidate_id": candidate_id},
+            [
+                {"$set": {
+                    "mutual_count": {"$max": [0, {"$add": [{"$ifNull": ["$mutual_count", 0]}, mutual]}]},
+                    "shared_activities": {"$max": [0, {"$add": [{"$ifNull": ["$shared_activities", 0]}, shared]}]}
+                }},
+                {"$set": {
+                    "score": {"$add": [
+                        {"$multiply": ["$mutual_count", MUTUAL_FRIEND_WEIGHT]},
+                        {"$multiply": ["$shared_activities", SHARED_ACTIVITY_WEIGHT]}
+                    ]}
+                }}
+            ],
+            upsert=mutual >= 0 and shared >= 0
+        )
+
+    def _mutual_op(self, user_id: str, candidate_id: str, mutual: int) -> UpdateOne:
+        # Ortak arkadaş sayısı mevcut durumdan hesaplanıp yazılır; skor aynı güncellemede yenilenir
+        return UpdateOne(
+            {"user_id": user_id, "candidate_id": candidate_id},
+            [
+                {"$set": {
+                    "mutual_count": mutual,
+                    "shared_activities": {"$ifNull": ["$shared_activities", 0]}
+                }},
+                {"$set": {
+                    "score": {"$add": [
+                        {"$multiply": ["$mutual_count", MUTUAL_FRIEND_WEIGHT]},
+                        {"$multiply": ["$shared_activities", SHARED_ACTIVITY_WEIGHT]}
+                    ]}
+                }}
+            ],
+            upsert=True
+        )
+
+    def _mutual_counts(self, friend_ids: List[str], candidate_ids: List[str]) -> Dict[str, int]:
+        """
+        Her adayın friend_ids içindeki arkadaş sayısı (yani kullanıcıyla ortak arkadaş sayısı)
+        """
+        if not friend_ids or not candidate_ids:
+            return {}
+        pipeline = [
+            {"$match": {
+                "user_id": {"$in": candidate_ids},
+                "status": FriendshipStatus.FRIEND,
+                "friend_id": {"$in": friend_ids}
+            }},
+            {"$group": {"_id": "$user_id", "count": {"$sum": 1}}}
+        ]
+        return {row["_id"]: row["count"] for row in self.friendship_db.friendships.aggregate(pipeline)}
+
+    def _all_friend_ids(self, user_id: str) -> List[str]:
+        """
+        Kullanıcının tüm arkadaşlarını MAX_FANOUT'luk sayfalarla getirir
+        """
+        friend_ids = []
+        after = None
+        while True:
+            page = self.friendship_db.get_friend_ids(user_id, after=after, limit=MAX_FANOUT)
+            friend_ids.extend(page)
+            if len(page) < MAX_FANOUT:
+                return friend_ids
+            after = page[-1]
+
+    def _write(self, operations: List[UpdateOne], affected_users: Iterable[str]) -> None:
+        if operations:
+            self.suggestions.bulk_write(operations, ordered=False)
+        for user_id in affected_users:
+            self.cache.delete(user_id)
+
+    def on_friendship_added(self, user_id: str, friend_id: str) -> None:
+        """
+        user_id ile friend_id arkadaş olduğunda etkilenen çiftlerin (kullanıcı ile
+        arkadaşının arkadaşları) ortak arkadaş sayılarını yeniden hesaplar.
+        Sayılar artırılmak yerine mevcut kenarlardan hesaplandığı için aynı anda
+        kabul edilen komşu arkadaşlıklar aynı ortak arkadaşı iki kez saymaz.
+        """
+        try:
+            # Sayılar tam listelerden hesaplanır; kesilmiş liste doğru sayının üzerine küçüğünü yazardı
+            user_friends = self._all_friend_ids(user_id)
+            friend_friends = self._all_friend_ids(friend_id)
+            user_friend_set = set(user_friends)
+            friend_friend_set = set(friend_friends)
+
+            # Zaten arkadaş olan çiftler için öneri tutulmaz. Yazma sayısı MAX_FANOUT ile sınırlanır;
+            # kapsam dışında kalan çiftler bir sonraki kabulde veya rebuild_for_user ile güncellenir
+            user_candidates = [f for f in friend_friends if f != user_id and f not in user_friend_set][:MAX_FANOUT]
+            friend_candidates = [f for f in user_friends if f != friend_id and f not in friend_friend_set][:MAX_FANOUT]
+            user_counts = self._mutual_counts(user_friends, user_candidates)
+            friend_counts = self._mutual_counts(friend_friends, friend_candidates)
+
+            operations = []
+            for owner_id, counts, candidates in (
+                (user_id, user_counts, user_candidates),
+                (friend_id, friend_counts, friend_candidates)
+            ):
+                for other_id in candidates:
+                    mutual = counts.get(other_id, 0)
+                    operations.append(self._mutual_op(owner_id, other_id, mutual))
+                    operations.append(self._mutual_op(other_id, owner_id, mutual))
+
+            # Artık arkadaş olan çift birbirine önerilmez
+            self.suggestions.delete_many({"$or": [
+                {"user_id": user_id, "candidate_id": friend_id},
+                {"user_id": friend_id, "candidate_id": user_id}
+            ]})
+            self._write(operations, [user_id, friend_id] + user_candidates + friend_candidates)
+        except Exception as e:
+            raise DatabaseError(f"Öneriler güncellenirken hata oluştu: {str(e)}")
+
+    def on_activity_joined(self, user_id: str, other_participants: List[str]) -> None:
+        """
+        Kullanıcı bir aktiviteye katıldığında diğer katılımcılarla ortak aktivite
+        sayacını bir artırır.
+        """
+        try:
+            operations = []
+            others = [p for p in other_participants if p != user_id]
+            for other_id in others:
+                operations.append(self._increment_op(user_id, other_id, shared=1))
+                operations.append(self._increment_op(other_id, user_id, shared=1))
+            self._write(operations, [user_id] + others)
+        except Exception as e:
+            raise DatabaseError(f"Öneriler güncellenirken hata oluştu: {str(e)}")
+
+    def on_activity_created(self, participants: List[str]) -> None:
+        """
+        Aktivite ilk katılımcılarıyla oluşturulduğunda tüm çiftleri günceller.
+        """
+        unique = list(dict.fromkeys(participants))
+        for index, user_id in enumerate(unique):
+            # Her çift yalnızca bir kez (iki yönlü) işlenir
+            self.on_activity_joined(user_id, unique[index + 1:])
+
+    def on_activity_left(self, user_id: str, remaining_participants: List[str]) -> None:
+        """
+        Kullanıcı aktiviteden ayrıldığında kalan katılımcılarla ortak aktivite
+        sayacını bir azaltır.
+        """
+        try:
+            operations = []
+            others = [p for p in remaining_participants if p != user_id]
+            for other_id in others:
+                operations.append(self._increment_op(user_id, other_id, shared=-1))
+                operations.append(self._increment_op(other_id, user_id, shared=-1))
+            self._write(operations, [user_id] + others)
+        except Exception as e:
+            raise DatabaseError(f"Öneriler güncellenirken hata oluştu: {str(e)}")
+
+    def on_activity_deleted(self, participants: List[str]) -> None:
+        """
+        Aktivite silindiğinde katılımcılar arasındaki tüm çiftlerin sayacını azaltır.
+        """
+        unique = list(dict.fromkeys(participants))
+        for index, user_id in enumerate(unique):
+            self.on_activity_left(user_id, unique[index + 1:])
+
+    def get_suggestions(self, user_id: str, limit: int = 20) -> List[Dict[str, Any]]:
+        """
+        Kullanıcı için skora göre sıralı önerileri getirir (önbellekli)
+        """
+        try:
+            # Sıralı liste bir kez hesaplanıp önbelleğe alınır; farklı limitler aynı listeden dilimlenir
+            cached = self.cache.get(user_id)
+            if cached is not None:
+                return cached[:limit]
+
+            candidates = list(self.suggestions.find(
+                {"user_id": user_id},
+                {"_id": 0, "candidate_id": 1, "mutual_count": 1, "shared_activities": 1, "score": 1}
+            ).sort("score", pymongo.DESCENDING).limit(MAX_CACHED_SUGGESTIONS * 2))
+
+            # Zaten arkadaş olanlar veya bekleyen isteği olanlar elenir
+            relationships = self.friendship_db.get_relationships(
+                user_id, [c["candidate_id"] for c in candidates]
+            )
+            result = [
+                c for c in candidates
+                if c["candidate_id"] != user_id and c["candidate_id"] not in relationships
+            ][:MAX_CACHED_SUGGESTIONS]
+            self.cache.set(user_id, result)
+            return result[:limit]
+        except Exception as e:
+            raise DatabaseError(f"Öneriler getirilirken hata oluştu: {str(e)}")
+
+    def _count_second_degree(self, user_id: str, friend_ids: List[str]) -> Dict[str, int]:
+        pipeline = [
+            {"$match": {
+                "user_id": {"$in": friend_ids},
+                "status": FriendshipStatus.FRIEND,
+                "friend_id": {"$nin": friend_ids + [user_id]}
+            }},
+            {"$group": {"_id": "$friend_id", "count": {"$sum": 1}}}
+        ]
+        return {row["_id"]: row["count"] for row in self.friendship_db.friendships.aggregate(pipeline)}
+
+    def _count_shared_activities(self, user_id: str) -> Dict[str, int]:
+        pipeline = [
+            {"$match": {"participants": user_id}},
+            {"$unwind": "$participants"},
+            {"$match": {"participants": {"$ne": user_id}}},
+            {"$group": {"_id": "$participants", "count": {"$sum": 1}}}
+        ]
+        return {row["_id"]: row["count"] for row in self.activities.aggregate(pipeline)}
+
+    def rebuild_for_user(self, user_id: str) -> int:
+        """
+        Bir kullanıcının aday kümesini sıfırdan hesaplar (ilk doldurma ve onarım için).
+        Yazılan aday sayısını döndürür.
+        """
+        try:
+            friend_ids = self._all_friend_ids(user_id)
+            mutual_counts = self._count_second_degree(user_id, friend_ids) if friend_ids else {}
+            shared_counts = self._count_shared_activities(user_id)
+            friend_set = set(friend_ids)
+
+            operations = []
+            for candidate_id in set(mutual_counts) | set(shared_counts):
+                if candidate_id in friend_set:
+                    continue
+                mutual = mutual_counts.get(candidate_id, 0)
+                shared = shared_counts.get(candidate_id, 0)
+                operations.append(UpdateOne(
+                    {"user_id": user_id, "candidate_id": candidate_id},
+                    {"$set": {
+                        "mutual_count": mutual,
+                        "shared_activities": shared,
+                        "score": mutual * MUTUAL_FRIEND_WEIGHT + shared * SHARED_ACTIVITY_WEIGHT
+                    }},
+                    upsert=True
+                ))
+            self.suggestions.delete_many({"user_id": user_id})
+            self._write(operations, [user_id])
+            return len(operations)
+        except Exception as e:
+            raise DatabaseError(f"Öneriler yeniden hesaplanırken hata oluştu: {str(e)}")
@@ -3,55 +3,116 @@ import pymongo
 from exceptions import DatabaseError, NotFoundError, DuplicateError
 from pymongo.errors import DuplicateKeyError
 from typing import Optional, List, Dict, Any
-from bson import ObjectId
+from Database.projection import build_projection
+from logger import get_logger
 import datetime
 
+logger = get_logger(__name__)
+
 class UserDB:
     def __init__(self, db):
         self.users = db["users"]
+        self.create_indexes(strict=False)
+
+    def create_indexes(self, strict: bool = True) -> None:
+        """
+        Giriş/kayıt e-posta ile, profil ve arkadaşlık yolları user_id ile tek indeks erişimi yapar.
+        E-posta yalnızca silinmemiş hesaplar arasında benzersizdir; silinen hesabın adresiyle yeniden kayıt olunabilir.
+        strict=False ise oluşturulamayan indeks uyarı olarak loglanır ve uygulama yine açılır.
+        """
+        indexes = [
+            ("email", {"unique": True, "partialFilterExpression": {"is_deleted": False}}),
+            ("user_id", {"unique": True})
+        ]
+        for field, options in indexes:
+            try:
+                self.users.create_index(field, **options)
+            except pymongo.errors.OperationFailure as e:
+                if strict:
+                    raise
+                # Eski veride kopya kayıt olabilir; 'python -m Database.migrations user-indexes' çalıştırılmalı
+                logger.warning("Kullanıcı indeksi oluşturulamadı", extra={"field": field, "error": str(e)})
 
-    def _convert_to_json(self, data):
+    def migrate_indexes(self) -> Dict[str, int]:
         """
-        MongoDB'den gelen verileri JSON'a dönüştürür.
-        ObjectId'leri string'e çevirir.
+        is_deleted alanı olmayan eski kullanıcılara is_deleted=False ekler ve benzersiz indeksleri oluşturur.
+        Kopya e-posta (aktif hesaplar arasında) veya user_id varsa indekslere dokunulmaz; kopya sayıları döndürülür.
         """
-        if isinstance(data, list):
-            return [self._convert_to_json(item) for item in data]
-        elif isinstance(data, dict):
-            return {key: self._convert_to_json(value) for key, value in data.items()}
-        elif isinstance(data, ObjectId):
-            return str(data)
-        return data
+        try:
+            self.users.update_many({"is_deleted": {"$exists": False}}, {"$set": {"is_deleted": False}})
+            duplicates = {
+                "email": self._count_duplicates("email", {"is_deleted": False}),
+                "user_id": self._count_duplicates("user_id", {})
+            }
+            if not any(duplicates.values()):
+                # Önceki sürümün silinmiş hesapları da kapsayan e-posta indeksi kısmi olanla değiştirilir
+                for name, info in self.users.index_information().items():
+                    if info["key"] == [("email", 1)] and "partialFilterExpression" not in info:
+                        self.users.drop_index(name)
+                self.create_indexes()
+            return duplicates
+        except Exception as e:
+            raise DatabaseError(f"Kullanıcı indeksleri oluşturulurken hata oluştu: {str(e)}")
 
-    def get_all_users(self) -> List[Dict[str, Any]]:
+    def _count_duplicates(self, field: str, match: Dict[str, Any]) -> int:
+        result = list(self.users.aggregate([
+            {"$match": match},
+            {"$group": {"_id": f"${field}", "count": {"$sum": 1}}},
+            {"$match": {"count": {"$gt": 1}}},
+            {"$count": "duplicates"}
+        ]))
+        return result[0]["duplicates"] if result else 0
+
+    def get_all_users(self, fields: Optional[List[str]] = None) -> List[Dict[str, Any]]:
         try:
             # Sadece silinmemiş kullanıcıları getir
-            users = list(self.users.find({"is_deleted": {"$ne": True}}, {"_id": 0}))
-            return self._convert_to_json(users)
+            return list(self.users.find({"is_deleted": {"$ne": True}}, build_projection(fields)))
         except Exception as e:
             raise DatabaseError(f"Kullanıcılar getirilirken hata oluştu: {str(e)}")
 
-    def get_user_by_email(self, email: str) -> Optional[Dict[str, Any]]:
+    def get_user_by_email(self, email: str, fields: Optional[List[str]] = None) -> Optional[Dict[str, Any]]:
         try:
             # Sadece silinmemiş kullanıcıları getir
-            user = self.users.find_one({"email": email, "is_deleted": {"$ne": True}}, {"_id": 0})
-            return self._convert_to_json(user) if user else None
+            return self.users.find_one({"email": email, "is_deleted": {"$ne": True}}, build_projection(fields))
         except Exception as e:
             raise DatabaseError(f"Kullanıcı getirilirken hata oluştu: {str(e)}")
 
-    def get_user_by_id(self, user_id: str) -> Optional[Dict[str, Any]]:
+    def get_user_by_id(self, user_id: str, fields: Optional[List[str]] = None) -> Optional[Dict[str, Any]]:
         try:
             # Sadece silinmemiş kullanıcıları getir
-            user = self.users.find_one({"user_id": user_id, "is_deleted": {"$ne": True}}, {"_id": 0})
-            return self._convert_to_json(user) if user else None
+            return self.users.find_one({"user_id": user_id, "is_deleted": {"$ne": True}}, build_projection(fields))
         except Exception as e:
             raise DatabaseError(f"Kullanıcı getirilirken hata oluştu: {str(e)}")
 
+    def get_users_by_ids(self, user_ids: List[str], fields: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        try:
+            if not user_ids:
+                return []
+            return list(self.users.find(
+                {"user_id": {"$in": user_ids}, "is_deleted": {"$ne": True}},
+                build_projection(fields, required=("user_id",))
+            ))
+        except Exception as e:
+            raise DatabaseError(f"Kullanıcılar getirilirken hata oluştu: {str(e)}")
+
+    def bump_versions(self, user_ids: List[str]) -> None:
+        """
+        Profil yanıtını etkileyen değişikliklerde (ör. arkadaşlık) kullanıcıların version sayacını artırır
+        """
+        try:
+            self.users.update_many({"user_id": {"$in": user_ids}}, {"$inc": {"version": 1}})
+        except Exception as e:
+            raise DatabaseError(f"Kullanıcı sürümü güncellenirken hata oluştu: {str(e)}")
+
     def insert_user(self, user_data: Dict[str, Any]) -> None:
         try:
+            # E-posta indeksi yalnızca is_deleted=False olan kayıtları kapsar
+            user_data.setdefault("is_deleted", False)
             self.users.insert_one(user_data)
-        except DuplicateKeyError:
-            raise DuplicateError("Bu e-posta adresi zaten kayıtlı")
+        except DuplicateKeyError as e:
+            if "email" in ((e.details or {}).get("keyPattern") or {}):
+                raise DuplicateError("Bu e-posta adresi zaten kayıtlı")
+            raise DuplicateError("Kullanıcı kimliği zaten kullanılıyor, lütfen tekrar deneyin")
         except Exception as e:
             raise DatabaseError(f"Kullanıcı eklenirken hata oluştu: {str(e)}")
 
@@ -59,7 +120,7 @@ class UserDB:
         try:
             result = self.users.update_one(
                 {"user_id": user_id},
-                {"$set": update_data}
+                {"$set": update_data, "$inc": {"version": 1}}
             )
             if result.modified_count == 0:
                 raise NotFoundError("Güncellenecek kullanıcı bulunamadı")
@@ -75,11 +136,12 @@ class UserDB:
                     "$set": {
                         "is_deleted": True,
                         "deleted_at": datetime.datetime.now().isoformat()
-                    }
+                    },
+                    "$inc": {"version": 1}
                 }
             )
             if result.modified_count == 0:
                 raise NotFoundError("Silinecek kullanıcı bulunamadı")
             return True
         except Exception as e:
-            raise DatabaseError(f"Kullanıcı silinirken hata oluştu: {str(e)}") 
\ No newline at end of file
+            raise DatabaseError(f"Kullanıcı silinirken hata oluştu: {str(e)}") 
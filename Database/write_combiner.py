@@ -0,0 +1,144 @@
+"""
+Chat özet alanları için yazma birleştirici.
+
+Yoğun grup sohbetlerinde her mesaj chat dokümanına ayrı bir güncelleme
+gönderdiğinde tüm gönderenler aynı doküman kilidinde sıraya girer. Bu sınıf
+last_message / updated_at / unread_count / version güncellemelerini (mesaj
+durum, silme ve düzenleme kaynaklı version artışları dahil) kısa bir
+pencere boyunca chat başına biriktirir ve tek bir bulk_write ile yazar.
+Mesajın kendisi beklemeden messages koleksiyonuna eklenir.
+"""
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Optional
+
+import pymongo
+
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+
+class ChatSummaryCombiner:
+    def __init__(self, chats, window_ms: int = 50):
+        self.chats = chats
+        self.window = window_ms / 1000
+        self._pending: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = False
+        self._thread: Optional[threading.Thread] = None
+
+    def add(self, chat_id: str, last_message: dict, seq: int) -> None:
+        """
+        Mesajın chat özetine etkisini kuyruğa ekler; en yüksek seq'li mesaj last_message olur
+        """
+        self._merge(chat_id, self._entry(last_message, seq, messages=1))
+
+    def bump_version(self, chat_id: str) -> None:
+        """
+        Mesaj listesini etkileyen değişiklikler (durum, silme, düzenleme) için yalnızca
+        version artışını kuyruğa ekler; updated_at değişmez
+        """
+        self._merge(chat_id, self._entry(None, 0, messages=0, touch=False))
+
+    def _merge(self, chat_id: str, update: dict) -> None:
+        if self.window <= 0 or self._stopped:
+            self._write({chat_id: update})
+            return
+        with self._lock:
+            entry = self._pending.get(chat_id)
+            if entry is None:
+                self._pending[chat_id] = update
+                self._ensure_started()
+                self._wakeup.set()
+                return
+            entry["messages"] += update["messages"]
+            entry["versions"] += update["versions"]
+            entry["touch"] = entry["touch"] or update["touch"]
+            if update["last_message"] is not None and update["seq"] > entry["seq"]:
+                entry["seq"] = update["seq"]
+                entry["last_message"] = update["last_message"]
+
+    def flush(self) -> int:
+        """
+        Bekleyen tüm özet güncellemelerini yazar; yazılan chat sayısını döndürür
+        """
+        with self._lock:
+            batch, self._pending = self._pending, {}
+            self._wakeup.clear()
+        if batch:
+            self._write(batch)
+        return len(batch)
+
+    def stop(self) -> None:
+        """
+        Arka plan iş parçacığını durdurur ve kalan güncellemeleri yazar (kapanışta çağrılır)
+        """
+        self._stopped = True
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        self.flush()
+
+    @staticmethod
+    def _entry(last_message: Optional[dict], seq: int, messages: int, touch: bool = True) -> dict:
+        return {
+            "last_message": last_message,
+            "seq": seq,
+            "messages": messages,
+            "versions": 1,
+            "touch": touch
+        }
+
+    def _ensure_started(self) -> None:
+        # Yalnızca mesaj yazan Database örneklerinde iş parçacığı açılır
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="chat-summary-combiner", daemon=True)
+            self._thread.start()
+
+    def _run(self) -> None:
+        while not self._stopped:
+            self._wakeup.wait()
+            if self._stopped:
+                return
+            # Pencere boyunca gelen mesajları biriktir
+            time.sleep(self.window)
+            self.flush()
+
+    @staticmethod
+    def _summary_update(entry: dict, flushed_at: str) -> dict:
+        # Farklı worker'ların birleştirdiği güncellemeler sırasız yazılabilir;
+        # last_message yalnızca daha yeni bir seq geldiyse değiştirilir
+        fields = {"version": {"$add": [{"$ifNull": ["$version", 0]}, entry["versions"]]}}
+        if entry["last_message"] is not None:
+            fields["last_message"] = {"$cond": [
+                {"$gte": [entry["seq"], {"$ifNull": ["$last_seq", 0]}]},
+                {"$literal": entry["last_message"]},
+                "$last_message"
+            ]}
+            fields["last_seq"] = {"$max": [{"$ifNull": ["$last_seq", 0]}, entry["seq"]]}
+        if entry["messages"]:
+            fields["unread_count"] = {"$add": [{"$ifNull": ["$unread_count", 0]}, entry["messages"]]}
+        if entry["touch"]:
+            # Yazma anı kullanılır: bekleme sırasında alınan sync_token'dan önceye düşen
+            # updated_at, sonraki senkronizasyonda chat'in atlanmasına yol açardı
+            fields["updated_at"] = {"$max": ["$updated_at", flushed_at]}
+        return {"$set": fields}
+
+    def _write(self, batch: Dict[str, dict]) -> None:
+        flushed_at = datetime.now().isoformat()
+        operations = [
+            pymongo.UpdateOne({"chat_id": chat_id}, [self._summary_update(entry, flushed_at)])
+            for chat_id, entry in batch.items()
+        ]
+        try:
+            self.chats.bulk_write(operations, ordered=False)
+            logger.debug("Chat özetleri yazıldı", extra={
+                "chats": len(batch), "messages": sum(entry["messages"] for entry in batch.values())
+            })
+        except Exception as e:
+            # Özet alanları mesajlardan türetilebilir; mesajların kendisi zaten kaydedildi
+            logger.error("Chat özetleri yazılamadı", extra={"chats": len(batch), "error": str(e)})
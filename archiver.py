@@ -0,0 +1,110 @@
+"""
+Eski sohbet geçmişini soğuk katmana taşıyan arka plan görevi.
+
+Belirli bir yaştan eski mesajlar periyodik olarak messages_archive
+koleksiyonuna (zstd sıkıştırmalı) taşınır; sıcak koleksiyonun çalışma kümesi
+ve indeks boyutu sınırlı kalır. Okuma yolları (ChatDatabase) sıcak katmanda
+biten sayfaları arşivden tamamlar.
+
+Birden fazla worker çalıştığında scheduler_locks koleksiyonundaki kiralık
+kilit sayesinde yalnızca bir worker arşivleme yapar.
+
+Ortam değişkenleri:
+    MESSAGE_ARCHIVE_ENABLED          Varsayılan true
+    MESSAGE_ARCHIVE_AFTER_DAYS       Mesajların kaç gün sonra arşivleneceği (varsayılan 90);
+                                     chat dokümanındaki archive_after_days ile chat bazında değiştirilebilir
+    MESSAGE_ARCHIVE_INTERVAL_MINUTES Arşivleme turları arasındaki süre (varsayılan 360)
+    MESSAGE_ARCHIVE_BATCH_SIZE       Tek seferde taşınan en fazla mesaj (varsayılan 1000)
+"""
+import asyncio
+import os
+from typing import Optional
+
+from logger import get_logger
+from scheduler import LeaderLease
+
+logger = get_logger(__name__)
+
+MESSAGE_ARCHIVE_ENABLED = os.getenv("MESSAGE_ARCHIVE_ENABLED", "true").lower() in ("1", "true", "yes")
+MESSAGE_ARCHIVE_AFTER_DAYS = int(os.getenv("MESSAGE_ARCHIVE_AFTER_DAYS", "90"))
+MESSAGE_ARCHIVE_INTERVAL_MINUTES = int(os.getenv("MESSAGE_ARCHIVE_INTERVAL_MINUTES", "360"))
+MESSAGE_ARCHIVE_BATCH_SIZE = int(os.getenv("MESSAGE_ARCHIVE_BATCH_SIZE", "1000"))
+
+LOCK_NAME = "message_archiver"
+# Tur boyunca kilit her chat'ten önce yenilenir
+LOCK_TTL = 300
+
+
+class MessageArchiver:
+    def __init__(self, db):
+        self.chat_db = db.chat_db
+        self.lease = LeaderLease(db.db["scheduler_locks"], LOCK_NAME, ttl=LOCK_TTL)
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+            logger.info("Mesaj arşivleyici başlatıldı", extra={"owner": self.lease.owner})
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        # Devam eden tur bir sonraki chat'te durur
+        self._stopping = True
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self.lease.release)
+        logger.info("Mesaj arşivleyici durduruldu")
+
+    def _should_continue(self) -> bool:
+        return not self._stopping and self.lease.acquire()
+
+    def run_once(self) -> int:
+        """
+        Lider ise tek bir arşivleme turu çalıştırır; taşınan mesaj sayısını döndürür
+        """
+        if not self.lease.acquire():
+            return 0
+        return self.chat_db.archive_old_messages(
+            MESSAGE_ARCHIVE_AFTER_DAYS,
+            batch_size=MESSAGE_ARCHIVE_BATCH_SIZE,
+            should_continue=self._should_continue
+        )
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                archived = await loop.run_in_executor(None, self.run_once)
+                if archived:
+                    logger.info("Arşivleme turu tamamlandı", extra={"archived": archived})
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Mesaj arşivleme hatası")
+            await asyncio.sleep(MESSAGE_ARCHIVE_INTERVAL_MINUTES * 60)
+
+
+# Global archiver instance
+_archiver: Optional[MessageArchiver] = None
+
+
+def init_archiver(db) -> Optional[MessageArchiver]:
+    global _archiver
+    if MESSAGE_ARCHIVE_ENABLED and _archiver is None:
+        _archiver = MessageArchiver(db)
+        _archiver.start()
+    return _archiver
+
+
+async def shutdown_archiver() -> None:
+    global _archiver
+    if _archiver is not None:
+        await _archiver.stop()
+        _archiver = None
@@ -1,6 +1,9 @@
 from typing import List
 import uuid
 from datetime import datetime
+from logger import get_logger
+
+logger = get_logger(__name__)
 
 async def create_chat(user_id: str, participants: List[str]) -> Chat:
     """
@@ -23,5 +26,5 @@ async def create_chat(user_id: str, participants: List[str]) -> Chat:
         
         return chat
     except Exception as e:
-        print(f"Chat oluşturma hatası: {str(e)}")
+        logger.exception("Chat oluşturma hatası")
         raise 
\ No newline at end of file
@@ -0,0 +1,151 @@
+"""
+Yanıt sıkıştırma middleware'i.
+
+İstemcinin Accept-Encoding başlığına göre brotli (kuruluysa) veya gzip ile
+sıkıştırır. Eşiğin altındaki küçük yanıtlar sıkıştırılmaz; sıkıştırmanın CPU
+maliyeti kazanılan bayttan fazladır. Her endpoint için ham ve sıkıştırılmış
+bayt toplamları tutulur (get_compression_report).
+
+Ortam değişkenleri:
+    COMPRESSION_MIN_SIZE    Sıkıştırma eşiği, bayt (varsayılan 1024)
+    COMPRESSION_GZIP_LEVEL  gzip seviyesi (varsayılan 6)
+    COMPRESSION_BR_QUALITY  brotli kalitesi (varsayılan 4)
+"""
+import gzip
+import os
+from typing import Dict, Optional
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from logger import get_logger
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - brotli opsiyonel
+    brotli = None
+
+logger = get_logger(__name__)
+
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
+COMPRESSION_GZIP_LEVEL = int(os.getenv("COMPRESSION_GZIP_LEVEL", "6"))
+COMPRESSION_BR_QUALITY = int(os.getenv("COMPRESSION_BR_QUALITY", "4"))
+
+# Yalnızca metin tabanlı içerikler sıkıştırılır
+COMPRESSIBLE_TYPES = ("application/json", "text/")
+
+# Endpoint adı -> {"responses", "compressed", "raw_bytes", "wire_bytes"}
+_stats: Dict[str, Dict[str, int]] = {}
+
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    """
+    Accept-Encoding başlığından desteklenen en uygun kodlamayı seçer (q değerleri dikkate alınır)
+    """
+    weights: Dict[str, float] = {}
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        weights[name] = q
+
+    candidates = ["br", "gzip"] if brotli is not None else ["gzip"]
+    wildcard = weights.get("*", 0.0)
+    best, best_q = None, 0.0
+    for encoding in candidates:
+        q = weights.get(encoding, wildcard)
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=COMPRESSION_BR_QUALITY)
+    return gzip.compress(body, compresslevel=COMPRESSION_GZIP_LEVEL)
+
+
+def _record(endpoint: str, raw_bytes: int, wire_bytes: int) -> None:
+    entry = _stats.setdefault(endpoint, {"responses": 0, "compressed": 0, "raw_bytes": 0, "wire_bytes": 0})
+    entry["responses"] += 1
+    entry["compressed"] += int(wire_bytes != raw_bytes)
+    entry["raw_bytes"] += raw_bytes
+    entry["wire_bytes"] += wire_bytes
+
+
+def get_compression_report() -> Dict[str, Dict[str, float]]:
+    """
+    Endpoint başına sıkıştırma öncesi/sonrası bayt toplamları ve oranı
+    """
+    report = {}
+    for endpoint, entry in _stats.items():
+        raw = entry["raw_bytes"]
+        report[endpoint] = {**entry, "ratio": round(entry["wire_bytes"] / raw, 3) if raw else 1.0}
+    return report
+
+
+class CompressionMiddleware:
+    def __init__(self, app: ASGIApp, minimum_size: int = COMPRESSION_MIN_SIZE) -> None:
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        encoding = choose_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        start_message: Optional[Message] = None
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal start_message
+            if message["type"] == "http.response.start":
+                # Gövde gelene kadar başlıkları beklet
+                start_message = message
+                return
+
+            if message["type"] != "http.response.body" or start_message is None:
+                await send(message)
+                return
+
+            start, start_message = start_message, None
+            headers = MutableHeaders(raw=start["headers"])
+            body = message.get("body", b"")
+            endpoint = getattr(scope.get("endpoint"), "__name__", scope["path"])
+
+            compressible = (
+                not message.get("more_body", False)
+                and "content-encoding" not in headers
+                and headers.get("content-type", "").startswith(COMPRESSIBLE_TYPES)
+            )
+            if compressible:
+                headers.add_vary_header("Accept-Encoding")
+
+            if compressible and encoding and len(body) >= self.minimum_size:
+                compressed = compress(body, encoding)
+                if len(compressed) < len(body):
+                    headers["Content-Encoding"] = encoding
+                    headers["Content-Length"] = str(len(compressed))
+                    _record(endpoint, len(body), len(compressed))
+                    logger.debug("Yanıt sıkıştırıldı", extra={
+                        "endpoint": endpoint, "encoding": encoding,
+                        "raw_bytes": len(body), "wire_bytes": len(compressed)
+                    })
+                    await send(start)
+                    await send({**message, "body": compressed})
+                    return
+
+            if not message.get("more_body", False):
+                _record(endpoint, len(body), len(body))
+            await send(start)
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
@@ -2,7 +2,7 @@ from fastapi import Request, status
 from fastapi.responses import JSONResponse
 from fastapi.exceptions import RequestValidationError
 from pymongo.errors import PyMongoError
-from exceptions import DatabaseError, AuthenticationError, ValidationError, NotFoundError, DuplicateError
+from exceptions import DatabaseError, AuthenticationError, ValidationError, NotFoundError, ForbiddenError, DuplicateError, CapacityError
 
 async def validation_exception_handler(request: Request, exc: RequestValidationError):
     return JSONResponse(
@@ -41,6 +41,15 @@ async def not_found_exception_handler(request: Request, exc: NotFoundError):
         }
     )
 
+async def forbidden_exception_handler(request: Request, exc: ForbiddenError):
+    return JSONResponse(
+        status_code=exc.status_code,
+        content={
+            "success": False,
+            "message": exc.detail
+        }
+    )
+
 async def duplicate_exception_handler(request: Request, exc: DuplicateError):
     return JSONResponse(
         status_code=exc.status_code,
@@ -50,6 +59,15 @@ async def duplicate_exception_handler(request: Request, exc: DuplicateError):
         }
     )
 
+async def capacity_exception_handler(request: Request, exc: CapacityError):
+    return JSONResponse(
+        status_code=exc.status_code,
+        content={
+            "success": False,
+            "message": exc.detail
+        }
+    )
+
 async def pymongo_exception_handler(request: Request, exc: PyMongoError):
     return JSONResponse(
         status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -28,9 +28,23 @@ class NotFoundError(HTTPException):
             detail=detail
         )
 
+class ForbiddenError(HTTPException):
+    def __init__(self, detail: str = "Bu işlem için yetkiniz yok"):
+        super().__init__(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail=detail
+        )
+
 class DuplicateError(HTTPException):
     def __init__(self, detail: str = "Bu kayıt zaten mevcut"):
         super().__init__(
             status_code=status.HTTP_409_CONFLICT,
             detail=detail
-        ) 
\ No newline at end of file
+        )
+
+class CapacityError(HTTPException):
+    def __init__(self, detail: str = "Kapasite dolu"):
+        super().__init__(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=detail
+        )
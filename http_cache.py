@@ -0,0 +1,75 @@
+"""
+Koşullu GET (ETag / Last-Modified) yardımcıları.
+
+ETag'ler dokümanlardaki version sayaçlarından türetilir; böylece istemcinin
+elindeki sürüm güncelse yanıt gövdesi hiç oluşturulmadan 304 döndürülebilir.
+"""
+import datetime
+import hashlib
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Any, Optional
+
+from fastapi import Request, Response
+
+# İstemci her istekte yeniden doğrulamalı; paylaşılan önbellekler kullanıcıya özel yanıtları saklamamalı
+CACHE_CONTROL = "private, no-cache"
+
+
+def make_etag(*parts: Any) -> str:
+    """
+    Verilen parçalardan zayıf (weak) bir ETag üretir
+    """
+    digest = hashlib.sha1("|".join(str(part) for part in parts).encode("utf-8")).hexdigest()[:20]
+    return f'W/"{digest}"'
+
+
+def _opaque_tag(tag: str) -> str:
+    tag = tag.strip()
+    return tag[2:] if tag.startswith("W/") else tag
+
+
+def _to_http_date(value: datetime.datetime) -> str:
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=datetime.timezone.utc)
+    return format_datetime(value.astimezone(datetime.timezone.utc), usegmt=True)
+
+
+def is_not_modified(request: Request, etag: str, last_modified: Optional[datetime.datetime] = None) -> bool:
+    """
+    If-None-Match (öncelikli) veya If-Modified-Since başlıklarına göre istemcinin kopyası güncel mi
+    """
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        if if_none_match.strip() == "*":
+            return True
+        # Zayıf karşılaştırma: W/ öneki yok sayılır
+        candidates = {_opaque_tag(tag) for tag in if_none_match.split(",")}
+        return _opaque_tag(etag) in candidates
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since and last_modified is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        if last_modified.tzinfo is None:
+            last_modified = last_modified.replace(tzinfo=datetime.timezone.utc)
+        # HTTP tarihleri saniye hassasiyetindedir
+        return last_modified.replace(microsecond=0) <= since
+    return False
+
+
+def set_cache_headers(response: Response, etag: str, last_modified: Optional[datetime.datetime] = None) -> None:
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = CACHE_CONTROL
+    if last_modified is not None:
+        response.headers["Last-Modified"] = _to_http_date(last_modified)
+
+
+def not_modified(etag: str, last_modified: Optional[datetime.datetime] = None) -> Response:
+    """
+    Gövdesiz 304 yanıtı
+    """
+    response = Response(status_code=304)
+    set_cache_headers(response, etag, last_modified)
+    return response
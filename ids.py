@@ -0,0 +1,151 @@
+"""
+Zamana göre sıralanabilir kimlik üreteci (snowflake düzeni).
+
+64 bitlik değer:
+    42 bit  EPOCH'tan bu yana geçen milisaniye
+    10 bit  worker kimliği (WORKER_ID ortam değişkeni; yoksa uygulama başlarken
+            worker_ids koleksiyonundan benzersiz olarak kiralanır, bkz. worker_ids.py)
+    12 bit  aynı milisaniye içindeki sıra numarası
+
+Değer sabit genişlikte (13 karakter) Crockford base32 ile yazılır, böylece
+kimliklerin metin sıralaması üretilme sırasıyla aynıdır ve MongoDB'de
+doğrudan sıralama/sayfalama anahtarı olarak kullanılabilir.
+"""
+import datetime
+import hashlib
+import os
+import socket
+import threading
+import time
+from typing import Optional
+
+EPOCH_MS = 1704067200000  # 2024-01-01T00:00:00Z
+
+WORKER_ID_BITS = 10
+SEQUENCE_BITS = 12
+MAX_WORKER_ID = (1 << WORKER_ID_BITS) - 1
+MAX_SEQUENCE = (1 << SEQUENCE_BITS) - 1
+TIMESTAMP_SHIFT = WORKER_ID_BITS + SEQUENCE_BITS
+
+ID_LENGTH = 13
+_ALPHABET = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+_DECODE = {char: index for index, char in enumerate(_ALPHABET)}
+
+
+def configured_worker_id() -> Optional[int]:
+    """
+    WORKER_ID ortam değişkeniyle sabitlenmiş worker kimliği; tanımlı değilse None
+    """
+    env_value = os.getenv("WORKER_ID")
+    if not env_value:
+        return None
+    worker_id = int(env_value)
+    if not 0 <= worker_id <= MAX_WORKER_ID:
+        raise ValueError(f"WORKER_ID 0-{MAX_WORKER_ID} aralığında olmalı")
+    return worker_id
+
+
+def hashed_worker_id() -> int:
+    """
+    Host adı ve pid'den türetilen kimlik; kiralamada ilk denenecek slot olarak kullanılır
+    """
+    seed = f"{socket.gethostname()}:{os.getpid()}".encode("utf-8")
+    return int(hashlib.sha1(seed).hexdigest(), 16) & MAX_WORKER_ID
+
+
+def _default_worker_id() -> int:
+    # Kiralama yapılmayan süreçler (taşıma araçları vb.) için geçici değer;
+    # sunucu başlarken worker_ids.py benzersiz bir kimlikle değiştirir
+    worker_id = configured_worker_id()
+    return hashed_worker_id() if worker_id is None else worker_id
+
+
+def _encode(value: int) -> str:
+    chars = []
+    for _ in range(ID_LENGTH):
+        chars.append(_ALPHABET[value & 31])
+        value >>= 5
+    return "".join(reversed(chars))
+
+
+def _decode(text: str) -> int:
+    value = 0
+    for char in text:
+        value = (value << 5) | _DECODE[char]
+    return value
+
+
+class IdGenerator:
+    """
+    Süreç içinde tekdüze artan kimlikler üretir. Saat geri giderse son
+    milisaniye kullanılmaya devam edilir; sıra taşarsa bir sonraki
+    milisaniyeye geçilir, böylece üretim hiçbir zaman beklemez.
+    """
+
+    def __init__(self, worker_id: int = None):
+        self.worker_id = _default_worker_id() if worker_id is None else worker_id
+        self._last_ms = -1
+        self._sequence = 0
+        self._lock = threading.Lock()
+
+    def next_int(self) -> int:
+        with self._lock:
+            now_ms = int(time.time() * 1000) - EPOCH_MS
+            if now_ms > self._last_ms:
+                self._last_ms = now_ms
+                self._sequence = 0
+            else:
+                self._sequence += 1
+                if self._sequence > MAX_SEQUENCE:
+                    self._last_ms += 1
+                    self._sequence = 0
+            return (self._last_ms << TIMESTAMP_SHIFT) | (self.worker_id << SEQUENCE_BITS) | self._sequence
+
+    def next_id(self, prefix: str = "") -> str:
+        return f"{prefix}{_encode(self.next_int())}"
+
+
+_generator = IdGenerator()
+
+
+def set_worker_id(worker_id: int) -> None:
+    """
+    Süreç genelindeki üretecin worker kimliğini değiştirir (kiralanan kimlik için)
+    """
+    if not 0 <= worker_id <= MAX_WORKER_ID:
+        raise ValueError(f"Worker kimliği 0-{MAX_WORKER_ID} aralığında olmalı")
+    with _generator._lock:
+        _generator.worker_id = worker_id
+
+
+def new_message_id() -> str:
+    return _generator.next_id("msg_")
+
+
+def new_edit_id() -> str:
+    return _generator.next_id("edt_")
+
+
+def id_from_datetime(value: datetime.datetime, prefix: str = "msg_", sequence: int = 0) -> str:
+    """
+    Verilen zamana karşılık gelen kimliği döndürür (worker 0). sequence=0 ile o
+    milisaniyenin en küçük kimliğidir; zaman aralığı sorgularında ve eski
+    mesajların taşınmasında kullanılır. Saat dilimi olmayan değerler yerel saat
+    kabul edilir (datetime.now().isoformat() ile yazılan alanlarla uyumlu).
+    """
+    ms = max(0, int(value.timestamp() * 1000) - EPOCH_MS)
+    ms += sequence // (MAX_SEQUENCE + 1)
+    return f"{prefix}{_encode((ms << TIMESTAMP_SHIFT) | (sequence % (MAX_SEQUENCE + 1)))}"
+
+
+def is_sortable_id(value: str, prefix: str = "msg_") -> bool:
+    body = value[len(prefix):] if value.startswith(prefix) else None
+    return body is not None and len(body) == ID_LENGTH and all(char in _DECODE for char in body)
+
+
+def id_datetime(value: str, prefix: str = "msg_") -> datetime.datetime:
+    """
+    Kimliğin üretildiği zamanı (UTC) döndürür
+    """
+    ms = (_decode(value[len(prefix):]) >> TIMESTAMP_SHIFT) + EPOCH_MS
+    return datetime.datetime.fromtimestamp(ms / 1000, tz=datetime.timezone.utc)
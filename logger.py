@@ -0,0 +1,131 @@
+"""
+Yapılandırılmış ve seviyeli loglama.
+
+Kayıtlar JSON (veya LOG_FORMAT=text ile düz metin) olarak biçimlendirilir ve bir
+kuyruk üzerinden ayrı bir iş parçacığında yazılır; böylece istek/WebSocket
+işleyicileri stdout'a senkron yazmayı beklemez.
+
+Ortam değişkenleri:
+    LOG_LEVEL               Varsayılan INFO
+    LOG_FORMAT              json (varsayılan) veya text
+    LOG_PAYLOADS            true ise mesaj içerikleri DEBUG seviyesinde loglanır (varsayılan kapalı)
+    LOG_DEBUG_SAMPLE_RATE   DEBUG kayıtlarının tutulma oranı, 0.0-1.0 (varsayılan 1.0)
+"""
+import datetime
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+from typing import Any, Optional
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").lower()
+LOG_PAYLOADS = os.getenv("LOG_PAYLOADS", "false").lower() in ("1", "true", "yes")
+LOG_DEBUG_SAMPLE_RATE = float(os.getenv("LOG_DEBUG_SAMPLE_RATE", "1.0"))
+
+# LogRecord'un standart alanları; bunların dışındaki `extra` alanları yapılandırılmış veri olarak yazılır
+_RESERVED_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_setup_lock = threading.Lock()
+
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.datetime.fromtimestamp(record.created).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage()
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED_ATTRS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        fields = {
+            key: value for key, value in record.__dict__.items()
+            if key not in _RESERVED_ATTRS and not key.startswith("_")
+        }
+        if fields:
+            line += " " + " ".join(f"{key}={value}" for key, value in fields.items())
+        return line
+
+
+class SamplingFilter(logging.Filter):
+    """
+    DEBUG kayıtlarını LOG_DEBUG_SAMPLE_RATE oranında örnekler; INFO ve üstü her zaman geçer.
+    """
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.DEBUG or self.rate >= 1.0:
+            return True
+        return random.random() < self.rate
+
+
+def setup_logging() -> None:
+    """
+    Kök logger'ı kuyruk tabanlı işleyiciyle yapılandırır (birden fazla çağrı güvenlidir)
+    """
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            return
+
+        log_queue = queue.SimpleQueue()
+        queue_handler = logging.handlers.QueueHandler(log_queue)
+        # Biçimlendirme çağıran iş parçacığında yapılır; yazma işlemi dinleyici iş parçacığındadır
+        queue_handler.setFormatter(JSONFormatter() if LOG_FORMAT == "json" else TextFormatter())
+        queue_handler.addFilter(SamplingFilter(LOG_DEBUG_SAMPLE_RATE))
+
+        stream_handler = logging.StreamHandler(sys.stdout)
+        stream_handler.setFormatter(logging.Formatter("%(message)s"))
+
+        root = logging.getLogger()
+        root.handlers = [queue_handler]
+        root.setLevel(LOG_LEVEL)
+
+        _listener = logging.handlers.QueueListener(log_queue, stream_handler)
+        _listener.start()
+
+
+def shutdown_logging() -> None:
+    """
+    Kuyrukta bekleyen kayıtları yazar ve dinleyici iş parçacığını durdurur
+    """
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+
+
+def get_logger(name: str) -> logging.Logger:
+    setup_logging()
+    return logging.getLogger(name)
+
+
+def log_payload(logger: logging.Logger, message: str, payload: Any, **fields) -> None:
+    """
+    Mesaj içeriğini yalnızca LOG_PAYLOADS açıksa ve DEBUG seviyesi etkinse loglar.
+    Kapalıyken içerik hiç biçimlendirilmez.
+    """
+    if LOG_PAYLOADS and logger.isEnabledFor(logging.DEBUG):
+        logger.debug(message, extra={**fields, "payload": payload})
@@ -4,23 +4,25 @@ from pymongo.errors import PyMongoError
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 from fastapi.encoders import jsonable_encoder
-from bson import ObjectId
 from routers import users, activities, chat, websocket
 from auth import auth
 from auth.auth import sign_jwt
-from exceptions import DatabaseError, AuthenticationError, ValidationError, NotFoundError, DuplicateError
+from exceptions import DatabaseError, AuthenticationError, ValidationError, NotFoundError, ForbiddenError, DuplicateError, CapacityError
 from error_handler import (
     validation_exception_handler,
     database_exception_handler,
     authentication_exception_handler,
     not_found_exception_handler,
+    forbidden_exception_handler,
     duplicate_exception_handler,
+    capacity_exception_handler,
     pymongo_exception_handler,
     generic_exception_handler
 )
 from Database.database import Database
+from serializer import FastJSONResponse
+from compression import CompressionMiddleware, get_compression_report
 from datetime import datetime
-import json
 import uvicorn
 import os
 from dotenv import load_dotenv
@@ -31,14 +33,21 @@ import sys
 # .env dosyasını yükle
 load_dotenv()
 
-app = FastAPI()
+from logger import get_logger, shutdown_logging
+
+logger = get_logger(__name__)
+
+# Tüm yanıtlar ortak serileştiriciden geçer (orjson varsa onu kullanır)
+app = FastAPI(default_response_class=FastJSONResponse)
 
 # Exception handler'ları ekle
 app.add_exception_handler(RequestValidationError, validation_exception_handler)
 app.add_exception_handler(DatabaseError, database_exception_handler)
 app.add_exception_handler(AuthenticationError, authentication_exception_handler)
 app.add_exception_handler(NotFoundError, not_found_exception_handler)
+app.add_exception_handler(ForbiddenError, forbidden_exception_handler)
 app.add_exception_handler(DuplicateError, duplicate_exception_handler)
+app.add_exception_handler(CapacityError, capacity_exception_handler)
 app.add_exception_handler(PyMongoError, pymongo_exception_handler)
 app.add_exception_handler(Exception, generic_exception_handler)
 
@@ -51,17 +60,8 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# ObjectId'yi JSON'a dönüştürmek için özel encoder
-class JSONEncoder(json.JSONEncoder):
-    def default(self, obj):
-        if isinstance(obj, ObjectId):
-            return str(obj)
-        return super().default(obj)
-
-# Özel JSON response sınıfı
-class CustomJSONResponse(JSONResponse):
-    def render(self, content):
-        return json.dumps(content, cls=JSONEncoder)
+# Eşik üzerindeki JSON yanıtlarını brotli/gzip ile sıkıştır
+app.add_middleware(CompressionMiddleware)
 
 # Global database instance
 db = None
@@ -81,47 +81,78 @@ def read_root():
 @app.on_event("startup")
 async def startup_event():
     global db
-    print("Uygulama başlatılıyor...")
+    logger.info("Uygulama başlatılıyor")
     try:
         # Veritabanı bağlantısını test et
         db = Database()
         db.db.list_collection_names()
-        print("Veritabanı bağlantısı başarılı")
+        logger.info("Veritabanı bağlantısı başarılı")
+        
+        # Kimlik üreteci için benzersiz worker kimliği (WORKER_ID yoksa kiralanır)
+        from worker_ids import init_worker_id
+        logger.info("Worker kimliği atandı", extra={"worker_id": init_worker_id(db)})
         
         # WebSocket manager'ı başlat
         from websocket_manager import init_manager
         init_manager(db)
-        print("WebSocket manager başlatıldı")
+        logger.info("WebSocket manager başlatıldı")
         
         # Chat router'ı başlat
         from routers.chat import init_chat_router
         init_chat_router(db)
-        print("Chat router başlatıldı")
+        logger.info("Chat router başlatıldı")
+        
+        # Aktivite zamanlayıcısını başlat
+        from scheduler import init_scheduler
+        if init_scheduler(db):
+            logger.info("Aktivite zamanlayıcısı başlatıldı")
+
+        # Eski mesajları arşive taşıyan görevi başlat
+        from archiver import init_archiver
+        if init_archiver(db):
+            logger.info("Mesaj arşivleyici başlatıldı")
         
     except Exception as e:
-        print(f"Başlatma hatası: {str(e)}")
+        logger.critical("Başlatma hatası", extra={"error": str(e)})
+        shutdown_logging()
         sys.exit(1)
 
 @app.on_event("shutdown")
 async def shutdown_event():
     global db
-    print("Uygulama kapatılıyor...")
+    logger.info("Uygulama kapatılıyor")
+    # Zamanlayıcıyı durdur (liderlik kilidi bırakılır)
+    from scheduler import shutdown_scheduler
+    await shutdown_scheduler()
+    from archiver import shutdown_archiver
+    await shutdown_archiver()
     # WebSocket bağlantılarını kapat
     from websocket_manager import get_manager
     manager = get_manager()
     if manager:
         for user_id in list(manager.active_connections.keys()):
             manager.disconnect(user_id)
+    # Kiralanan worker kimliğini bırak
+    from worker_ids import shutdown_worker_id
+    await shutdown_worker_id()
     # Veritabanı bağlantılarını kapat
     try:
         if db:
             db.close()
     except Exception as e:
-        print(f"Veritabanı kapatma hatası: {str(e)}")
+        logger.error("Veritabanı kapatma hatası", extra={"error": str(e)})
+    # Endpoint başına sıkıştırma öncesi/sonrası bayt raporu
+    logger.info("Yanıt boyutu raporu", extra={"compression": get_compression_report()})
+    # Kuyruktaki log kayıtlarını yaz
+    shutdown_logging()
 
 # Graceful shutdown için sinyal işleyicileri
 def signal_handler(sig, frame):
-    print("\nUygulama kapatılıyor...")
+    logger.info("Uygulama kapatılıyor")
+    # Birleştirilmiş chat özeti güncellemelerini kaybetme
+    if db:
+        db.chat_db.close()
+    shutdown_logging()
     sys.exit(0)
 
 signal.signal(signal.SIGINT, signal_handler)
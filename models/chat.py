@@ -2,6 +2,10 @@ from typing import List, Optional, Literal, Dict, Any
 from datetime import datetime
 from pydantic import BaseModel, Field, validator
 import uuid
+from logger import get_logger, log_payload
+from ids import new_message_id
+
+logger = get_logger(__name__)
 
 class MessageStatus(BaseModel):
     """
@@ -18,6 +22,17 @@ class MessageStatus(BaseModel):
     def is_read(self) -> bool:
         return len(self.read_by) > 0
 
+    @classmethod
+    def from_db(cls, data: Optional[Dict[str, Any]]) -> "MessageStatus":
+        """
+        Veritabanından okunan güvenilir veriden doğrulama yapmadan oluşturur
+        """
+        data = data or {}
+        return cls.model_construct(
+            read_by=data.get("read_by") or [],
+            delivered_to=data.get("delivered_to") or []
+        )
+
     def dict(self, **kwargs) -> Dict[str, Any]:
         return {
             "read_by": self.read_by,
@@ -50,6 +65,23 @@ class MessageContent(BaseModel):
             data['content'] = data['text']
         super().__init__(**data)
 
+    @classmethod
+    def from_db(cls, data: Any) -> "MessageContent":
+        """
+        Veritabanından okunan güvenilir veriden doğrulama yapmadan oluşturur.
+        Düz metin olarak saklanmış içerik de kabul edilir.
+        """
+        if not data:
+            return cls.model_construct(type="text", text="", content="")
+        if isinstance(data, str):
+            return cls.model_construct(type="text", text=data, content=data)
+        text = data.get("text")
+        return cls.model_construct(
+            type=data.get("type", "text"),
+            text=text,
+            content=data.get("content", text)
+        )
+
     def dict(self, **kwargs) -> Dict[str, Any]:
         return {
             "type": self.type,
@@ -57,11 +89,20 @@ class MessageContent(BaseModel):
             "content": self.content
         }
 
+    def compact_dict(self) -> Dict[str, Any]:
+        """
+        text ile content aynıysa yalnızca content gönderilir
+        """
+        data = {"type": self.type, "content": self.content}
+        if self.text is not None and self.text != self.content:
+            data["text"] = self.text
+        return data
+
 class Message(BaseModel):
     """
     Chat mesajı modeli
     """
-    message_id: str = Field(default_factory=lambda: f"msg_{uuid.uuid4().hex[:8]}")
+    message_id: str = Field(default_factory=new_message_id)  # Zamana göre sıralanabilir (ids.py)
     chat_id: str
     sender_id: str
     content: MessageContent
@@ -70,23 +111,31 @@ class Message(BaseModel):
     is_deleted: bool = False
     edited: bool = False
     reply_to: Optional[str] = None  # Yanıtlanan mesajın ID'si
+    seq: Optional[int] = None  # Sohbet içi sıra numarası (boşluk tespiti ve delta senkronizasyonu için)
+    client_message_id: Optional[str] = None  # İstemcinin tekrar denemeler için gönderdiği anahtar
 
     def __init__(self, **data):
-        print(f"\n=== Message modeli oluşturuluyor ===")
-        print(f"Gelen veri: {data}")
         try:
             # Eğer data boşsa veya content yoksa, varsayılan değerler kullan
             if not data or not data.get('content'):
                 data['content'] = MessageContent(type="text", text="", content="")
             super().__init__(**data)
-            print(f"Message modeli başarıyla oluşturuldu: {self.dict()}")
-        except Exception as e:
-            print(f"Message modeli oluşturma hatası: {str(e)}")
-            print(f"Hata tipi: {type(e)}")
-            import traceback
-            print(f"Stack trace: {traceback.format_exc()}")
+        except Exception:
+            logger.warning("Message modeli oluşturulamadı", exc_info=True)
+            log_payload(logger, "Geçersiz Message verisi", data)
             raise
 
+    @classmethod
+    def from_db(cls, doc: Dict[str, Any]) -> "Message":
+        """
+        Kendi veritabanımızdan okunan mesaj dokümanından doğrulama yapmadan oluşturur.
+        İstemciden gelen veriler için normal kurucu (tam doğrulama) kullanılmalıdır.
+        """
+        data = {key: value for key, value in doc.items() if key in cls.model_fields}
+        data["content"] = MessageContent.from_db(doc.get("content"))
+        data["status"] = MessageStatus.from_db(doc.get("status"))
+        return cls.model_construct(**data)
+
     def dict(self, **kwargs) -> Dict[str, Any]:
         return {
             "message_id": self.message_id,
@@ -97,9 +146,39 @@ class Message(BaseModel):
             "status": self.status.dict(),
             "is_deleted": self.is_deleted,
             "edited": self.edited,
-            "reply_to": self.reply_to
+            "reply_to": self.reply_to,
+            "seq": self.seq,
+            "client_message_id": self.client_message_id
         }
 
+    def compact_dict(self, include_chat_id: bool = True) -> Dict[str, Any]:
+        """
+        Kompakt tel formatı: tekrarlanan metin, boş diziler ve None alanlar atlanır.
+        Sohbetin içinde gönderilen mesajlarda chat_id üst nesneden bilinir.
+        """
+        data = {
+            "message_id": self.message_id,
+            "sender_id": self.sender_id,
+            "content": self.content.compact_dict(),
+            "timestamp": self.timestamp
+        }
+        if include_chat_id:
+            data["chat_id"] = self.chat_id
+        status = {key: value for key, value in self.status.dict().items() if value}
+        if status:
+            data["status"] = status
+        if self.is_deleted:
+            data["is_deleted"] = True
+        if self.edited:
+            data["edited"] = True
+        if self.reply_to:
+            data["reply_to"] = self.reply_to
+        if self.seq is not None:
+            data["seq"] = self.seq
+        if self.client_message_id:
+            data["client_message_id"] = self.client_message_id
+        return data
+
 class Chat(BaseModel):
     """
     Chat modeli
@@ -114,26 +193,35 @@ class Chat(BaseModel):
     messages: List[Message] = []
     last_message: Optional[Dict[str, Any]] = None
     unread_count: int = 0
+    version: int = 0  # Mesaj listesindeki her değişiklikte artar (HTTP ETag için)
+    last_seq: int = 0  # Son mesajın sohbet içi sıra numarası (chat_sequences sayacının başlangıcı)
     created_at: str = Field(default_factory=lambda: datetime.now().isoformat())
     updated_at: str = Field(default_factory=lambda: datetime.now().isoformat())
     is_active: bool = True
 
     def __init__(self, **data):
-        print(f"\n=== Chat modeli oluşturuluyor ===")
-        print(f"Gelen veri: {data}")
         try:
             # Eğer last_message boşsa, None olarak ayarla
             if data.get('last_message') == {}:
                 data['last_message'] = None
             super().__init__(**data)
-            print(f"Chat modeli başarıyla oluşturuldu: {self.dict()}")
-        except Exception as e:
-            print(f"Chat modeli oluşturma hatası: {str(e)}")
-            print(f"Hata tipi: {type(e)}")
-            import traceback
-            print(f"Stack trace: {traceback.format_exc()}")
+        except Exception:
+            logger.warning("Chat modeli oluşturulamadı", exc_info=True)
+            log_payload(logger, "Geçersiz Chat verisi", data)
             raise
 
+    @classmethod
+    def from_db(cls, doc: Dict[str, Any]) -> "Chat":
+        """
+        Kendi veritabanımızdan okunan sohbet dokümanından doğrulama yapmadan oluşturur.
+        Gömülü mesajlar da Message.from_db ile oluşturulur.
+        """
+        data = {key: value for key, value in doc.items() if key in cls.model_fields}
+        data["messages"] = [Message.from_db(msg) for msg in doc.get("messages") or []]
+        if not data.get("last_message"):
+            data["last_message"] = None
+        return cls.model_construct(**data)
+
     def dict(self, **kwargs) -> Dict[str, Any]:
         return {
             "chat_id": self.chat_id,
@@ -146,11 +234,22 @@ class Chat(BaseModel):
             "messages": [msg.dict() for msg in self.messages],
             "last_message": self.last_message,
             "unread_count": self.unread_count,
+            "version": self.version,
             "created_at": self.created_at,
             "updated_at": self.updated_at,
             "is_active": self.is_active
         }
 
+    def compact_dict(self) -> Dict[str, Any]:
+        """
+        Kompakt tel formatı: None alanlar ve boş diziler atlanır, mesajlar kompakt gönderilir
+        """
+        data = {key: value for key, value in self.dict().items()
+                if key != "messages" and value is not None and value != []}
+        if self.messages:
+            data["messages"] = [msg.compact_dict(include_chat_id=False) for msg in self.messages]
+        return data
+
     class Config:
         arbitrary_types_allowed = True
         json_encoders = {
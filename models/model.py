@@ -53,6 +53,8 @@ class ActivitySchema(BaseModel):
     max_participants: int = 10  # Varsayılan değer 10
     participants: List[str] = []  # Katılımcıların ID listesi
     location: Optional[str] = None  # Aktivitenin yapılacağı mekan
+    latitude: Optional[float] = Field(None, ge=-90, le=90)  # Konum koordinatları (opsiyonel, birlikte verilmeli)
+    longitude: Optional[float] = Field(None, ge=-180, le=180)
     creator_id: Optional[str] = None  # Aktiviteyi oluşturan kullanıcının ID'si
     created_at: Optional[str] = None  # Aktivitenin oluşturulma tarihi
 
@@ -75,6 +77,8 @@ class ActivityCreateSchema(BaseModel):
     max_participants: int = 10  # Varsayılan değer 10
     participants: List[str] = []  # Katılımcıların ID listesi
     location: Optional[str] = None  # Aktivitenin yapılacağı mekan
+    latitude: Optional[float] = Field(None, ge=-90, le=90)  # Konum koordinatları (opsiyonel, birlikte verilmeli)
+    longitude: Optional[float] = Field(None, ge=-180, le=180)
 
     class Config:
         json_schema_extra = {
@@ -82,7 +86,9 @@ class ActivityCreateSchema(BaseModel):
                 "title": "Proje Toplantısı",
                 "activity_date": "2024-03-25T14:00:00+03:00",
                 "max_participants": 10,
-                "location": "Toplantı Odası 1"
+                "location": "Toplantı Odası 1",
+                "latitude": 41.0082,
+                "longitude": 28.9784
             }
         }
 
@@ -93,6 +99,8 @@ class ActivityResponseSchema(BaseModel):
     max_participants: int
     participants: List[str]
     location: Optional[str] = None
+    latitude: Optional[float] = Field(None, ge=-90, le=90)
+    longitude: Optional[float] = Field(None, ge=-180, le=180)
     creator_id: str
     created_at: str
 
@@ -109,3 +117,5 @@ class ActivityResponseSchema(BaseModel):
             }
         }
 
+class NearbyActivitySchema(ActivityResponseSchema):
+    distance_m: float  # Sorgu noktasına uzaklık (metre)
@@ -8,8 +8,19 @@ class NotificationType:
     FRIEND_REQUEST_ACCEPTED = "friend_request_accepted"
     ACTIVITY_INVITATION = "activity_invitation"
     ACTIVITY_UPDATE = "activity_update"
+    ACTIVITY_REMINDER = "activity_reminder"
     CHAT_MESSAGE = "chat_message"
 
+# Başlık verilmediğinde kullanılan varsayılan bildirim başlıkları
+DEFAULT_NOTIFICATION_TITLES = {
+    NotificationType.FRIEND_REQUEST: "Yeni arkadaşlık isteği",
+    NotificationType.FRIEND_REQUEST_ACCEPTED: "Arkadaşlık isteğiniz kabul edildi",
+    NotificationType.ACTIVITY_INVITATION: "Aktivite daveti",
+    NotificationType.ACTIVITY_UPDATE: "Aktivite güncellendi",
+    NotificationType.ACTIVITY_REMINDER: "Aktivite yaklaşıyor",
+    NotificationType.CHAT_MESSAGE: "Yeni mesaj"
+}
+
 class Notification(BaseModel):
     notification_id: str = Field(default_factory=lambda: f"not_{uuid.uuid4().hex[:8]}")
     user_id: str
@@ -18,5 +29,6 @@ class Notification(BaseModel):
     message: str
     data: Optional[dict] = None
     is_read: bool = False
+    delivered: bool = False
     created_at: str = Field(default_factory=lambda: datetime.datetime.now().isoformat())
     read_at: Optional[str] = None 
\ No newline at end of file
@@ -1,14 +1,22 @@
 import Database.database as database
-from fastapi import APIRouter, Body, Depends, HTTPException, status
+from fastapi import APIRouter, Body, Depends, HTTPException, Query, Request, Response, status
 from auth.auth_bearer import JWTBearer
-from models.model import ActivityCreateSchema, ActivityResponseSchema
-from exceptions import DatabaseError, NotFoundError, DuplicateError, AuthenticationError
-from typing import List, Dict, Any
+from models.model import ActivityCreateSchema, ActivityResponseSchema, NearbyActivitySchema
+from exceptions import DatabaseError, NotFoundError, DuplicateError, AuthenticationError, ValidationError, CapacityError
+from typing import List, Dict, Any, Optional
 import uuid
+import asyncio
 import jwt
 from datetime import datetime
 import os
 from auth.auth import decode_jwt
+from logger import get_logger
+from websocket_manager import get_manager
+from scheduler import get_scheduler
+from http_cache import make_etag, is_not_modified, not_modified, set_cache_headers
+from Database.activity_db import to_utc_datetime
+
+logger = get_logger(__name__)
 
 router = APIRouter()
 db = database.Database()
@@ -16,40 +24,107 @@ db = database.Database()
 secret = os.getenv("JWT_SECRET")
 algorithm = os.getenv("JWT_ALGORITHM")
 
+def _last_modified(activities: List[Dict[str, Any]]):
+    dates = [a["updated_at"] for a in activities if isinstance(a.get("updated_at"), datetime)]
+    return max(dates) if dates else None
+
+def _isoformat_dates(activity: Dict[str, Any]) -> Dict[str, Any]:
+    # Eski dokümanlarda tarih alanları datetime olarak saklanmış olabilir; şema string bekler
+    for field in ("created_at", "activity_date"):
+        if isinstance(activity.get(field), datetime):
+            activity[field] = activity[field].isoformat()
+    return activity
+
 @router.get("/activities", response_model=List[ActivityResponseSchema])
-async def get_all_activities():
+async def get_all_activities(
+    request: Request,
+    response: Response,
+    upcoming: bool = False,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    location: Optional[str] = None,
+    has_free_slots: bool = False,
+    after: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=100)
+):
+    """
+    Aktivite akışını tarihe göre artan sırada, filtreli ve imleçle sayfalı getirir.
+    Bir sonraki sayfanın imleci X-Next-Cursor başlığında döner; after parametresi olarak gönderilir.
+    """
     try:
-        activities = db.get_all_activities()
-        # Tarih alanlarını kontrol et ve dönüştür
-        for activity in activities:
-            if "created_at" in activity:
-                if isinstance(activity["created_at"], datetime):
-                    activity["created_at"] = activity["created_at"].isoformat()
-            if "activity_date" in activity:
-                if isinstance(activity["activity_date"], datetime):
-                    activity["activity_date"] = activity["activity_date"].isoformat()
-        return activities
+        feed = db.get_activity_feed(
+            upcoming=upcoming,
+            date_from=date_from,
+            date_to=date_to,
+            location=location,
+            has_free_slots=has_free_slots,
+            after=after,
+            limit=limit
+        )
+        # ETag sayfadaki aktivitelerin kimlik ve sürümlerinden türetilir; 304'te gövde serileştirilmez
+        etag = make_etag(
+            request.url.query,
+            [(a["activity_id"], a.get("version", 0)) for a in feed["activities"]],
+            feed["next_cursor"]
+        )
+        last_modified = _last_modified(feed["activities"])
+        if is_not_modified(request, etag, last_modified):
+            cached = not_modified(etag, last_modified)
+            if feed["next_cursor"]:
+                cached.headers["X-Next-Cursor"] = feed["next_cursor"]
+            return cached
+        set_cache_headers(response, etag, last_modified)
+        if feed["next_cursor"]:
+            response.headers["X-Next-Cursor"] = feed["next_cursor"]
+        return [_isoformat_dates(activity) for activity in feed["activities"]]
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=str(e.detail))
+    except DatabaseError as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Beklenmeyen bir hata oluştu: {str(e)}")
+
+@router.get("/activities/nearby", response_model=List[NearbyActivitySchema])
+async def get_nearby_activities(
+    response: Response,
+    lat: float = Query(..., ge=-90, le=90),
+    lng: float = Query(..., ge=-180, le=180),
+    radius_km: float = Query(10, gt=0, le=50),
+    upcoming: bool = True,
+    after: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=100)
+):
+    """
+    Konuma en yakın aktiviteleri uzaklığa göre sıralı getirir (yalnızca koordinatı olan aktiviteler).
+    Bir sonraki sayfanın imleci X-Next-Cursor başlığında döner; after parametresi olarak gönderilir.
+    """
+    try:
+        nearby = db.get_nearby_activities(lat, lng, radius_km * 1000, upcoming, after, limit)
+        if nearby["next_cursor"]:
+            response.headers["X-Next-Cursor"] = nearby["next_cursor"]
+        return [_isoformat_dates(activity) for activity in nearby["activities"]]
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=str(e.detail))
     except DatabaseError as e:
         raise HTTPException(status_code=500, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Beklenmeyen bir hata oluştu: {str(e)}")
 
 @router.get("/activities/{activity_id}", response_model=ActivityResponseSchema)
-async def get_activity(activity_id: str):
+async def get_activity(activity_id: str, request: Request, response: Response):
     try:
         activity = db.get_activity_by_id(activity_id)
         if not activity:
             raise NotFoundError("Aktivite bulunamadı")
+        
+        etag = make_etag("activity", activity_id, activity.get("version", 0))
+        last_modified = _last_modified([activity])
+        if is_not_modified(request, etag, last_modified):
+            return not_modified(etag, last_modified)
+        set_cache_headers(response, etag, last_modified)
             
         # Tarih alanlarını kontrol et ve dönüştür
-        if "created_at" in activity:
-            if isinstance(activity["created_at"], datetime):
-                activity["created_at"] = activity["created_at"].isoformat()
-        if "activity_date" in activity:
-            if isinstance(activity["activity_date"], datetime):
-                activity["activity_date"] = activity["activity_date"].isoformat()
-            
-        return activity
+        return _isoformat_dates(activity)
     except NotFoundError as e:
         raise HTTPException(status_code=404, detail=str(e))
     except DatabaseError as e:
@@ -99,9 +174,27 @@ async def create_activity(
                 detail="Maksimum katılımcı sayısı en az 1 olmalıdır"
             )
         
+        # Koordinatlar birlikte verilmeli
+        if (activity_data["latitude"] is None) != (activity_data["longitude"] is None):
+            raise HTTPException(
+                status_code=400,
+                detail="Enlem ve boylam birlikte verilmelidir"
+            )
+        
         # Aktiviteyi veritabanına ekle
         db.insert_activity(activity_data)
         
+        # Yakın tarihli aktivitenin hatırlatmasını hemen planla
+        scheduler = get_scheduler()
+        if scheduler:
+            scheduler.on_activity_changed(activity_data["activity_id"], activity_data["activity_at"])
+        
+        # Katılımcılar arasındaki ortak aktivite sayaçlarını güncelle (öneriler için)
+        try:
+            db.suggestion_db.on_activity_created(activity_data["participants"])
+        except DatabaseError as e:
+            logger.error("Öneri güncelleme hatası", extra={"error": str(e)})
+        
         # Eklenen aktiviteyi getir
         created_activity = db.get_activity_by_id(activity_data["activity_id"])
         if not created_activity:
@@ -114,6 +207,8 @@ async def create_activity(
         raise HTTPException(status_code=409, detail=str(e))
     except DatabaseError as e:
         raise HTTPException(status_code=500, detail=str(e))
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Beklenmeyen bir hata oluştu: {str(e)}")
 
@@ -132,7 +227,7 @@ async def update_activity(
         user_id = decoded_token["user_id"]
         
         # Mevcut aktiviteyi kontrol et
-        existing_activity = db.get_activity_by_id(activity_id)
+        existing_activity = db.get_activity_by_id(activity_id, fields=["creator_id"])
         if not existing_activity:
             raise NotFoundError("Güncellenecek aktivite bulunamadı")
             
@@ -156,15 +251,19 @@ async def update_activity(
                 detail="Maksimum katılımcı sayısı en az 1 olmalıdır"
             )
         
-        # Mevcut katılımcı sayısını kontrol et
-        if len(existing_activity["participants"]) > activity_data["max_participants"]:
+        # Koordinatlar birlikte verilmeli
+        if (activity_data["latitude"] is None) != (activity_data["longitude"] is None):
             raise HTTPException(
                 status_code=400,
-                detail="Maksimum katılımcı sayısı mevcut katılımcı sayısından az olamaz"
+                detail="Enlem ve boylam birlikte verilmelidir"
             )
         
-        # Aktiviteyi güncelle
-        db.update_activity(activity_id, activity_data)
+        # Aktiviteyi güncelle (katılımcılar join/leave ile yönetilir; kapasite kontrolü aynı işlemde yapılır)
+        db.update_activity_details(activity_id, activity_data)
+        
+        scheduler = get_scheduler()
+        if scheduler:
+            scheduler.on_activity_changed(activity_id, to_utc_datetime(activity_data["activity_date"]))
         
         # Güncellenmiş aktiviteyi getir
         updated_activity = db.get_activity_by_id(activity_id)
@@ -176,11 +275,106 @@ async def update_activity(
         raise HTTPException(status_code=401, detail=str(e))
     except NotFoundError as e:
         raise HTTPException(status_code=404, detail=str(e))
+    except CapacityError:
+        raise
     except DatabaseError as e:
         raise HTTPException(status_code=500, detail=str(e))
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Beklenmeyen bir hata oluştu: {str(e)}")
 
+def update_suggestions_after_join(user_id: str, participants: List[str]):
+    """
+    Katılımdan sonra ortak aktivite sayaçlarını günceller (arka planda çalışır)
+    """
+    try:
+        db.suggestion_db.on_activity_joined(user_id, participants)
+    except Exception as e:
+        logger.error("Öneri güncelleme hatası", extra={"user_id": user_id, "error": str(e)})
+
+def update_suggestions_after_leave(user_id: str, remaining_participants: List[str]):
+    """
+    Ayrılmadan sonra ortak aktivite sayaçlarını azaltır (arka planda çalışır)
+    """
+    try:
+        db.suggestion_db.on_activity_left(user_id, remaining_participants)
+    except Exception as e:
+        logger.error("Öneri güncelleme hatası", extra={"user_id": user_id, "error": str(e)})
+
+async def notify_participants_changed(activity: Dict[str, Any], user_id: str, action: str):
+    """
+    Katılımcı değişikliğini aktivitenin katılımcılarına (ayrılan kullanıcı dahil) WebSocket ile iletir
+    """
+    try:
+        recipients = list(activity["participants"])
+        if action == "left":
+            recipients.append(user_id)
+        await get_manager().broadcast({
+            "type": "activity_participants",
+            "activity_id": activity["activity_id"],
+            "user_id": user_id,
+            "action": action,
+            "participant_count": len(activity["participants"]),
+            "max_participants": activity["max_participants"]
+        }, recipients)
+    except Exception as e:
+        logger.error("Katılımcı bildirimi gönderilemedi", extra={"activity_id": activity["activity_id"], "error": str(e)})
+
+@router.post("/activities/{activity_id}/join")
+async def join_activity(activity_id: str, token: str = Depends(JWTBearer())):
+    """
+    Aktiviteye katıl. Kapasite doluysa 409 döner.
+    """
+    decoded_token = decode_jwt(token)
+    if not decoded_token or "user_id" not in decoded_token:
+        raise AuthenticationError("Geçersiz token")
+    user_id = decoded_token["user_id"]
+
+    # Kapasite kontrolü ve ekleme tek atomik işlemde yapılır
+    activity = db.join_activity(activity_id, user_id)
+
+    asyncio.get_running_loop().run_in_executor(
+        None, update_suggestions_after_join, user_id, activity["participants"]
+    )
+    await notify_participants_changed(activity, user_id, "joined")
+
+    return {
+        "success": True,
+        "message": "Aktiviteye katıldınız",
+        "data": {
+            "activity_id": activity_id,
+            "participant_count": len(activity["participants"]),
+            "max_participants": activity["max_participants"]
+        }
+    }
+
+@router.post("/activities/{activity_id}/leave")
+async def leave_activity(activity_id: str, token: str = Depends(JWTBearer())):
+    """
+    Aktiviteden ayrıl
+    """
+    decoded_token = decode_jwt(token)
+    if not decoded_token or "user_id" not in decoded_token:
+        raise AuthenticationError("Geçersiz token")
+    user_id = decoded_token["user_id"]
+
+    activity = db.leave_activity(activity_id, user_id)
+    asyncio.get_running_loop().run_in_executor(
+        None, update_suggestions_after_leave, user_id, activity["participants"]
+    )
+    await notify_participants_changed(activity, user_id, "left")
+
+    return {
+        "success": True,
+        "message": "Aktiviteden ayrıldınız",
+        "data": {
+            "activity_id": activity_id,
+            "participant_count": len(activity["participants"]),
+            "max_participants": activity["max_participants"]
+        }
+    }
+
 @router.delete("/activities/{activity_id}")
 async def delete_activity(
     activity_id: str,
@@ -202,6 +396,12 @@ async def delete_activity(
         # Aktiviteyi sil
         db.delete_activity(activity_id)
         
+        # Katılımcılar arasındaki ortak aktivite sayaçlarını geri al
+        try:
+            db.suggestion_db.on_activity_deleted(activity.get("participants", []))
+        except DatabaseError as e:
+            logger.error("Öneri güncelleme hatası", extra={"error": str(e)})
+        
         return {"message": "Aktivite başarıyla silindi"}
     except AuthenticationError as e:
         raise HTTPException(status_code=401, detail=str(e))
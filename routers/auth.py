@@ -72,9 +72,6 @@ async def signup(user: UserSignup):
             "email": user.email,
             "password": get_password_hash(user.password),
             "full_name": user.full_name,
-            "friends": [],
-            "sent_requests": [],
-            "received_requests": [],
             "activities": [],
             "is_deleted": False,
             "created_at": datetime.datetime.now().isoformat()
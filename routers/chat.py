@@ -1,5 +1,5 @@
-from fastapi import APIRouter, HTTPException, Depends, status, Query
-from typing import List, Optional
+from fastapi import APIRouter, HTTPException, Depends, status, Query, Request, Response
+from typing import List, Literal, Optional
 from models.chat import CreateNewChat, Chat, Message
 from Database.chat_db import ChatDatabase
 from auth.auth_bearer import JWTBearer
@@ -11,6 +11,11 @@ import jwt
 from jwt.exceptions import PyJWTError
 from Database.database import DatabaseError
 from websocket_manager import get_manager
+from logger import get_logger
+from serializer import FastJSONResponse
+from http_cache import make_etag, is_not_modified, set_cache_headers, not_modified
+
+logger = get_logger(__name__)
 
 router = APIRouter(prefix="/chat", tags=["chat"])
 
@@ -25,10 +30,55 @@ def init_chat_router(database):
     chat_db = db.chat_db
     user_db = db.user_db
 
+# Katılımcı bilgileri için kullanıcı dokümanlarından okunan alanlar
+PARTICIPANT_FIELDS = ["user_id", "full_name", "profile_picture"]
+
+def _participant_info(user: dict) -> dict:
+    return {
+        "user_id": user["user_id"],
+        "full_name": user.get("full_name", "Kullanıcı"),
+        "profile_picture": user.get("profile_picture", "/default-avatar.png")
+    }
+
+def attach_participants_info(chats: List[Chat]) -> None:
+    """
+    Chat'lerin katılımcı bilgilerini tek sorguda doldurur
+    """
+    user_ids = list({participant_id for chat in chats for participant_id in chat.participants})
+    users = {user["user_id"]: user for user in user_db.get_users_by_ids(user_ids, fields=PARTICIPANT_FIELDS)}
+    for chat in chats:
+        chat.participants_info = [
+            _participant_info(users[participant_id])
+            for participant_id in chat.participants if participant_id in users
+        ]
+
+async def require_chat_member(chat_id: str, token: str = Depends(JWTBearer())) -> str:
+    """
+    /{chat_id}/... rotalarında kullanılan bağımlılık: token'ı doğrular, kullanıcının
+    chat katılımcısı olduğunu kontrol eder ve user_id'yi döndürür
+    """
+    payload = decode_jwt(token)
+    user_id = payload.get("user_id") if payload else None
+    if not user_id:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Geçersiz token"
+        )
+
+    # Chat yoksa da 403 döner; chat'in varlığı üye olmayanlara açık edilmez
+    if not chat_db.is_member(chat_id, user_id):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Bu chat'e erişim yetkiniz yok"
+        )
+    return user_id
+
 class ChatMessagesResponse(BaseModel):
     messages: List[Message]
     last_message: Optional[Message] = None
     total_messages: int
+    next_before: Optional[str] = None  # Sonraki (daha eski) sayfa için before imleci
+    next_after_seq: Optional[int] = None  # after_seq aralığının devamı için imleç
 
 @router.post("/", response_model=Chat)
 async def create_chat(chat_data: CreateNewChat, token: str = Depends(JWTBearer())):
@@ -53,18 +103,18 @@ async def create_chat(chat_data: CreateNewChat, token: str = Depends(JWTBearer()
             )
 
         # Kullanıcıların var olduğunu kontrol et ve katılımcı bilgilerini al
+        users = {
+            user["user_id"]: user
+            for user in user_db.get_users_by_ids(chat_data.participants, fields=PARTICIPANT_FIELDS)
+        }
         participants_info = []
         for user_id_ in chat_data.participants:
-            user = user_db.get_user_by_id(user_id_)
+            user = users.get(user_id_)
             if not user:
                 raise HTTPException(status_code=404, detail=f"Kullanıcı bulunamadı: {user_id_}")
             
             # Katılımcı bilgilerini ekle
-            participants_info.append({
-                "user_id": user_id_,
-                "full_name": user.get("full_name", "Kullanıcı"),
-                "profile_picture": user.get("profile_picture", "/default-avatar.png")
-            })
+            participants_info.append(_participant_info(user))
 
         # Kullanıcının katılımcılar arasında olup olmadığını kontrol et
         if user_id not in chat_data.participants:
@@ -73,15 +123,15 @@ async def create_chat(chat_data: CreateNewChat, token: str = Depends(JWTBearer()
                 detail="Kullanıcı katılımcılar arasında değil"
             )
 
-        # Chat'i oluştur
-        chat = chat_db.create_chat(chat_data)
+        # Chat'i oluştur; birebir sohbet zaten varsa mevcut chat döner
+        chat, created = chat_db.create_chat(chat_data)
         
         # Katılımcı bilgilerini ekle
         chat.participants_info = participants_info
         
-        # Diğer katılımcılara WebSocket üzerinden bildirim gönder
+        # Diğer katılımcılara WebSocket üzerinden bildirim gönder (yalnızca yeni chat'lerde)
         manager = get_manager()
-        if manager:
+        if manager and created:
             await manager.notify_chat_participants(chat, user_id)
         
         return chat
@@ -100,12 +150,9 @@ async def get_user_chats(token: str = Depends(JWTBearer())):
     Kullanıcının tüm chat'lerini getir
     """
     try:
-        print(f"\n=== get_user_chats endpoint başladı ===")
-        
         # Token'ı doğrula ve payload'ı al
         payload = decode_jwt(token)
         if not payload:
-            print("Geçersiz token")
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Geçersiz token"
@@ -114,77 +161,45 @@ async def get_user_chats(token: str = Depends(JWTBearer())):
         # Token'dan user_id'yi al
         user_id = payload.get("user_id")
         if not user_id:
-            print("Token'da user_id yok")
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Geçersiz token"
             )
 
-        print(f"Kullanıcı ID: {user_id}")
-
         # Chat'leri getir
         chats = chat_db.get_user_chats(user_id)
-        print(f"Chat sayısı: {len(chats) if chats else 0}")
         
         if not chats:
-            print("Chat bulunamadı")
             return []
         
-        # Her chat için katılımcı bilgilerini getir
-        for chat in chats:
-            print(f"\nChat ID: {chat.chat_id}")
-            print(f"Katılımcılar: {chat.participants}")
-            
-            # Katılımcı bilgilerini al
-            participants_info = []
-            for participant_id in chat.participants:
-                user = user_db.get_user_by_id(participant_id)
-                if user:
-                    print(f"Katılımcı bulundu: {participant_id}")
-                    participants_info.append({
-                        "user_id": participant_id,
-                        "full_name": user.get("full_name", "Kullanıcı"),
-                        "profile_picture": user.get("profile_picture", "/default-avatar.png")
-                    })
-                else:
-                    print(f"Katılımcı bulunamadı: {participant_id}")
-            chat.participants_info = participants_info
-            
-            # Son mesajı kontrol et ve dönüştür
-            if chat.last_message:
-                print(f"Son mesaj: {chat.last_message.dict()}")
-            else:
-                print("Son mesaj yok")
+        # Tüm chat'lerin katılımcı bilgilerini tek sorguda getir
+        attach_participants_info(chats)
         
-        print("=== get_user_chats endpoint bitti ===\n")
         return chats
         
     except PyJWTError:
-        print("JWT hatası")
         raise HTTPException(status_code=401, detail="Geçersiz token")
     except DatabaseError as e:
-        print(f"Veritabanı hatası: {str(e)}")
+        logger.error("Veritabanı hatası", extra={"error": str(e)})
         raise HTTPException(status_code=500, detail=str(e))
     except Exception as e:
-        print(f"Beklenmeyen hata: {str(e)}")
-        print(f"Hata tipi: {type(e)}")
-        import traceback
-        print(f"Stack trace: {traceback.format_exc()}")
+        logger.exception("Chat listesi getirilirken beklenmeyen hata")
         raise HTTPException(status_code=500, detail="Could not retrieve chat list")
 
 @router.get("/with-recent-messages", response_model=List[Chat])
-async def get_user_chats_with_recent_messages(token: str = Depends(JWTBearer())):
+async def get_user_chats_with_recent_messages(
+    response_format: Literal["full", "compact"] = Query("full", alias="format"),
+    token: str = Depends(JWTBearer())
+):
     """
     Kullanıcının tüm sohbetlerini getirir.
     Son 5 sohbetin son 30 mesajını da içerir.
+    format=compact ile tekrarlanan alanlar ve boş diziler atlanır.
     """
     try:
-        print(f"\n=== get_user_chats_with_recent_messages endpoint başladı ===")
-        
         # Token'ı doğrula ve payload'ı al
         payload = decode_jwt(token)
         if not payload:
-            print("Geçersiz token")
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Geçersiz token"
@@ -193,153 +208,129 @@ async def get_user_chats_with_recent_messages(token: str = Depends(JWTBearer()))
         # Token'dan user_id'yi al
         user_id = payload.get("user_id")
         if not user_id:
-            print("Token'da user_id yok")
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Geçersiz token"
             )
 
-        print(f"Kullanıcı ID: {user_id}")
-
         # Chat'leri ve son mesajlarını getir
         
         chats = chat_db.get_user_chats_with_recent_messages(user_id)
-        print(f"Chat sayısı: {len(chats) if chats else 0}")
         
         if not chats:
-            print("Chat bulunamadı")
             return []
         
-        # Her chat için katılımcı bilgilerini getir
-        for chat in chats:
-            print(f"\nChat ID: {chat.chat_id}")
-            print(f"Katılımcılar: {chat.participants}")
-            
-            # Katılımcı bilgilerini al
-            participants_info = []
-            for participant_id in chat.participants:
-                user = user_db.get_user_by_id(participant_id)
-                if user:
-                    print(f"Katılımcı bulundu: {participant_id}")
-                    participants_info.append({
-                        "user_id": participant_id,
-                        "full_name": user.get("full_name", "Kullanıcı"),
-                        "profile_picture": user.get("profile_picture", "/default-avatar.png")
-                    })
-                else:
-                    print(f"Katılımcı bulunamadı: {participant_id}")
-            chat.participants_info = participants_info
+        # Tüm chat'lerin katılımcı bilgilerini tek sorguda getir
+        attach_participants_info(chats)
+
+        if response_format == "compact":
+            return FastJSONResponse([chat.compact_dict() for chat in chats])
         
-        print("=== get_user_chats_with_recent_messages endpoint bitti ===\n")
         return chats
         
     except PyJWTError:
-        print("JWT hatası")
         raise HTTPException(status_code=401, detail="Geçersiz token")
     except DatabaseError as e:
-        print(f"Veritabanı hatası: {str(e)}")
+        logger.error("Veritabanı hatası", extra={"error": str(e)})
         raise HTTPException(status_code=500, detail=str(e))
     except Exception as e:
-        print(f"Beklenmeyen hata: {str(e)}")
-        print(f"Hata tipi: {type(e)}")
-        import traceback
-        print(f"Stack trace: {traceback.format_exc()}")
+        logger.exception("Chat listesi getirilirken beklenmeyen hata")
         raise HTTPException(status_code=500, detail="Could not retrieve chat list")
 
 @router.get("/{chat_id}/messages", response_model=ChatMessagesResponse)
 async def get_chat_messages(
     chat_id: str,
+    request: Request,
+    response: Response,
     page: int = Query(1, ge=1),
     page_size: int = Query(20, ge=1, le=100),
-    token: str = Depends(JWTBearer())
+    before: Optional[str] = Query(None, description="Bu message_id'den eski mesajları getir (imleçli sayfalama)"),
+    after_seq: Optional[int] = Query(None, ge=0, description="Bu sıra numarasından sonraki mesajları eskiden yeniye getir"),
+    response_format: Literal["full", "compact"] = Query("full", alias="format"),
+    user_id: str = Depends(require_chat_member)
 ):
     """
-    Belirli bir chat'in mesajlarını getir
+    Belirli bir chat'in mesajlarını getir.
+    format=compact ile tekrarlanan alanlar ve boş diziler atlanır.
     """
     try:
-        # Token'ı doğrula ve payload'ı al
-        payload = decode_jwt(token)
-        if not payload:
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Geçersiz token"
-            )
-
-        # Token'dan user_id'yi al
-        user_id = payload.get("user_id")
-        if not user_id:
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Geçersiz token"
-            )
-
-        # Chat'in var olduğunu kontrol et
-        chat = chat_db.get_chat_by_id(chat_id)
+        # Üyelik require_chat_member ile kontrol edildi; ETag için yalnızca sürüm okunur
+        chat = chat_db.get_chat_by_id(chat_id, fields=["version"])
         if not chat:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="Chat bulunamadı"
             )
 
-        # Kullanıcının chat'e erişim yetkisi var mı kontrol et
-        if user_id not in chat.participants:
-            raise HTTPException(
-                status_code=status.HTTP_403_FORBIDDEN,
-                detail="Bu chat'e erişim yetkiniz yok"
-            )
+        # Chat sürümü değişmediyse mesajları hiç okumadan 304 dön
+        etag = make_etag("chat_messages", chat_id, chat.version, page, page_size, before, after_seq, response_format)
+        if is_not_modified(request, etag):
+            return not_modified(etag)
+        set_cache_headers(response, etag)
 
         # Mesajları getir
-        messages_data = chat_db.get_chat_messages(chat_id, page, page_size)
+        messages_data = chat_db.get_chat_messages(chat_id, page, page_size, before=before, after_seq=after_seq)
+
+        if response_format == "compact":
+            # Son mesaj zaten listede olduğundan ayrıca gönderilmez
+            compact_response = FastJSONResponse({
+                "messages": [msg.compact_dict(include_chat_id=False) for msg in messages_data["messages"]],
+                "total_messages": messages_data["pagination"]["total_messages"],
+                "next_before": messages_data["pagination"]["next_before"],
+                "next_after_seq": messages_data["pagination"]["next_after_seq"]
+            })
+            set_cache_headers(compact_response, etag)
+            return compact_response
         
         # Son mesajı al
         last_message = None
         if messages_data["messages"]:
-            last_message = messages_data["messages"][0]  # En son mesaj ilk sırada
+            # En son mesaj ilk sırada; after_seq aralığında ise son sırada
+            last_message = messages_data["messages"][-1 if after_seq is not None else 0]
             
         return {
             "messages": messages_data["messages"],
             "last_message": last_message,
-            "total_messages": messages_data["pagination"]["total_messages"]
+            "total_messages": messages_data["pagination"]["total_messages"],
+            "next_before": messages_data["pagination"]["next_before"],
+            "next_after_seq": messages_data["pagination"]["next_after_seq"]
         }
 
     except HTTPException:
         raise
     except Exception as e:
-        print(f"Mesajlar getirilirken hata: {str(e)}")
+        logger.exception("Mesajlar getirilirken hata", extra={"chat_id": chat_id})
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Mesajlar getirilirken bir hata oluştu: {str(e)}"
         )
 
+async def _broadcast_message_change(chat_id: str, user_id: str, event: dict) -> None:
+    """
+    Mesaj silme/düzenleme olaylarını chat'in diğer katılımcılarına iletir
+    """
+    try:
+        chat = chat_db.get_chat_by_id(chat_id, fields=["participants"])
+        if chat:
+            await get_manager().broadcast(event, chat.participants, exclude_user_id=user_id)
+    except Exception as e:
+        # Değişiklik kaydedildi; istemciler yeniden bağlanınca senkronize olur
+        logger.error("Mesaj değişikliği yayınlanamadı", extra={"chat_id": chat_id, "error": str(e)})
+
 @router.delete("/{chat_id}/messages/{message_id}")
-async def delete_message(chat_id: str, message_id: str, token: str = Depends(JWTBearer())):
+async def delete_message(chat_id: str, message_id: str, user_id: str = Depends(require_chat_member)):
     """
     Mesajı sil
     """
     try:
-        # Token'ı doğrula ve payload'ı al
-        payload = decode_jwt(token)
-        if not payload:
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Geçersiz token"
-            )
-
-        # Token'dan user_id'yi al
-        user_id = payload.get("user_id")
-        if not user_id:
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Geçersiz token"
-            )
-
-        # Mesajı sil
-        success = chat_db.delete_message(chat_id, message_id, user_id)
-        if not success:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="Mesaj bulunamadı veya silme yetkiniz yok"
-            )
+        # Mesajı sil; yoksa 404, başkasına aitse 403
+        deleted = chat_db.delete_message(chat_id, message_id, user_id)
+        await _broadcast_message_change(chat_id, user_id, {
+            "type": "message_deleted",
+            "chat_id": chat_id,
+            "message_id": message_id,
+            "deleted_at": deleted.get("deleted_at")
+        })
 
         return {"message": "Mesaj başarıyla silindi"}
 
@@ -352,34 +343,18 @@ async def delete_message(chat_id: str, message_id: str, token: str = Depends(JWT
         )
 
 @router.put("/{chat_id}/messages/{message_id}")
-async def edit_message(chat_id: str, message_id: str, content: str, token: str = Depends(JWTBearer())):
+async def edit_message(chat_id: str, message_id: str, content: str, user_id: str = Depends(require_chat_member)):
     """
     Mesajı düzenle
     """
     try:
-        # Token'ı doğrula ve payload'ı al
-        payload = decode_jwt(token)
-        if not payload:
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Geçersiz token"
-            )
-
-        # Token'dan user_id'yi al
-        user_id = payload.get("user_id")
-        if not user_id:
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Geçersiz token"
-            )
-
-        # Mesajı düzenle
-        success = chat_db.edit_message(chat_id, message_id, user_id, content)
-        if not success:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="Mesaj bulunamadı veya düzenleme yetkiniz yok"
-            )
+        # Mesajı düzenle; yoksa 404, başkasına aitse 403
+        edited = chat_db.edit_message(chat_id, message_id, user_id, content)
+        await _broadcast_message_change(chat_id, user_id, {
+            "type": "message_edited",
+            "chat_id": chat_id,
+            "message": Message.from_db(edited).dict()
+        })
 
         return {"message": "Mesaj başarıyla düzenlendi"}
 
@@ -391,28 +366,38 @@ async def edit_message(chat_id: str, message_id: str, content: str, token: str =
             detail=f"Mesaj düzenlenirken bir hata oluştu: {str(e)}"
         )
 
-@router.put("/{chat_id}/messages/{message_id}/read")
-async def mark_message_as_read(chat_id: str, message_id: str, token: str = Depends(JWTBearer())):
+@router.get("/{chat_id}/messages/{message_id}/history")
+async def get_message_history(
+    chat_id: str,
+    message_id: str,
+    limit: int = Query(50, ge=1, le=100),
+    before: Optional[str] = Query(None, description="Bu edit_id'den eski düzenlemeleri getir"),
+    user_id: str = Depends(require_chat_member)
+):
     """
-    Mesajı okundu olarak işaretle
+    Mesajın düzenleme geçmişini yeniden eskiye getir
     """
     try:
-        # Token'ı doğrula ve payload'ı al
-        payload = decode_jwt(token)
-        if not payload:
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Geçersiz token"
-            )
+        edits = chat_db.get_message_history(chat_id, message_id, limit=limit, before=before)
+        return {
+            "edits": edits,
+            "next_before": edits[-1]["edit_id"] if len(edits) == limit else None
+        }
 
-        # Token'dan user_id'yi al
-        user_id = payload.get("user_id")
-        if not user_id:
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Geçersiz token"
-            )
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Mesaj geçmişi getirilirken bir hata oluştu: {str(e)}"
+        )
 
+@router.put("/{chat_id}/messages/{message_id}/read")
+async def mark_message_as_read(chat_id: str, message_id: str, user_id: str = Depends(require_chat_member)):
+    """
+    Mesajı okundu olarak işaretle
+    """
+    try:
         # Mesajı okundu olarak işaretle
         success = chat_db.mark_message_as_read(chat_id, message_id, user_id)
         if not success:
@@ -1,5 +1,5 @@
 import Database.database as database
-from fastapi import APIRouter, Body, Depends, HTTPException, status
+from fastapi import APIRouter, Body, Depends, HTTPException, Query, Request, Response, status
 from auth.auth_bearer import JWTBearer
 from auth.auth import sign_jwt, decode_jwt
 from models.model import PostSchema, UserSchema, UserLoginSchema
@@ -7,13 +7,31 @@ from exceptions import AuthenticationError, DatabaseError, NotFoundError, Duplic
 from pymongo.errors import DuplicateKeyError
 import uuid
 import datetime
-from utils import get_user_details
+import asyncio
+from utils import get_user_details, get_users_summary, FRIENDS_PAGE_SIZE
+from Database.friendship_db import FriendshipStatus
+from typing import Optional
+from logger import get_logger
+from http_cache import make_etag, is_not_modified, not_modified, set_cache_headers
+
+logger = get_logger(__name__)
 from websocket_manager import get_manager
+from models.notification import NotificationType
 
 router = APIRouter()
 db = database.Database()
 
 
+def update_suggestions_after_accept(user_id: str, friend_id: str):
+    """
+    Arkadaşlık kabulünden sonra öneri kümelerini günceller (arka planda çalışır)
+    """
+    try:
+        db.suggestion_db.on_friendship_added(user_id, friend_id)
+    except Exception as e:
+        logger.error("Öneri güncelleme hatası", extra={"user_id": user_id, "friend_id": friend_id, "error": str(e)})
+
+
 @router.post("/user/signup", tags=["user"])
 async def create_user(user: UserSchema = Body(..., example={
     "email": "ornek@email.com",
@@ -22,13 +40,11 @@ async def create_user(user: UserSchema = Body(..., example={
 })):
     try:
         # Kullanıcı zaten var mı kontrol et
-        existing_users = db.get_all_users()
-        for existing_user in existing_users:
-            if existing_user["email"] == user.email and not existing_user.get("is_deleted", False):
-                raise HTTPException(
-                    status_code=400,
-                    detail="Bu e-posta adresi zaten kayıtlı"
-                )
+        if db.get_user_by_email(user.email, fields=["user_id"]):
+            raise HTTPException(
+                status_code=400,
+                detail="Bu e-posta adresi zaten kayıtlı"
+            )
         
         # Kullanıcı ID'si oluştur
         user_id = f"usr_{uuid.uuid4().hex[:8]}"
@@ -36,7 +52,6 @@ async def create_user(user: UserSchema = Body(..., example={
         # Kullanıcı verisine ID'yi ekle
         user_data = user.model_dump()
         user_data["user_id"] = user_id
-        user_data["friends"] = []  # Boş arkadaş listesi ekle
         user_data["is_deleted"] = False  # Soft delete için
         
         db.insert_user(user_data)
@@ -57,11 +72,10 @@ async def create_user(user: UserSchema = Body(..., example={
 
 async def check_user(data: UserLoginSchema):
     try:
-        users = db.get_all_users()
-        for user in users:
-            if user["email"] == data.email and user["password"] == data.password:
-                # Eğer user_id yoksa email'i kullan
-                return user.get("user_id", user["email"])
+        user = db.get_user_by_email(data.email, fields=["user_id", "email", "password"])
+        if user and user.get("password") == data.password:
+            # Eğer user_id yoksa email'i kullan
+            return user.get("user_id", user["email"])
         return None
     except Exception as e:
         raise DatabaseError(f"Kullanıcı kontrolü sırasında hata oluştu: {str(e)}")
@@ -96,15 +110,26 @@ async def user_login(user: UserLoginSchema = Body(..., example={
         )
 
 @router.get("/users", dependencies=[Depends(JWTBearer())], tags=["users"])
-async def get_all_users():
+async def get_all_users(token: str = Depends(JWTBearer())):
     try:
-        users = db.get_all_users()
+        decoded_token = decode_jwt(token)
+        if not decoded_token:
+            raise HTTPException(
+                status_code=401,
+                detail="Geçersiz token"
+            )
+        current_user_id = decoded_token["user_id"]
+
+        users = db.get_all_users(fields=["user_id", "email", "full_name", "is_deleted"])
         if not users:
             raise HTTPException(
                 status_code=404,
                 detail="Hiç kullanıcı bulunamadı"
             )
             
+        # Mevcut kullanıcıyla ilişkileri tek sorguda al
+        relationships = db.get_relationships(current_user_id, [user["user_id"] for user in users])
+            
         # Hassas bilgileri çıkar ve silinmemiş kullanıcıları filtrele
         safe_users = []
         for user in users:
@@ -113,9 +138,7 @@ async def get_all_users():
                     "user_id": user["user_id"],
                     "email": user["email"],
                     "fullname": user.get("full_name", ""),
-                    "friends": user.get("friends", []),
-                    "sent_requests": user.get("sent_requests", []),
-                    "received_requests": user.get("received_requests", [])
+                    "relationship": relationships.get(user["user_id"])
                 })
             
         return {
@@ -164,19 +187,35 @@ async def get_my_info(token: str = Depends(JWTBearer())):
         )
 
 @router.get("/user/profile/{user_id}", dependencies=[Depends(JWTBearer())], tags=["users"])
-async def get_user_profile(user_id: str, current_user: dict = Depends(JWTBearer())):
+async def get_user_profile(user_id: str, request: Request, response: Response, token: str = Depends(JWTBearer())):
     try:
-        # Kullanıcıyı bul
-        users = db.get_all_users()
-        user = None
-        for u in users:
-            if u["user_id"] == user_id and not u.get("is_deleted", False):
-                user = u
-                break
+        decoded_token = decode_jwt(token)
+        if not decoded_token:
+            raise HTTPException(
+                status_code=401,
+                detail="Geçersiz token"
+            )
+        current_user_id = decoded_token["user_id"]
+
+        # Profil ve görüntüleyen kullanıcı tek sorguda alınır; ikisinin version'ı ETag'i belirler
+        users = {
+            user["user_id"]: user
+            for user in db.get_users_by_ids(
+                list({user_id, current_user_id}), fields=["user_id", "email", "full_name", "version"]
+            )
+        }
+        user = users.get(user_id)
         
         if not user:
             raise NotFoundError("Kullanıcı bulunamadı")
         
+        # İlişki ve ortak arkadaş sayısı yalnızca iki kullanıcıdan birinin arkadaşlıkları değişince değişir
+        etag = make_etag("profile", user_id, user.get("version", 0),
+                         current_user_id, users.get(current_user_id, {}).get("version", 0))
+        if is_not_modified(request, etag):
+            return not_modified(etag)
+        set_cache_headers(response, etag)
+        
         return {
             "success": True,
             "message": "Kullanıcı profili başarıyla getirildi",
@@ -184,10 +223,12 @@ async def get_user_profile(user_id: str, current_user: dict = Depends(JWTBearer(
                 "user_id": user["user_id"],
                 "email": user["email"],
                 "full_name": user.get("full_name", ""),
-                "friends": user.get("friends", [])
+                "friend_count": db.count_friends(user_id),
+                "mutual_friend_count": db.get_mutual_friend_count(current_user_id, user_id) if current_user_id != user_id else 0,
+                "relationship": db.get_relationship(current_user_id, user_id)
             }
         }
-    except NotFoundError:
+    except HTTPException:
         raise
     except Exception as e:
         raise DatabaseError(f"Kullanıcı profili getirilirken hata oluştu: {str(e)}")
@@ -205,63 +246,33 @@ async def accept_friend_request(friend_id: str = Body(..., example="usr_12345678
             
         current_user_id = decoded_token["user_id"]
         
-        # Mevcut kullanıcıyı bul
-        current_user_data = None
-        users = db.get_all_users()
-        for user in users:
-            if user["user_id"] == current_user_id:
-                current_user_data = user
-                break
-        
-        if not current_user_data:
-            raise HTTPException(
-                status_code=404,
-                detail="Kullanıcı bulunamadı"
-            )
-        
         # Arkadaş olarak eklenecek kullanıcıyı bul
-        friend_user = None
-        for user in users:
-            if user["user_id"] == friend_id:
-                friend_user = user
-                break
-        
+        friend_user = db.get_user_by_id(friend_id, fields=["user_id", "full_name"])
         if not friend_user:
             raise HTTPException(
                 status_code=404,
                 detail="İstek gönderen kullanıcı bulunamadı"
             )
         
-        # İstek var mı kontrol et
-        if friend_id not in current_user_data.get("received_requests", []):
-            raise HTTPException(
-                status_code=404,
-                detail="Bu kullanıcıdan gelen arkadaşlık isteği bulunamadı"
-            )
-        
-        # Arkadaş listelerini oluştur/güncelle
-        if "friends" not in current_user_data:
-            current_user_data["friends"] = []
-        if "friends" not in friend_user:
-            friend_user["friends"] = []
-            
-        # Arkadaş listelerine ekle
-        current_user_data["friends"].append(friend_id)
-        friend_user["friends"].append(current_user_id)
+        # İsteği tek atomik işlemde kabul et (istek yoksa NotFoundError fırlatılır)
+        db.accept_friend_request(current_user_id, friend_id)
         
-        # İstek listelerinden çıkar
-        current_user_data["received_requests"].remove(friend_id)
-        friend_user["sent_requests"].remove(current_user_id)
+        # Öneri kümelerini yanıtı bekletmeden arka planda güncelle
+        asyncio.get_running_loop().run_in_executor(
+            None, update_suggestions_after_accept, current_user_id, friend_id
+        )
         
-        # Veritabanını güncelle
-        db.update_user(current_user_id, {
-            "friends": current_user_data["friends"],
-            "received_requests": current_user_data["received_requests"]
-        })
-        db.update_user(friend_id, {
-            "friends": friend_user["friends"],
-            "sent_requests": friend_user["sent_requests"]
-        })
+        # İsteği gönderen kullanıcıya bildirim gönder
+        current_user = db.get_user_by_id(current_user_id, fields=["full_name"])
+        await get_manager().send_notification(
+            user_id=friend_id,
+            notification_type=NotificationType.FRIEND_REQUEST_ACCEPTED,
+            data={
+                "from_user_id": current_user_id,
+                "from_user_name": current_user.get("full_name", "") if current_user else "",
+                "timestamp": datetime.datetime.now().isoformat()
+            }
+        )
         
         return {
             "success": True,
@@ -279,16 +290,55 @@ async def accept_friend_request(friend_id: str = Body(..., example="usr_12345678
             detail=f"Arkadaşlık isteği kabul edilirken hata oluştu: {str(e)}"
         )
 
+@router.post("/reject-friend-request", dependencies=[Depends(JWTBearer())], tags=["users"])
+async def reject_friend_request(friend_id: str = Body(..., example="usr_12345678"), token: str = Depends(JWTBearer())):
+    try:
+        # JWT token'ı decode et
+        decoded_token = decode_jwt(token)
+        if not decoded_token:
+            raise HTTPException(
+                status_code=401,
+                detail="Geçersiz token"
+            )
+            
+        current_user_id = decoded_token["user_id"]
+        
+        # İsteği tek atomik işlemde reddet (istek yoksa NotFoundError fırlatılır)
+        db.reject_friend_request(current_user_id, friend_id)
+        
+        return {
+            "success": True,
+            "message": "Arkadaşlık isteği reddedildi",
+            "data": {
+                "friend_id": friend_id
+            }
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Arkadaşlık isteği reddedilirken hata oluştu: {str(e)}"
+        )
+
 @router.get("/users/search", dependencies=[Depends(JWTBearer())], tags=["users"])
-async def search_users(q: str):
+async def search_users(q: str, token: str = Depends(JWTBearer())):
     try:
+        decoded_token = decode_jwt(token)
+        if not decoded_token:
+            raise HTTPException(
+                status_code=401,
+                detail="Geçersiz token"
+            )
+        current_user_id = decoded_token["user_id"]
+
         if not q or len(q.strip()) == 0:
             raise HTTPException(
                 status_code=400,
                 detail="Arama sorgusu boş olamaz"
             )
             
-        users = db.get_all_users()
+        users = db.get_all_users(fields=["user_id", "email", "full_name", "is_deleted"])
         if not users:
             raise HTTPException(
                 status_code=404,
@@ -312,12 +362,14 @@ async def search_users(q: str):
                     matched_users.append({
                         "user_id": user["user_id"],
                         "email": user["email"],
-                        "full_name": user.get("full_name", ""),
-                        "friends": user.get("friends", []),
-                        "sent_requests": user.get("sent_requests", []),
-                        "received_requests": user.get("received_requests", [])
+                        "full_name": user.get("full_name", "")
                     })
         
+        # Mevcut kullanıcıyla ilişkileri tek sorguda ekle
+        relationships = db.get_relationships(current_user_id, [user["user_id"] for user in matched_users])
+        for user in matched_users:
+            user["relationship"] = relationships.get(user["user_id"])
+        
         return {
             "success": True,
             "message": "Arama sonuçları başarıyla getirildi",
@@ -345,30 +397,26 @@ async def add_friend(friend_id: str = Body(..., example="usr_12345678"), token:
         user_id = payload["user_id"]
 
         # Kullanıcıyı kontrol et
-        user = db.get_user_by_id(user_id)
+        user = db.get_user_by_id(user_id, fields=["user_id", "full_name"])
         if not user:
             raise HTTPException(status_code=404, detail="Kullanıcı bulunamadı")
 
         # Arkadaş isteği gönderilecek kullanıcıyı kontrol et
-        friend = db.get_user_by_id(friend_id)
+        friend = db.get_user_by_id(friend_id, fields=["user_id"])
         if not friend:
             raise HTTPException(status_code=404, detail="Arkadaş isteği gönderilecek kullanıcı bulunamadı")
 
-        # Arkadaş isteği zaten gönderilmiş mi kontrol et
-        if friend_id in user.get("sent_friend_requests", []):
-            raise HTTPException(status_code=400, detail="Arkadaş isteği zaten gönderilmiş")
-
-        # Arkadaş isteği gönder
+        # Arkadaş isteği gönder (zaten gönderilmişse veya arkadaşsa DuplicateError fırlatılır)
         db.add_friend_request(user_id, friend_id)
 
         # Bildirim gönder
         await get_manager().send_notification(
             user_id=friend_id,
-            notification_type="friend_request",
+            notification_type=NotificationType.FRIEND_REQUEST,
             data={
                 "from_user_id": user_id,
                 "from_user_name": user.get("full_name", ""),
-                "timestamp": datetime.now().isoformat()
+                "timestamp": datetime.datetime.now().isoformat()
             }
         )
 
@@ -385,7 +433,16 @@ async def add_friend(friend_id: str = Body(..., example="usr_12345678"), token:
         )
 
 @router.get("/friends", dependencies=[Depends(JWTBearer())], tags=["users"])
-async def get_friends(token: str = Depends(JWTBearer())):
+async def get_friends(
+    after: Optional[str] = None,
+    limit: int = FRIENDS_PAGE_SIZE,
+    relation_status: str = Query(FriendshipStatus.FRIEND, alias="status"),
+    token: str = Depends(JWTBearer())
+):
+    """
+    Arkadaş (veya bekleyen istek) listesini imleçle sayfalı getirir.
+    Bir sonraki sayfa için dönen next_cursor değeri after parametresi olarak gönderilir.
+    """
     try:
         # JWT token'ı decode et
         decoded_token = decode_jwt(token)
@@ -397,41 +454,66 @@ async def get_friends(token: str = Depends(JWTBearer())):
             
         current_user_id = decoded_token["user_id"]
         
-        # Mevcut kullanıcıyı bul
-        current_user_data = None
-        users = db.get_all_users()
-        for user in users:
-            if user["user_id"] == current_user_id:
-                current_user_data = user
-                break
+        if relation_status not in (FriendshipStatus.FRIEND, FriendshipStatus.SENT, FriendshipStatus.RECEIVED):
+            raise HTTPException(status_code=400, detail="Geçersiz ilişki durumu")
+        limit = max(1, min(limit, 200))
         
-        if not current_user_data:
+        # Arkadaş ID'lerini sayfalı al ve detaylarını tek sorguda topla
+        friend_ids = db.get_friend_ids(current_user_id, relation_status, after, limit)
+        friends_details = get_users_summary(friend_ids, db)
+        
+        return {
+            "success": True,
+            "message": "Arkadaş listesi başarıyla getirildi",
+            "data": {
+                "friends": friends_details,
+                "total_friends": db.count_friends(current_user_id, relation_status),
+                "next_cursor": friend_ids[-1] if len(friend_ids) == limit else None
+            }
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Arkadaş listesi getirilirken hata oluştu: {str(e)}"
+        )
+
+@router.get("/friends/suggestions", dependencies=[Depends(JWTBearer())], tags=["users"])
+async def get_friend_suggestions(limit: int = 20, token: str = Depends(JWTBearer())):
+    """
+    "Tanıyor olabileceğin kişiler" listesini ortak arkadaş ve ortak aktivite
+    sayısına göre sıralı getirir
+    """
+    try:
+        decoded_token = decode_jwt(token)
+        if not decoded_token:
             raise HTTPException(
-                status_code=404,
-                detail="Kullanıcı bulunamadı"
+                status_code=401,
+                detail="Geçersiz token"
             )
+            
+        current_user_id = decoded_token["user_id"]
+        limit = max(1, min(limit, 50))
         
-        # Arkadaş listesini al
-        friends_list = current_user_data.get("friends", [])
+        suggestions = db.get_friend_suggestions(current_user_id, limit)
+        users = {user["user_id"]: user for user in get_users_summary([s["candidate_id"] for s in suggestions], db)}
         
-        # Arkadaşların detaylı bilgilerini topla
-        friends_details = []
-        for friend_id in friends_list:
-            for user in users:
-                if user["user_id"] == friend_id:
-                    friends_details.append({
-                        "user_id": user["user_id"],
-                        "full_name": user.get("full_name", ""),
-                        "email": user["email"]
-                    })
-                    break
+        data = []
+        for suggestion in suggestions:
+            user = users.get(suggestion["candidate_id"])
+            if user:
+                data.append({
+                    **user,
+                    "mutual_friend_count": suggestion.get("mutual_count", 0),
+                    "shared_activity_count": suggestion.get("shared_activities", 0)
+                })
         
         return {
             "success": True,
-            "message": "Arkadaş listesi başarıyla getirildi",
+            "message": "Arkadaş önerileri başarıyla getirildi",
             "data": {
-                "friends": friends_details,
-                "total_friends": len(friends_details)
+                "suggestions": data
             }
         }
     except HTTPException:
@@ -439,7 +521,7 @@ async def get_friends(token: str = Depends(JWTBearer())):
     except Exception as e:
         raise HTTPException(
             status_code=500,
-            detail=f"Arkadaş listesi getirilirken hata oluştu: {str(e)}"
+            detail=f"Arkadaş önerileri getirilirken hata oluştu: {str(e)}"
         )
 
 @router.delete("/user/{user_id}", dependencies=[Depends(JWTBearer())], tags=["users"])
@@ -447,7 +529,7 @@ async def soft_delete_user(user_id: str, current_user: dict = Depends(JWTBearer(
     try:
         # Mevcut kullanıcıyı bul
         current_user_data = None
-        users = db.get_all_users()
+        users = db.get_all_users(fields=["user_id", "is_deleted"])
         for user in users:
             if user["user_id"] == current_user["user_id"]:
                 current_user_data = user
@@ -487,7 +569,11 @@ async def soft_delete_user(user_id: str, current_user: dict = Depends(JWTBearer(
         raise DatabaseError(f"Kullanıcı silinirken hata oluştu: {str(e)}")
 
 @router.get("/notifications", dependencies=[Depends(JWTBearer())], tags=["users"])
-async def get_notifications(token: str = Depends(JWTBearer())):
+async def get_notifications(before: Optional[str] = None, limit: int = 20, token: str = Depends(JWTBearer())):
+    """
+    Bildirimleri yeniden eskiye sayfalı getirir.
+    Bir sonraki sayfa için dönen next_cursor değeri before parametresi olarak gönderilir.
+    """
     try:
         # Token'dan kullanıcı bilgilerini al
         payload = decode_jwt(token)
@@ -495,8 +581,8 @@ async def get_notifications(token: str = Depends(JWTBearer())):
             raise HTTPException(status_code=401, detail="Geçersiz token")
         user_id = payload["user_id"]
 
-        # TODO: Veritabanından bekleyen bildirimleri getir
-        notifications = []  # Buraya veritabanından bildirimleri getir
+        limit = max(1, min(limit, 100))
+        notifications = db.get_notifications(user_id, before, limit)
 
         return {
             "success": True,
@@ -509,4 +595,46 @@ async def get_notifications(token: str = Depends(JWTBearer())):
         raise HTTPException(
             status_code=500,
             detail=f"Bildirimler getirilirken hata oluştu: {str(e)}"
-        )
\ No newline at end of file
+        )
+
+@router.put("/notifications/read-all", dependencies=[Depends(JWTBearer())], tags=["users"])
+async def mark_all_notifications_as_read(token: str = Depends(JWTBearer())):
+    try:
+        payload = decode_jwt(token)
+        if not payload:
+            raise HTTPException(status_code=401, detail="Geçersiz token")
+
+        db.mark_notification_as_read(payload["user_id"])
+
+        return {
+            "success": True,
+            "message": "Tüm bildirimler okundu olarak işaretlendi"
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Bildirimler güncellenirken hata oluştu: {str(e)}"
+        )
+
+@router.put("/notifications/{notification_id}/read", dependencies=[Depends(JWTBearer())], tags=["users"])
+async def mark_notification_as_read(notification_id: str, token: str = Depends(JWTBearer())):
+    try:
+        payload = decode_jwt(token)
+        if not payload:
+            raise HTTPException(status_code=401, detail="Geçersiz token")
+
+        db.mark_notification_as_read(payload["user_id"], notification_id)
+
+        return {
+            "success": True,
+            "message": "Bildirim okundu olarak işaretlendi"
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Bildirim güncellenirken hata oluştu: {str(e)}"
+        )
@@ -2,7 +2,10 @@ from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Query
 from auth.auth import decode_jwt
 from websocket_manager import get_manager
 from typing import Optional
-import json
+from logger import get_logger, log_payload
+from serializer import loads
+
+logger = get_logger(__name__)
 
 router = APIRouter()
 
@@ -30,41 +33,33 @@ async def websocket_endpoint(websocket: WebSocket, token: str = Query(...)):
 
         # Bağlantıyı kabul et
         await manager.connect(websocket, user_id)
-        print(f"Yeni WebSocket bağlantısı: {user_id}")
 
         try:
             while True:
                 # Mesajı al
-                data = await websocket.receive_json()
-                print(f"Alınan mesaj: {data}")
+                data = loads(await websocket.receive_text())
+                log_payload(logger, "WebSocket mesajı alındı", data, user_id=user_id)
 
                 # Mesaj tipine göre işle
                 if data["type"] == "chat_message":
-                    print(f"Chat mesajı işleniyor: {data}")
                     await manager.handle_chat_message(websocket, data)
                 elif data["type"] == "typing":
-                    print(f"Yazıyor bildirimi işleniyor: {data}")
                     await manager.handle_typing(user_id, data)
                 elif data["type"] == "read_receipt":
-                    print(f"Okundu bildirimi işleniyor: {data}")
-                    await manager.handle_read_receipt(user_id, data)
+                    await manager.handle_read_receipt(data["chat_id"], data["message_id"], user_id)
+                elif data["type"] == "sync":
+                    await manager.handle_sync(user_id, data)
                 elif data["type"] == "friend_request":
-                    print(f"Arkadaşlık isteği işleniyor: {data}")
                     await manager.handle_friend_request(user_id, data)
                 elif data["type"] == "friend_request_response":
-                    print(f"Arkadaşlık isteği yanıtı işleniyor: {data}")
                     await manager.handle_friend_request_response(user_id, data)
 
         except WebSocketDisconnect:
-            print(f"WebSocket bağlantısı kapandı: {user_id}")
             manager.disconnect(user_id)
         except Exception as e:
-            print(f"WebSocket hatası: {str(e)}")
-            print(f"Hata tipi: {type(e)}")
-            import traceback
-            print(f"Stack trace: {traceback.format_exc()}")
+            logger.exception("WebSocket hatası", extra={"user_id": user_id})
             await websocket.close(code=1011)
 
     except Exception as e:
-        print(f"Token doğrulama hatası: {str(e)}")
+        logger.warning("Token doğrulama hatası", extra={"error": str(e)})
         await websocket.close(code=4001) 
\ No newline at end of file
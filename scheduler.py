@@ -0,0 +1,269 @@
+"""
+Aktivite yaşam döngüsü zamanlayıcısı.
+
+Yaklaşan aktiviteler için hatırlatma bildirimleri gönderir ve sona ermiş
+aktiviteleri activities_archive koleksiyonuna taşır. Olaylar zamana göre
+sıralı bir yığında (heap) tutulur; döngü yalnızca en yakın olayın zamanına
+kadar uyur, periyodik sorgu yalnızca ufuk (horizon) penceresini yenilemek
+için yapılır.
+
+Birden fazla worker çalıştığında scheduler_locks koleksiyonundaki kiralık
+kilit sayesinde yalnızca bir worker (lider) olayları işler.
+
+Ortam değişkenleri:
+    SCHEDULER_ENABLED               Varsayılan true
+    ACTIVITY_REMINDER_MINUTES       Hatırlatmanın aktiviteden kaç dakika önce gönderileceği (varsayılan 60)
+    ACTIVITY_ARCHIVE_AFTER_HOURS    Aktivite tarihinden kaç saat sonra arşivleneceği (varsayılan 24)
+    SCHEDULER_HORIZON_MINUTES       Yığına yüklenen olayların zaman penceresi (varsayılan 30)
+"""
+import asyncio
+import datetime
+import heapq
+import itertools
+import os
+import uuid
+from typing import Dict, List, Optional, Set, Tuple
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from logger import get_logger
+from models.notification import NotificationType
+
+logger = get_logger(__name__)
+
+SCHEDULER_ENABLED = os.getenv("SCHEDULER_ENABLED", "true").lower() in ("1", "true", "yes")
+ACTIVITY_REMINDER_MINUTES = int(os.getenv("ACTIVITY_REMINDER_MINUTES", "60"))
+ACTIVITY_ARCHIVE_AFTER_HOURS = int(os.getenv("ACTIVITY_ARCHIVE_AFTER_HOURS", "24"))
+SCHEDULER_HORIZON_MINUTES = int(os.getenv("SCHEDULER_HORIZON_MINUTES", "30"))
+
+# Ufuk penceresinin yenilenme ve lider kilidinin süresi (saniye)
+REFRESH_INTERVAL = 60
+LOCK_TTL = 90
+LOCK_NAME = "activity_scheduler"
+
+REMINDER = "reminder"
+ARCHIVE = "archive"
+
+
+class LeaderLease:
+    """
+    scheduler_locks koleksiyonunda süreli kilit. Birden fazla worker'dan
+    yalnızca birinin arka plan işini yürütmesini sağlar.
+    """
+
+    def __init__(self, locks, name: str, ttl: int = LOCK_TTL):
+        self.locks = locks
+        self.name = name
+        self.ttl = ttl
+        self.owner = f"{os.getpid()}_{uuid.uuid4().hex[:8]}"
+
+    def acquire(self) -> bool:
+        """
+        Kilidi alır veya süresini uzatır; kilit başka bir worker'daysa False döner
+        """
+        now = datetime.datetime.utcnow()
+        try:
+            self.locks.find_one_and_update(
+                {"_id": self.name, "$or": [{"owner": self.owner}, {"expires_at": {"$lt": now}}]},
+                {"$set": {"owner": self.owner, "expires_at": now + datetime.timedelta(seconds=self.ttl)}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+            return True
+        except DuplicateKeyError:
+            # Kilit başka bir worker'da ve süresi dolmamış
+            return False
+
+    def release(self) -> None:
+        self.locks.delete_one({"_id": self.name, "owner": self.owner})
+
+
+class ActivityScheduler:
+    def __init__(self, db):
+        self.activity_db = db.activity_db
+        self.lease = LeaderLease(db.db["scheduler_locks"], LOCK_NAME)
+        self.owner = self.lease.owner
+        self.is_leader = False
+
+        # (çalışma zamanı, sıra, tür, activity_id, activity_at)
+        self._heap: List[Tuple[datetime.datetime, int, str, str, datetime.datetime]] = []
+        self._scheduled: Set[Tuple[str, str, datetime.datetime]] = set()
+        self._counter = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._next_refresh = datetime.datetime.min
+
+        # Gecikme ölçümü: olayın planlanan zamanı ile çalıştığı zaman arasındaki fark
+        self.stats: Dict[str, float] = {"fired": 0, "last_lag_ms": 0.0, "max_lag_ms": 0.0}
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+            logger.info("Aktivite zamanlayıcısı başlatıldı", extra={"owner": self.owner})
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        if self.is_leader:
+            await self._call(self.lease.release)
+            self.is_leader = False
+        logger.info("Aktivite zamanlayıcısı durduruldu", extra=self.stats)
+
+    def schedule(self, kind: str, activity_id: str, run_at: datetime.datetime,
+                 activity_at: datetime.datetime) -> None:
+        """
+        Olayı yığına ekler; ufuk dışındaki olaylar bir sonraki yenilemede yüklenir
+        """
+        key = (kind, activity_id, activity_at)
+        if key in self._scheduled:
+            return
+        self._scheduled.add(key)
+        seq = next(self._counter)
+        heapq.heappush(self._heap, (run_at, seq, kind, activity_id, activity_at))
+        # Yeni olay en yakın olaysa döngüyü erken uyandır
+        if self._heap[0][1] == seq:
+            self._wakeup.set()
+
+    def on_activity_changed(self, activity_id: str, activity_at: datetime.datetime) -> None:
+        """
+        Oluşturulan/tarihi değişen aktivitenin hatırlatmasını pencere yenilemesini beklemeden planlar.
+        Yalnızca lider worker'da etkilidir; diğerlerindeki değişiklikler yenilemede yakalanır.
+        """
+        if not self.is_leader:
+            return
+        now = datetime.datetime.utcnow()
+        run_at = activity_at - datetime.timedelta(minutes=ACTIVITY_REMINDER_MINUTES)
+        if activity_at >= now and run_at <= now + datetime.timedelta(minutes=SCHEDULER_HORIZON_MINUTES):
+            self.schedule(REMINDER, activity_id, run_at, activity_at)
+
+    async def _call(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, lambda: func(*args, **kwargs))
+
+    async def _acquire_leadership(self) -> bool:
+        acquired = await self._call(self.lease.acquire)
+
+        if acquired != self.is_leader:
+            logger.info("Zamanlayıcı liderliği değişti", extra={"owner": self.owner, "is_leader": acquired})
+            if not acquired:
+                self._heap.clear()
+                self._scheduled.clear()
+        self.is_leader = acquired
+        return acquired
+
+    async def _refresh(self) -> None:
+        """
+        Ufuk penceresindeki hatırlatma ve arşivleme olaylarını yığına yükler.
+        Gecikmiş olaylar (ör. kesinti sonrası) hemen çalışacak şekilde eklenir.
+        """
+        now = datetime.datetime.utcnow()
+        horizon = now + datetime.timedelta(minutes=SCHEDULER_HORIZON_MINUTES)
+        reminder_offset = datetime.timedelta(minutes=ACTIVITY_REMINDER_MINUTES)
+        archive_offset = datetime.timedelta(hours=ACTIVITY_ARCHIVE_AFTER_HOURS)
+
+        reminders = await self._call(self.activity_db.get_pending_reminders, now, horizon + reminder_offset)
+        for activity in reminders:
+            activity_at = activity["activity_at"]
+            self.schedule(REMINDER, activity["activity_id"], activity_at - reminder_offset, activity_at)
+
+        archivable = await self._call(self.activity_db.get_archivable, horizon - archive_offset)
+        for activity in archivable:
+            activity_at = activity["activity_at"]
+            self.schedule(ARCHIVE, activity["activity_id"], activity_at + archive_offset, activity_at)
+
+        logger.debug("Zamanlayıcı penceresi yenilendi", extra={
+            "queued": len(self._heap), "reminders": len(reminders), "archivable": len(archivable), **self.stats
+        })
+
+    async def _fire(self, kind: str, activity_id: str, run_at: datetime.datetime,
+                    activity_at: datetime.datetime) -> None:
+        lag_ms = (datetime.datetime.utcnow() - run_at).total_seconds() * 1000
+        self.stats["fired"] += 1
+        self.stats["last_lag_ms"] = lag_ms
+        self.stats["max_lag_ms"] = max(self.stats["max_lag_ms"], lag_ms)
+
+        if kind == REMINDER:
+            activity = await self._call(self.activity_db.claim_reminder, activity_id, activity_at)
+            if activity:
+                await self._send_reminders(activity)
+        elif kind == ARCHIVE:
+            archive_before = datetime.datetime.utcnow() - datetime.timedelta(hours=ACTIVITY_ARCHIVE_AFTER_HOURS)
+            await self._call(self.activity_db.archive_activity, activity_id, archive_before)
+
+    async def _send_reminders(self, activity: dict) -> None:
+        from websocket_manager import get_manager
+        manager = get_manager()
+        for user_id in activity.get("participants", []):
+            try:
+                await manager.send_notification(
+                    user_id=user_id,
+                    notification_type=NotificationType.ACTIVITY_REMINDER,
+                    message=f"{activity.get('title', 'Aktivite')} {ACTIVITY_REMINDER_MINUTES} dakika içinde başlıyor",
+                    data={"activity_id": activity["activity_id"], "activity_date": activity.get("activity_date")}
+                )
+            except Exception as e:
+                logger.error("Hatırlatma gönderilemedi", extra={"user_id": user_id, "activity_id": activity["activity_id"], "error": str(e)})
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                now = datetime.datetime.utcnow()
+                if now >= self._next_refresh:
+                    self._next_refresh = now + datetime.timedelta(seconds=REFRESH_INTERVAL)
+                    if await self._acquire_leadership():
+                        await self._refresh()
+
+                # Zamanı gelen olayları çalıştır
+                while self.is_leader and self._heap and self._heap[0][0] <= datetime.datetime.utcnow():
+                    run_at, _, kind, activity_id, activity_at = heapq.heappop(self._heap)
+                    self._scheduled.discard((kind, activity_id, activity_at))
+                    try:
+                        await self._fire(kind, activity_id, run_at, activity_at)
+                    except Exception as e:
+                        logger.error("Zamanlanmış olay çalıştırılamadı", extra={"kind": kind, "activity_id": activity_id, "error": str(e)})
+
+                # Bir sonraki olaya veya pencere yenilemesine kadar uyu
+                wake_at = self._next_refresh
+                if self.is_leader and self._heap:
+                    wake_at = min(wake_at, self._heap[0][0])
+                timeout = max(0.0, (wake_at - datetime.datetime.utcnow()).total_seconds())
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    pass
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.exception("Zamanlayıcı döngüsü hatası")
+                await asyncio.sleep(5)
+
+
+# Global scheduler instance
+_scheduler: Optional[ActivityScheduler] = None
+
+
+def init_scheduler(db) -> Optional[ActivityScheduler]:
+    global _scheduler
+    if SCHEDULER_ENABLED and _scheduler is None:
+        _scheduler = ActivityScheduler(db)
+        _scheduler.start()
+    return _scheduler
+
+
+def get_scheduler() -> Optional[ActivityScheduler]:
+    return _scheduler
+
+
+async def shutdown_scheduler() -> None:
+    global _scheduler
+    if _scheduler is not None:
+        await _scheduler.stop()
+        _scheduler = None
@@ -0,0 +1,66 @@
+"""
+HTTP yanıtları ve WebSocket çerçeveleri için ortak JSON serileştirici.
+
+orjson kuruluysa o kullanılır; değilse standart json modülüne düşülür.
+Her iki durumda da çıktı aynı biçimdedir (UTF-8, boşluksuz ayırıcılar).
+"""
+import datetime
+import json
+from typing import Any
+
+from bson import ObjectId
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson opsiyonel
+    orjson = None
+
+
+def _default(obj: Any) -> Any:
+    """
+    Serileştiricinin doğrudan tanımadığı tipleri dönüştürür
+    """
+    if isinstance(obj, ObjectId):
+        return str(obj)
+    if isinstance(obj, (datetime.datetime, datetime.date)):
+        return obj.isoformat()
+    if hasattr(obj, "model_dump"):
+        return obj.model_dump(mode="json")
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    raise TypeError(f"JSON'a dönüştürülemeyen tip: {type(obj).__name__}")
+
+
+if orjson is not None:
+    _ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS
+
+    def dumps(obj: Any) -> bytes:
+        return orjson.dumps(obj, default=_default, option=_ORJSON_OPTIONS)
+
+    def loads(data: Any) -> Any:
+        return orjson.loads(data)
+else:
+    def dumps(obj: Any) -> bytes:
+        return json.dumps(
+            obj, default=_default, ensure_ascii=False, separators=(",", ":")
+        ).encode("utf-8")
+
+    def loads(data: Any) -> Any:
+        return json.loads(data)
+
+
+def dumps_str(obj: Any) -> str:
+    """
+    WebSocket text çerçeveleri için str döndürür
+    """
+    return dumps(obj).decode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    """
+    Uygulamanın varsayılan yanıt sınıfı; gövdeyi ortak serileştiriciyle üretir
+    """
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
@@ -1,5 +1,28 @@
 from fastapi import HTTPException
 from Database.database import Database
+from Database.friendship_db import FriendshipStatus
+from typing import List
+
+# Kullanıcı detaylarında döndürülen arkadaş/istek listelerinin sayfa boyutu
+FRIENDS_PAGE_SIZE = 50
+
+def get_users_summary(user_ids: List[str], db: Database) -> List[dict]:
+    """
+    Verilen kullanıcıların özet bilgilerini tek sorguda getirir.
+    Sonuç, user_ids sırasını korur.
+    """
+    users = {
+        user["user_id"]: user
+        for user in db.get_users_by_ids(user_ids, fields=["user_id", "full_name", "email"])
+    }
+    return [
+        {
+            "user_id": users[uid]["user_id"],
+            "full_name": users[uid].get("full_name", ""),
+            "email": users[uid]["email"]
+        }
+        for uid in user_ids if uid in users
+    ]
 
 def get_user_details(user_id: str, db: Database) -> dict:
     """
@@ -17,12 +40,7 @@ def get_user_details(user_id: str, db: Database) -> dict:
     """
     try:
         # Kullanıcıyı bul
-        user_data = None
-        users = db.get_all_users()
-        for user in users:
-            if user["user_id"] == user_id:
-                user_data = user
-                break
+        user_data = db.get_user_by_id(user_id, fields=["user_id", "email", "full_name"])
         
         if not user_data:
             raise HTTPException(
@@ -30,44 +48,10 @@ def get_user_details(user_id: str, db: Database) -> dict:
                 detail="Kullanıcı bulunamadı"
             )
             
-        # Arkadaş listesini al
-        friends_list = user_data.get("friends", [])
-        
-        # Arkadaşların detaylı bilgilerini topla
-        friends_details = []
-        for friend_id in friends_list:
-            for user in users:
-                if user["user_id"] == friend_id:
-                    friends_details.append({
-                        "user_id": user["user_id"],
-                        "full_name": user.get("full_name", ""),
-                        "email": user["email"]
-                    })
-                    break
-        
-        # Gönderilen isteklerin detaylarını topla
-        sent_requests_details = []
-        for request_id in user_data.get("sent_requests", []):
-            for user in users:
-                if user["user_id"] == request_id:
-                    sent_requests_details.append({
-                        "user_id": user["user_id"],
-                        "full_name": user.get("full_name", ""),
-                        "email": user["email"]
-                    })
-                    break
-        
-        # Alınan isteklerin detaylarını topla
-        received_requests_details = []
-        for request_id in user_data.get("received_requests", []):
-            for user in users:
-                if user["user_id"] == request_id:
-                    received_requests_details.append({
-                        "user_id": user["user_id"],
-                        "full_name": user.get("full_name", ""),
-                        "email": user["email"]
-                    })
-                    break
+        # Arkadaşlar ve bekleyen istekler kenar koleksiyonundan ilk sayfa olarak alınır
+        friends_details = get_users_summary(db.get_friend_ids(user_id, FriendshipStatus.FRIEND, limit=FRIENDS_PAGE_SIZE), db)
+        sent_requests_details = get_users_summary(db.get_friend_ids(user_id, FriendshipStatus.SENT, limit=FRIENDS_PAGE_SIZE), db)
+        received_requests_details = get_users_summary(db.get_friend_ids(user_id, FriendshipStatus.RECEIVED, limit=FRIENDS_PAGE_SIZE), db)
         
         # Kullanıcı aktivitelerini getir
         user_activities = db.get_user_activities(user_id)
@@ -77,6 +61,7 @@ def get_user_details(user_id: str, db: Database) -> dict:
             "email": user_data["email"],
             "full_name": user_data.get("full_name", ""),
             "friends": friends_details,
+            "friend_count": db.count_friends(user_id),
             "sent_requests": sent_requests_details,
             "received_requests": received_requests_details,
             "activities": user_activities
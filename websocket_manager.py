@@ -2,9 +2,25 @@ from fastapi import WebSocket
 from typing import Dict, List
 import asyncio
 from models.chat import Message, MessageContent, MessageStatus
+from models.notification import Notification, NotificationType, DEFAULT_NOTIFICATION_TITLES
 from datetime import datetime
-import json
-import uuid
+from ids import new_message_id
+from logger import get_logger, log_payload
+from serializer import dumps_str
+from cache import TTLCache
+from exceptions import DuplicateError
+
+logger = get_logger(__name__)
+
+# Yeniden bağlanma senkronizasyonu ayarları
+SYNC_BATCH_SIZE = 100  # Tek bir sync_batch çerçevesindeki en fazla mesaj
+SYNC_MAX_MESSAGES_PER_CHAT = 1000  # Bundan fazlası için istemci REST sayfalamasına döner
+SYNC_STATUS_PAGE_SIZE = 1000  # Durum değişiklikleri veritabanından bu boyutta sayfalarla okunur
+SYNC_CONCURRENCY = 32  # Aynı anda veritabanından okunan senkronizasyon sayısı
+
+# Tekrar denenen mesajlar için bellek içi tekilleştirme penceresi; pencere dışındakiler benzersiz indeksle yakalanır
+CLIENT_MESSAGE_DEDUPE_SECONDS = 300
+CLIENT_MESSAGE_ID_MAX_LENGTH = 64
 
 class ConnectionManager:
     def __init__(self, db):
@@ -12,13 +28,67 @@ class ConnectionManager:
         self.active_connections: Dict[str, WebSocket] = {}
         self.user_rooms: Dict[str, List[str]] = {}
         self.chat_db = db.chat_db
+        self.notification_db = db.notification_db
+        # Deploy sonrası toplu yeniden bağlanmalarda veritabanını korumak için sınır
+        self.sync_semaphore = asyncio.Semaphore(SYNC_CONCURRENCY)
+        # Yakın zamanda kaydedilen (chat_id, sender_id, client_message_id) -> kanonik kimlik
+        self.recent_client_messages = TTLCache(maxsize=50000, ttl=CLIENT_MESSAGE_DEDUPE_SECONDS)
 
     async def connect(self, websocket: WebSocket, user_id: str):
         # Yeni bağlantıyı kabul et ve kaydet
         await websocket.accept()
         self.active_connections[user_id] = websocket
         self.user_rooms[user_id] = []
-        print(f"Kullanıcı bağlandı: {user_id}")
+        logger.info("Kullanıcı bağlandı", extra={"user_id": user_id})
+        await self.flush_pending_notifications(user_id)
+
+    async def flush_pending_notifications(self, user_id: str):
+        """
+        Kullanıcı çevrimdışıyken biriken bildirimleri tek bir çerçevede gönder
+        """
+        try:
+            pending = self.notification_db.pop_pending(user_id)
+            if not pending:
+                return
+            try:
+                await self.active_connections[user_id].send_text(dumps_str({
+                    "type": "notifications",
+                    "notifications": pending
+                }))
+            except Exception:
+                # Gönderilemeyenler bir sonraki bağlantıda tekrar denenir
+                self.notification_db.mark_pending(user_id, [n["notification_id"] for n in pending])
+                raise
+        except Exception as e:
+            logger.error("Bekleyen bildirim gönderme hatası", extra={"user_id": user_id, "error": str(e)})
+
+    async def send_notification(self, user_id: str, notification_type: str, data: dict = None,
+                                title: str = None, message: str = ""):
+        """
+        Bildirimi kalıcı olarak kaydet; kullanıcı çevrimiçiyse hemen gönder.
+        Çevrimdışı kullanıcılara bildirim bir sonraki bağlantıda toplu olarak iletilir.
+        """
+        online = user_id in self.active_connections
+        notification = Notification(
+            user_id=user_id,
+            type=notification_type,
+            title=title or DEFAULT_NOTIFICATION_TITLES.get(notification_type, "Bildirim"),
+            message=message,
+            data=data,
+            delivered=online
+        ).model_dump()
+        self.notification_db.add_notification(notification)
+
+        if online:
+            try:
+                await self.active_connections[user_id].send_text(dumps_str({
+                    "type": "notification",
+                    "notification": notification
+                }))
+            except Exception as e:
+                logger.error("Bildirim gönderme hatası", extra={"user_id": user_id, "error": str(e)})
+                self.notification_db.mark_pending(user_id, [notification["notification_id"]])
+        return notification
 
     def disconnect(self, user_id: str):
         # Bağlantıyı kaldır
@@ -26,13 +96,33 @@ class ConnectionManager:
             del self.active_connections[user_id]
         if user_id in self.user_rooms:
             del self.user_rooms[user_id]
-        print(f"Kullanıcı ayrıldı: {user_id}")
+        logger.info("Kullanıcı ayrıldı", extra={"user_id": user_id})
 
     async def send_personal_message(self, message: dict, user_id: str):
         # Belirli bir kullanıcıya mesaj gönder
         if user_id in self.active_connections:
-            await self.active_connections[user_id].send_json(message)
-            print(f"Kişisel mesaj gönderildi: {message}")
+            await self.active_connections[user_id].send_text(dumps_str(message))
+            log_payload(logger, "Kişisel mesaj gönderildi", message, user_id=user_id)
+
+    async def broadcast(self, message: dict, user_ids: List[str], exclude_user_id: str = None):
+        """
+        Aynı mesajı birden fazla kullanıcıya gönder; mesaj yalnızca bir kez serileştirilir
+        """
+        frame = None
+        for user_id in user_ids:
+            if user_id == exclude_user_id:
+                continue
+            websocket = self.active_connections.get(user_id)
+            if websocket is None:
+                continue
+            if frame is None:
+                frame = dumps_str(message)
+            try:
+                await websocket.send_text(frame)
+            except Exception as e:
+                logger.error("Yayın mesajı gönderilemedi", extra={"user_id": user_id, "error": str(e)})
+        if frame is not None:
+            log_payload(logger, "Yayın mesajı gönderildi", message, user_ids=user_ids)
 
     
     async def handle_read_receipt(self, chat_id: str, message_id: str, user_id: str):
@@ -40,16 +130,14 @@ class ConnectionManager:
         Okundu bilgisini işle
         """
         # 1. Okundu bilgisini hemen gönder
-        chat = self.chat_db.get_chat_by_id(chat_id)
+        chat = self.chat_db.get_chat_by_id(chat_id, fields=["participants"])
         if chat:
-            for participant_id in chat.participants:
-                if participant_id != user_id:
-                    await self.send_personal_message({
-                        "type": "read",
-                        "chat_id": chat_id,
-                        "message_id": message_id,
-                        "user_id": user_id
-                    }, participant_id)
+            await self.broadcast({
+                "type": "read",
+                "chat_id": chat_id,
+                "message_id": message_id,
+                "user_id": user_id
+            }, chat.participants, exclude_user_id=user_id)
 
         # 2. Veritabanı işlemlerini arka planda yap
         asyncio.create_task(self._update_read_status(chat_id, message_id, user_id))
@@ -66,18 +154,17 @@ class ConnectionManager:
                 is_read=True
             )
         except Exception as e:
-            print(f"Okundu durumu güncelleme hatası: {str(e)}")
+            logger.error("Okundu durumu güncelleme hatası", extra={"chat_id": chat_id, "message_id": message_id, "error": str(e)})
 
     async def handle_chat_message(self, websocket: WebSocket, message: dict):
         """
         Chat mesajını işle
         """
         try:
-            print(f"\n=== handle_chat_message başladı ===")
-            print(f"Gelen mesaj: {message}")
+            log_payload(logger, "Gelen chat mesajı", message)
             
             # Mesaj içeriğini doğrula
-            if not all(k in message for k in ["chat_id", "content", "sender_id", "timestamp"]):
+            if not all(k in message for k in ["chat_id", "content", "sender_id"]):
                 raise ValueError("Geçersiz mesaj formatı")
 
             # Mesaj içeriğini düzenle
@@ -89,59 +176,79 @@ class ConnectionManager:
                     "content": content["text"]  # text mesajları için content de text olmalı
                 }
             
-            # Mesajı oluştur
+            # Tekrar denenen mesajlar yeniden saklanmaz; gönderene kanonik kimlik iletilir
+            client_message_id = message.get("client_message_id")
+            if client_message_id is not None:
+                if not isinstance(client_message_id, str) or not 0 < len(client_message_id) <= CLIENT_MESSAGE_ID_MAX_LENGTH:
+                    raise ValueError("Geçersiz client_message_id")
+                dedupe_key = (message["chat_id"], message["sender_id"], client_message_id)
+                existing = self.recent_client_messages.get(dedupe_key)
+                if existing is None:
+                    existing = self.chat_db.find_by_client_message_id(*dedupe_key)
+                if existing:
+                    await self._send_message_ack(message["sender_id"], client_message_id, existing, duplicate=True)
+                    return
+
+            # Mesajı oluştur; kimlik ve zaman damgası sunucu tarafından atanır,
+            # istemcinin gönderdiği timestamp sıralamada kullanılmaz
             new_message = {
-                "message_id": f"msg_{uuid.uuid4().hex[:8]}",
+                "message_id": new_message_id(),
                 "chat_id": message["chat_id"],
                 "sender_id": message["sender_id"],
                 "content": content,
-                "timestamp": message["timestamp"],
+                "timestamp": datetime.now().isoformat(),
                 "status": {
                     "read_by": [],
                     "delivered_to": []
                 }
             }
-
-            print(f"Oluşturulan mesaj: {new_message}")
+            if client_message_id is not None:
+                new_message["client_message_id"] = client_message_id
 
             # Mesajı veritabanına kaydet
-            success = self.chat_db.save_message(new_message)
-            if not success:
+            try:
+                seq = self.chat_db.save_message(new_message)
+            except DuplicateError:
+                # Yalnızca client_message_id anahtarı çakıştığında fırlatılır
+                if client_message_id is None:
+                    raise
+                # Başka bir bağlantıdan gelen eşzamanlı tekrar; kazanan kaydı bildir
+                existing = self.chat_db.find_by_client_message_id(*dedupe_key)
+                if not existing:
+                    # Kazanan istek kaydedemeden anahtarını bıraktı; istemci tekrar denemeli
+                    raise ValueError("Mesaj kaydedilemedi")
+                await self._send_message_ack(message["sender_id"], client_message_id, existing, duplicate=True)
+                return
+            if seq is None:
                 raise ValueError("Mesaj kaydedilemedi")
 
-            print("Mesaj veritabanına kaydedildi")
+            if client_message_id is not None:
+                canonical = {"message_id": new_message["message_id"], "seq": seq, "timestamp": new_message["timestamp"]}
+                self.recent_client_messages.set(dedupe_key, canonical)
+                await self._send_message_ack(message["sender_id"], client_message_id, canonical, duplicate=False)
 
             # Mesajı chat katılımcılarına gönder
-            chat = self.chat_db.get_chat_by_id(message["chat_id"])
+            chat = self.chat_db.get_chat_by_id(message["chat_id"], fields=["participants"])
             if chat:
-                print(f"Chat bulundu: {chat.dict()}")
-                print(f"Katılımcılar: {chat.participants}")
-                
                 # Mesajı tüm katılımcılara gönder (gönderen dahil)
-                for participant_id in chat.participants:
-                    print(f"Mesaj gönderiliyor: {participant_id}")
-                    # Mesajı JSON serileştirilebilir formata dönüştür
-                    message_to_send = {
-                        "type": "chat_message",
-                        "message": {
-                            "message_id": new_message["message_id"],
-                            "chat_id": new_message["chat_id"],
-                            "sender_id": new_message["sender_id"],
-                            "content": new_message["content"],
-                            "timestamp": new_message["timestamp"],
-                            "status": new_message["status"]
-                        }
+                await self.broadcast({
+                    "type": "chat_message",
+                    "message": {
+                        "message_id": new_message["message_id"],
+                        "chat_id": new_message["chat_id"],
+                        "sender_id": new_message["sender_id"],
+                        "content": new_message["content"],
+                        "timestamp": new_message["timestamp"],
+                        "status": new_message["status"],
+                        "seq": seq,
+                        "client_message_id": client_message_id
                     }
-                    await self.send_personal_message(message_to_send, participant_id)
-                    print(f"Mesaj gönderildi: {participant_id}")
+                }, chat.participants)
 
-            print("=== handle_chat_message bitti ===\n")
+            logger.debug("Chat mesajı işlendi", extra={"chat_id": new_message["chat_id"], "message_id": new_message["message_id"]})
 
         except Exception as e:
-            print(f"Mesaj işleme hatası: {str(e)}")
-            print(f"Hata tipi: {type(e)}")
-            import traceback
-            print(f"Stack trace: {traceback.format_exc()}")
+            logger.exception("Mesaj işleme hatası", extra={"chat_id": message.get("chat_id")})
             
             # Hata mesajını gönderene bildir
             await self.send_personal_message(
@@ -153,25 +260,123 @@ class ConnectionManager:
                 message["sender_id"]
             )
 
+    async def _send_message_ack(self, user_id: str, client_message_id: str, canonical: dict, duplicate: bool):
+        await self.send_personal_message({
+            "type": "message_ack",
+            "client_message_id": client_message_id,
+            "message_id": canonical["message_id"],
+            "seq": canonical.get("seq"),
+            "timestamp": canonical.get("timestamp"),
+            "duplicate": duplicate
+        }, user_id)
+
+    async def handle_sync(self, user_id: str, data: dict):
+        """
+        Yeniden bağlanan istemciye yalnızca kaçırdığı mesajları ve durum değişikliklerini gönder.
+
+        İstemci mesajı:
+            {"type": "sync", "cursors": {chat_id: son görülen seq (veya eski istemciler için message_id)}, "since": önceki sync_token}
+
+        Sunucu yanıtları:
+            {"type": "sync_batch", "chat_id", "messages": [...], "has_more"}
+            {"type": "status_delta", "updates": [{"chat_id", "message_id", "status"}]}
+            {"type": "sync_complete", "sync_token"}
+        """
+        try:
+            cursors = data.get("cursors") or {}
+            since = data.get("since")
+            loop = asyncio.get_running_loop()
+
+            async with self.sync_semaphore:
+                # Token sorgulardan önce alınır; bu sırada gelen değişiklikler bir sonraki senkronizasyonda tekrar gönderilir
+                sync_token = datetime.now().isoformat()
+                chats = await loop.run_in_executor(None, self.chat_db.get_user_chat_cursors, user_id)
+
+                for chat in chats:
+                    chat_id = chat["chat_id"]
+                    cursor = cursors.get(chat_id)
+                    by_seq = isinstance(cursor, int)
+                    # İstemci son seq'i zaten görmüşse chat atlanır
+                    if by_seq and cursor >= chat.get("last_seq", 0):
+                        continue
+                    # Eski (message_id) imleçlerde son senkronizasyondan beri güncellenmeyen chat'ler atlanır;
+                    # seq imleçlerinde karar yalnızca sayaçtan okunan last_seq ile verilir
+                    if not by_seq and since and cursor and chat.get("updated_at", "") <= since:
+                        continue
+
+                    sent = 0
+                    while sent < SYNC_MAX_MESSAGES_PER_CHAT:
+                        if by_seq:
+                            batch = await loop.run_in_executor(
+                                None, self.chat_db.get_messages_after_seq, chat_id, cursor, SYNC_BATCH_SIZE
+                            )
+                        else:
+                            batch = await loop.run_in_executor(
+                                None, self.chat_db.get_messages_since, chat_id, cursor, SYNC_BATCH_SIZE
+                            )
+                        if not batch:
+                            break
+                        sent += len(batch)
+                        # İmleci bilinmeyen chat'ler için yalnızca en son sayfa gönderilir
+                        has_more = len(batch) == SYNC_BATCH_SIZE and (cursor is None or sent >= SYNC_MAX_MESSAGES_PER_CHAT)
+                        await self.send_personal_message({
+                            "type": "sync_batch",
+                            "chat_id": chat_id,
+                            "messages": batch,
+                            "has_more": has_more
+                        }, user_id)
+                        if cursor is None or len(batch) < SYNC_BATCH_SIZE:
+                            break
+                        cursor = batch[-1]["seq"] if by_seq else batch[-1]["message_id"]
+
+                if since and chats:
+                    # Durum değişiklikleri tükenene kadar sayfalanır; sync_token hiçbirini atlamaz
+                    chat_ids = [c["chat_id"] for c in chats]
+                    after = None
+                    while True:
+                        updates = await loop.run_in_executor(
+                            None, self.chat_db.get_status_updates_since, chat_ids, since, after, SYNC_STATUS_PAGE_SIZE
+                        )
+                        for i in range(0, len(updates), SYNC_BATCH_SIZE):
+                            await self.send_personal_message({
+                                "type": "status_delta",
+                                "updates": updates[i:i + SYNC_BATCH_SIZE]
+                            }, user_id)
+                        if len(updates) < SYNC_STATUS_PAGE_SIZE:
+                            break
+                        after = (updates[-1]["status_updated_at"], updates[-1]["message_id"])
+
+            await self.send_personal_message({
+                "type": "sync_complete",
+                "sync_token": sync_token
+            }, user_id)
+        except Exception as e:
+            logger.exception("Senkronizasyon hatası", extra={"user_id": user_id})
+            await self.send_personal_message({
+                "type": "error",
+                "message": "Senkronizasyon başarısız",
+                "details": str(e)
+            }, user_id)
+
     async def handle_friend_request(self, user_id: str, data: dict):
         """
         Arkadaşlık isteği işle
         """
         try:
-            # Arkadaşlık isteği bildirimini gönder
-            notification = {
-                "type": "notification",
-                "notification_type": "friend_request",
-                "from_user_id": user_id,
-                "to_user_id": data["to_user_id"],
-                "timestamp": datetime.now().isoformat()
-            }
-            
-            await self.send_personal_message(notification, data["to_user_id"])
-            print(f"Arkadaşlık isteği işlendi: {notification}")
+            # Arkadaşlık isteği bildirimini kaydet ve gönder
+            await self.send_notification(
+                user_id=data["to_user_id"],
+                notification_type=NotificationType.FRIEND_REQUEST,
+                data={
+                    "from_user_id": user_id,
+                    "to_user_id": data["to_user_id"],
+                    "timestamp": datetime.now().isoformat()
+                }
+            )
+            logger.debug("Arkadaşlık isteği işlendi", extra={"user_id": user_id, "to_user_id": data["to_user_id"]})
             
         except Exception as e:
-            print(f"Arkadaşlık isteği işleme hatası: {str(e)}")
+            logger.error("Arkadaşlık isteği işleme hatası", extra={"user_id": user_id, "error": str(e)})
 
     async def handle_typing(self, user_id: str, data: dict):
         """
@@ -187,16 +392,15 @@ class ConnectionManager:
             }
             
             # Chat katılımcılarına gönder
-            chat = self.chat_db.get_chat_by_id(data["chat_id"])
+            chat = self.chat_db.get_chat_by_id(data["chat_id"], fields=["participants"])
             if chat:
-                for participant_id in chat.participants:
-                    if participant_id != user_id:  # Gönderen hariç
-                        await self.send_personal_message(typing_message, participant_id)
+                # Gönderen hariç
+                await self.broadcast(typing_message, chat.participants, exclude_user_id=user_id)
             
-            print(f"Yazıyor bildirimi işlendi: {typing_message}")
+            logger.debug("Yazıyor bildirimi işlendi", extra={"user_id": user_id, "chat_id": data["chat_id"]})
             
         except Exception as e:
-            print(f"Yazıyor bildirimi işleme hatası: {str(e)}")
+            logger.error("Yazıyor bildirimi işleme hatası", extra={"user_id": user_id, "error": str(e)})
 
     async def handle_friend_request_response(self, user_id: str, data: dict):
         """
@@ -214,33 +418,24 @@ class ConnectionManager:
             
             # İsteği gönderen kullanıcıya yanıtı gönder
             await self.send_personal_message(response, data["from_user_id"])
-            print(f"Arkadaşlık isteği yanıtı işlendi: {response}")
+            logger.debug("Arkadaşlık isteği yanıtı işlendi", extra={"user_id": user_id, "request_id": data["request_id"]})
             
         except Exception as e:
-            print(f"Arkadaşlık isteği yanıtı işleme hatası: {str(e)}")
+            logger.error("Arkadaşlık isteği yanıtı işleme hatası", extra={"user_id": user_id, "error": str(e)})
 
     async def notify_chat_participants(self, chat, exclude_user_id: str):
         """
         Yeni chat oluşturulduğunda diğer katılımcılara bildirim gönder
         """
         try:
-            # Chat'i JSON serileştirilebilir formata dönüştür
-            chat_dict = chat.dict()
-            
             # Diğer katılımcılara bildirim gönder (oluşturan kişi hariç)
-            for participant_id in chat.participants:
-                if participant_id != exclude_user_id:  # Oluşturan kişiye bildirim gönderme
-                    await self.send_personal_message({
-                        "type": "new_chat",
-                        "chat": chat_dict
-                    }, participant_id)
-                    print(f"Yeni chat bildirimi gönderildi: {participant_id}")
+            await self.broadcast({
+                "type": "new_chat",
+                "chat": chat.dict()
+            }, chat.participants, exclude_user_id=exclude_user_id)
             
         except Exception as e:
-            print(f"Yeni chat bildirimi gönderme hatası: {str(e)}")
-            print(f"Hata tipi: {type(e)}")
-            import traceback
-            print(f"Stack trace: {traceback.format_exc()}")
+            logger.exception("Yeni chat bildirimi gönderme hatası", extra={"chat_id": chat.chat_id})
 
 # Global manager instance
 _manager = None
@@ -0,0 +1,153 @@
+"""
+Kimlik üreteci (ids.py) için worker kimliği kiralama.
+
+Snowflake kimliklerinin benzersizliği her sürecin farklı bir worker kimliği
+kullanmasına bağlıdır. WORKER_ID tanımlı değilse uygulama başlarken
+worker_ids koleksiyonundan süresi dolmuş ya da hiç alınmamış bir slot
+(0-1023) kiralanır ve süre arka planda yenilenir. Yenileme başarısız olursa
+(ör. uzun bir bağlantı kesintisinden sonra slot başka bir sürece geçtiyse)
+yeni bir slot kiralanır.
+
+Ortam değişkenleri:
+    WORKER_ID   Sabit worker kimliği (0-1023); tanımlıysa kiralama yapılmaz
+"""
+import asyncio
+import datetime
+import os
+import uuid
+from typing import Optional
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from ids import MAX_WORKER_ID, configured_worker_id, hashed_worker_id, set_worker_id
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+# Kiralama süresi ve yenileme aralığı (saniye)
+LEASE_TTL = 300
+RENEW_INTERVAL = 60
+
+
+class WorkerIdLease:
+    """
+    worker_ids koleksiyonunda süreli slot. Aynı anda yalnızca bir süreç bir slotu tutar.
+    """
+
+    def __init__(self, slots, ttl: int = LEASE_TTL):
+        self.slots = slots
+        self.ttl = ttl
+        self.owner = f"{os.getpid()}_{uuid.uuid4().hex[:8]}"
+        self.worker_id: Optional[int] = None
+
+    def acquire(self) -> int:
+        """
+        Boş bir slot kiralar; tüm slotlar doluysa RuntimeError fırlatır
+        """
+        now = datetime.datetime.utcnow()
+        taken = {slot["_id"] for slot in self.slots.find({"expires_at": {"$gte": now}}, {"_id": 1})}
+        start = hashed_worker_id()
+        for offset in range(MAX_WORKER_ID + 1):
+            worker_id = (start + offset) & MAX_WORKER_ID
+            if worker_id in taken:
+                continue
+            try:
+                self.slots.find_one_and_update(
+                    {"_id": worker_id, "$or": [{"owner": self.owner}, {"expires_at": {"$lt": now}}]},
+                    {"$set": {"owner": self.owner, "expires_at": now + datetime.timedelta(seconds=self.ttl)}},
+                    upsert=True,
+                    return_document=ReturnDocument.AFTER
+                )
+            except DuplicateKeyError:
+                # Okumadan sonra başka bir süreç aldı
+                continue
+            self.worker_id = worker_id
+            return worker_id
+        raise RuntimeError("Boş worker kimliği kalmadı")
+
+    def renew(self) -> bool:
+        """
+        Kiralama süresini uzatır; slot artık bu süreçte değilse False döner
+        """
+        if self.worker_id is None:
+            return False
+        expires_at = datetime.datetime.utcnow() + datetime.timedelta(seconds=self.ttl)
+        result = self.slots.update_one(
+            {"_id": self.worker_id, "owner": self.owner},
+            {"$set": {"expires_at": expires_at}}
+        )
+        return result.matched_count == 1
+
+    def release(self) -> None:
+        if self.worker_id is not None:
+            self.slots.delete_one({"_id": self.worker_id, "owner": self.owner})
+            self.worker_id = None
+
+
+class WorkerIdKeeper:
+    def __init__(self, db):
+        self.lease = WorkerIdLease(db.db["worker_ids"])
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> int:
+        worker_id = self.lease.acquire()
+        set_worker_id(worker_id)
+        self._task = asyncio.create_task(self._run())
+        return worker_id
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self.lease.release)
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(RENEW_INTERVAL)
+            try:
+                if await loop.run_in_executor(None, self.lease.renew):
+                    continue
+                previous = self.lease.worker_id
+                worker_id = await loop.run_in_executor(None, self.lease.acquire)
+                set_worker_id(worker_id)
+                logger.warning("Worker kimliği yeniden kiralandı", extra={
+                    "previous_worker_id": previous, "worker_id": worker_id
+                })
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Worker kimliği yenileme hatası")
+
+
+# Global keeper instance
+_keeper: Optional[WorkerIdKeeper] = None
+
+
+def init_worker_id(db) -> int:
+    """
+    WORKER_ID tanımlıysa onu, değilse kiralanan slotu üretece atar ve döndürür
+    """
+    global _keeper
+    worker_id = configured_worker_id()
+    if worker_id is not None:
+        set_worker_id(worker_id)
+        return worker_id
+    if _keeper is None:
+        _keeper = WorkerIdKeeper(db)
+        return _keeper.start()
+    return _keeper.lease.worker_id
+
+
+async def shutdown_worker_id() -> None:
+    global _keeper
+    if _keeper is not None:
+        await _keeper.stop()
+        _keeper = None